@@ -67,31 +67,69 @@ class NodeAttr(Tree):
 
 		self.connectionChanged = Signal()
 
+		# owning node, attr root and role are cached against the parent
+		# they were resolved under - moves deeper in the trunk are caught
+		# by the structure signal of the attr that changed
+		self._resolvedParent = None
+		self._resolved = None #type: T.Tuple[GraphNode, NodeAttr, NodeAttr.Roles]
+		self.structureChanged.connect(self._onAttrStructureChanged)
+
 	@property
 	def desc(self):
 		return self.extras["desc"]
 
+	def _resolveTrunk(self)->T.Tuple[GraphNode, NodeAttr, NodeAttr.Roles]:
+		"""walk trunk once to find owning node, attr root and role -
+		result is cached until this attr or one of its parents moves"""
+		if self._resolved is not None and self.parent is self._resolvedParent:
+			return self._resolved
+		node = None
+		root = self
+		for i in self.trunk():
+			if isinstance(i, GraphNodeBase):
+				node = i
+				break
+			root = i
+		role = {"input" : self.Roles.Input,
+		        "output" : self.Roles.Output}.get(root.name)
+		result = (node, root, role)
+		# don't cache attrs not yet added to a node
+		if node is not None:
+			self._resolved = result
+			self._resolvedParent = self.parent
+		return result
+
+	def _clearResolved(self):
+		self._resolved = None
+		self._resolvedParent = None
+		for i in self.branches:
+			if isinstance(i, NodeAttr):
+				i._clearResolved()
+
+	def _onAttrStructureChanged(self, branch, parent=None, *args, **kwargs):
+		"""branch moved somewhere under this attr - only direct
+		parent responds, clearing moved branch and its children"""
+		if parent is not self or not isinstance(branch, NodeAttr):
+			return
+		branch._clearResolved()
+
 	@property
 	def node(self)->"GraphNode":
 		""" points to node which owns this attr
 		:rtype GraphNode"""
-		return next(filter(lambda x: isinstance(x, GraphNodeBase), self.trunk()))
+		return self._resolveTrunk()[0]
 
 	@property
 	def attrRoot(self) ->NodeAttr:
-		"""return root-level attribute"""
-		return list(filter(lambda x: isinstance(x, GraphNodeBase), self.trunk(includeSelf=True)))[-1]
+		"""return root-level attribute, directly under node"""
+		return self._resolveTrunk()[1]
 
 	def attrAddress(self)->T.List[str]:
 		return self.relAddress(fromBranch=self.node)
 
 	@property
 	def role(self)->Roles:
-		if "input" in self.attrAddress():
-			result = self.Roles.Input
-		if "output" in self.attrAddress():
-			result = self.Roles.Output
-		return result
+		return self._resolveTrunk()[2]
 
 
 	@property
@@ -102,7 +140,7 @@ class NodeAttr(Tree):
 	def connections(self)->T.Set[GraphEdge]:
 		"""edge register is maintained by Graph - this
 		only indexes into it """
-		return self.graph.attrEdgeMap[self]
+		return self.graph.attrEdges(self)
 
 
 	@property
@@ -171,7 +209,7 @@ class NodeAttr(Tree):
 			#self.log("skipping duplicate edge on attr {}".format(self.name))
 			print(( "skipping duplicate edge on attr {}".format(self.name) ))
 			return
-		if self.role == "output":
+		if self.role == self.Roles.Output:
 			self.connections.add(edge)
 		else:
 			self.connections.clear()
@@ -191,9 +229,9 @@ class NodeAttr(Tree):
 	def getConnectedAttrs(self):
 		"""returns only connected AbstractAttrs, not abstractEdges -
 		this should be the limit of what's called in normal api"""
-		if self.role == "input":
+		if self.role == self.Roles.Input:
 			return [i.sourceAttr for i in self.getConnections()]
-		elif self.role == "output":
+		elif self.role == self.Roles.Output:
 			return [i.destAttr for i in self.getConnections()]
 
 	def attrFromName(self, name):
@@ -0,0 +1 @@
+"""synthetic graph generators and timing of core graph operations"""
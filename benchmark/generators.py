@@ -0,0 +1,128 @@
+"""synthetic graph shapes for benchmarking -
+each generator returns a GraphPlan of node levels and edges between
+node indices, so that building nodes and building edges can be
+timed separately.
+
+nodes do nothing on execution, so timings measure graph overhead only
+"""
+
+from __future__ import annotations
+
+import math, random
+import typing as T
+from collections import namedtuple
+
+from treegraph.node import GraphNode
+from treegraph.graph import Graph
+
+
+class BenchNode(GraphNode):
+	"""no-op node - inputs are added as edges need them.
+	'probe' input is never connected, for legality queries"""
+
+	def defineAttrs(self):
+		self.addOutput("out")
+		self.addInput("probe")
+
+	def execute(self):
+		pass
+
+
+class BenchGraph(Graph):
+	"""graph with logging silenced, so output doesn't swamp timings"""
+
+	def log(self, message):
+		pass
+
+
+# nodeLevels : subgraph depth of each node, 0 being the root graph
+# edges : (source index, dest index) pairs - always within one level
+GraphPlan = namedtuple("GraphPlan", ("nodeLevels", "edges"))
+
+
+def chain(size:int)->GraphPlan:
+	"""a -> b -> c ..."""
+	return GraphPlan([0] * size, [(i, i + 1) for i in range(size - 1)])
+
+def fanOutIn(size:int)->GraphPlan:
+	"""one source feeding every middle node, all feeding one sink"""
+	size = max(size, 3)
+	edges = []
+	for i in range(1, size - 1):
+		edges.append((0, i))
+		edges.append((i, size - 1))
+	return GraphPlan([0] * size, edges)
+
+def randomDag(size:int, edgesPerNode=2, seed=0)->GraphPlan:
+	"""each node draws inputs from random earlier nodes"""
+	rand = random.Random(seed)
+	edges = []
+	for dest in range(1, size):
+		for source in rand.sample(range(dest), min(dest, edgesPerNode)):
+			edges.append((source, dest))
+	return GraphPlan([0] * size, edges)
+
+def nestedSubgraphs(size:int, depth=8)->GraphPlan:
+	"""subgraphs nested depth levels deep, each level holding
+	a chain of an even share of nodes"""
+	perLevel = max(1, size // depth)
+	levels = []
+	edges = []
+	for level in range(depth):
+		start = len(levels)
+		levels.extend([level] * perLevel)
+		edges.extend((i, i + 1) for i in range(start, len(levels) - 1))
+	return GraphPlan(levels, edges)
+
+def lattice(size:int)->GraphPlan:
+	"""square grid, each node feeding its right and lower neighbours"""
+	side = max(2, int(math.sqrt(size)))
+	edges = []
+	for row in range(side):
+		for column in range(side):
+			index = row * side + column
+			if column < side - 1:
+				edges.append((index, index + 1))
+			if row < side - 1:
+				edges.append((index, index + side))
+	return GraphPlan([0] * (side * side), edges)
+
+
+shapes = {
+	"chain" : chain,
+	"fanOutIn" : fanOutIn,
+	"randomDag" : randomDag,
+	"nestedSubgraphs" : nestedSubgraphs,
+	"lattice" : lattice,
+} #type: T.Dict[str, T.Callable[[int], GraphPlan]]
+
+
+BuiltGraph = namedtuple("BuiltGraph", ("nodes", "outputs", "inputs"))
+
+def buildNodes(graph:Graph, plan:GraphPlan)->BuiltGraph:
+	"""create subgraphs and nodes for plan, with one input
+	for each incoming edge"""
+	levelGraphs = [graph]
+	for level in range(1, max(plan.nodeLevels, default=0) + 1):
+		levelGraphs.append(levelGraphs[-1].addNode(
+			type(graph)(name="level{}".format(level))))
+	inDegree = [0] * len(plan.nodeLevels)
+	for source, dest in plan.edges:
+		inDegree[dest] += 1
+
+	built = BuiltGraph([], [], [])
+	for i, level in enumerate(plan.nodeLevels):
+		node = levelGraphs[level].addNode(BenchNode(name="n{}".format(i)))
+		built.nodes.append(node)
+		built.outputs.append(node.getOutput("out"))
+		built.inputs.append(
+			[node.addInput("in{}".format(n)) for n in range(inDegree[i])])
+	return built
+
+def buildEdges(built:BuiltGraph, plan:GraphPlan):
+	"""connect nodes for plan"""
+	used = [0] * len(built.nodes)
+	for source, dest in plan.edges:
+		destAttr = built.inputs[dest][used[dest]]
+		used[dest] += 1
+		built.nodes[dest].graph.addEdge(built.outputs[source], destAttr)
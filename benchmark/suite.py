@@ -0,0 +1,159 @@
+"""timing of core graph operations over generated graphs -
+results are written as json, and can be compared against a
+previous run to catch regressions
+
+run as:
+	python -m treegraph.benchmark --sizes 100 1000 --output results.json
+	python -m treegraph.benchmark --compare results.json
+"""
+
+from __future__ import annotations
+
+import argparse, json, platform, random, sys, time
+import typing as T
+from pathlib import Path
+
+from treegraph.exepath import ExecutionPath
+from treegraph.executor import ExecutionScheduler, ThreadNodeExecutor
+from treegraph.benchmark.generators import shapes, BenchGraph, \
+	buildNodes, buildEdges
+
+defaultSizes = (100, 1000, 10000, 50000)
+# queries sampled per graph, so large sizes stay tractable
+sampleCount = 200
+
+
+class Timer(object):
+	"""context manager for one timed operation"""
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.seconds = time.perf_counter() - self.start
+
+
+def runShape(shapeName:str, size:int, seed=0)->T.List[T.Dict]:
+	"""build one graph and time every operation on it"""
+	results = []
+	def record(operation, timer:Timer, count=1):
+		results.append({"shape" : shapeName, "size" : size,
+		                "operation" : operation, "count" : count,
+		                "seconds" : timer.seconds})
+
+	plan = shapes[shapeName](size)
+	graph = BenchGraph(name="bench")
+	with Timer() as t:
+		built = buildNodes(graph, plan)
+	record("addNode", t, len(built.nodes))
+	with Timer() as t:
+		buildEdges(built, plan)
+	record("addEdge", t, len(plan.edges))
+
+	rand = random.Random(seed)
+	nodes = built.nodes
+	samples = rand.sample(range(len(nodes)), min(len(nodes), sampleCount))
+
+	pairs = [(i, rand.randrange(len(nodes))) for i in samples]
+	with Timer() as t:
+		for source, dest in pairs:
+			nodes[source].graph.checkLegalConnection(
+				built.outputs[source], nodes[dest].getInput("probe"))
+	record("checkLegalConnection", t, len(pairs))
+
+	for i in set(node.graph for node in nodes):
+		i.topologyChanged()
+	with Timer() as t:
+		for i in samples:
+			nodes[i].graph.getNodesInHistory(nodes[i])
+	record("getNodesInHistory", t, len(samples))
+	with Timer() as t:
+		for i in samples:
+			nodes[i].graph.getNodesInHistory(nodes[i])
+	record("getNodesInHistory.cached", t, len(samples))
+
+	with Timer() as t:
+		graph.getIslands()
+	record("getIslands", t)
+
+	with Timer() as t:
+		path = ExecutionPath.getExecPathToAll(graph)
+	record("getExecPathToAll", t, len(path.sequence))
+
+	with Timer() as t:
+		graph.serialise()
+	record("serialise", t)
+
+	with Timer() as t:
+		for i in path.sequence:
+			i.execStage(0)
+	record("execute.serial", t, len(path.sequence))
+
+	with Timer() as t:
+		ExecutionScheduler(graph, path.sequence,
+		                   ThreadNodeExecutor(maxWorkers=4)).run()
+	record("execute.thread", t, len(path.sequence))
+	return results
+
+def runSuite(shapeNames:T.Sequence[str]=None,
+             sizes:T.Sequence[int]=defaultSizes,
+             log:T.Callable[[str], None]=print)->T.Dict:
+	"""run every shape at every size"""
+	results = []
+	for shapeName in shapeNames or shapes:
+		for size in sizes:
+			log("{} {}".format(shapeName, size))
+			results.extend(runShape(shapeName, size))
+	return {
+		"meta" : {
+			"python" : sys.version,
+			"platform" : platform.platform(),
+			"time" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+		},
+		"results" : results,
+	}
+
+def compareResults(old:T.Dict, new:T.Dict, threshold=1.25
+                   )->T.List[T.Tuple[str, float]]:
+	"""return (label, slowdown ratio) for every operation slower in new
+	than old by more than threshold"""
+	def key(entry):
+		return entry["shape"], entry["size"], entry["operation"]
+	oldTimes = {key(i) : i["seconds"] for i in old["results"]}
+	regressions = []
+	for entry in new["results"]:
+		before = oldTimes.get(key(entry))
+		if not before:
+			continue
+		ratio = entry["seconds"] / before
+		if ratio > threshold:
+			regressions.append(("{} {} {}".format(*key(entry)), ratio))
+	return sorted(regressions, key=lambda x: x[1], reverse=True)
+
+
+def main(argv:T.Sequence[str]=None)->int:
+	parser = argparse.ArgumentParser(description="treegraph benchmarks")
+	parser.add_argument("--shapes", nargs="*", choices=sorted(shapes))
+	parser.add_argument("--sizes", nargs="*", type=int,
+	                    default=list(defaultSizes))
+	parser.add_argument("--output", type=Path,
+	                    help="write results json to this path")
+	parser.add_argument("--compare", type=Path,
+	                    help="previous results json to check for regressions")
+	parser.add_argument("--threshold", type=float, default=1.25,
+	                    help="slowdown ratio counted as a regression")
+	args = parser.parse_args(argv)
+
+	data = runSuite(args.shapes, args.sizes)
+	if args.output:
+		args.output.write_text(json.dumps(data, indent=1))
+	else:
+		print(json.dumps(data, indent=1))
+
+	if args.compare:
+		regressions = compareResults(json.loads(args.compare.read_text()),
+		                             data, args.threshold)
+		for label, ratio in regressions:
+			print("REGRESSION {} : {:.2f}x slower".format(label, ratio))
+		return 1 if regressions else 0
+	return 0
@@ -0,0 +1,201 @@
+"""sidecar storage for large binary and array values -
+when graph records are written, bytes-like values and numpy arrays
+of at least blobThreshold bytes go raw into a "<file>.blobs" sidecar,
+leaving only a small reference in the record.
+
+on load those references are memory-mapped rather than read -
+arrays come back as read-only numpy memmaps, bytes as read-only
+memoryviews. nothing is paged in until it is accessed, and processes
+mapping the same file share its pages. pass blobRef(value) to a
+worker process to map a loaded value again there without copying.
+
+sidecars are written to a temp file and renamed over the old one,
+so values still mapped from an earlier load stay valid
+"""
+
+from __future__ import annotations
+
+import typing as T
+import hashlib, io, mmap, os, pickle
+from collections import namedtuple
+from pathlib import Path
+from weakref import WeakKeyDictionary
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+blobSuffix = ".blobs"
+# values smaller than this stay inline in records
+blobThreshold = 64 * 1024
+# blobs start on boundaries that mmap can use as offsets
+_alignment = mmap.ALLOCATIONGRANULARITY
+
+# { mmap : (BlobRef, inode of sidecar when mapped) }
+_mappedRefs = WeakKeyDictionary()
+
+
+def blobPath(path:T.Union[str, Path])->Path:
+	"""sidecar path for record file at path"""
+	path = Path(path)
+	return path.with_name(path.name + blobSuffix)
+
+
+def _blobView(value, threshold:int
+              )->T.Optional[T.Tuple[memoryview, object, tuple]]:
+	"""return (flat byte view, dtype, shape) if value should be
+	stored as a blob - dtype and shape are None for raw bytes"""
+	if np is not None and isinstance(value, np.ndarray):
+		if value.dtype.hasobject or value.nbytes < threshold:
+			return None
+		array = np.ascontiguousarray(value)
+		return memoryview(array).cast("B"), array.dtype, array.shape
+	if not isinstance(value, (bytes, bytearray, memoryview)):
+		return None
+	view = memoryview(value)
+	if view.nbytes < threshold:
+		return None
+	if not view.c_contiguous:
+		view = memoryview(view.tobytes())
+	return view.cast("B"), None, None
+
+
+class BlobRef(namedtuple("BlobRef",
+                         ("path", "offset", "nbytes", "dtype", "shape"))):
+	"""location of one blob in a sidecar file, cheap to pickle -
+	dtype and shape are None for raw bytes"""
+
+	def open(self):
+		"""map blob read-only, as numpy memmap or memoryview"""
+		with open(self.path, "rb") as f:
+			if self.dtype is None:
+				mapped = mmap.mmap(f.fileno(), self.nbytes, offset=self.offset,
+				                   access=mmap.ACCESS_READ)
+				value = memoryview(mapped)
+			else:
+				if np is None:
+					raise RuntimeError("numpy is needed to load array blobs")
+				value = np.memmap(f, dtype=self.dtype, mode="r",
+				                  offset=self.offset, shape=self.shape)
+				mapped = value._mmap
+			_mappedRefs[mapped] = (self, os.fstat(f.fileno()).st_ino)
+		return value
+
+
+def _mappedEntry(value)->T.Optional[T.Tuple[BlobRef, int]]:
+	"""(ref, sidecar inode) for a whole value mapped by BlobRef.open()"""
+	if isinstance(value, memoryview):
+		mapped = value.obj
+	else:
+		mapped = getattr(value, "_mmap", None)
+		if mapped is None:
+			return None
+	try:
+		entry = _mappedRefs.get(mapped)
+	except TypeError: # not weak-referenceable
+		return None
+	if entry is None or value.nbytes != entry[0].nbytes:
+		return None
+	return entry
+
+def blobRef(value)->T.Optional[BlobRef]:
+	"""return reference to a value mapped from a sidecar, or None -
+	only whole mapped values are recognised, not slices of them,
+	and not values whose sidecar has since been rewritten"""
+	entry = _mappedEntry(value)
+	if entry is None:
+		return None
+	ref, inode = entry
+	try:
+		if os.stat(ref.path).st_ino != inode:
+			return None
+	except OSError:
+		return None
+	return ref
+
+
+class BlobWriter(object):
+	"""writes blobs for one record file's sidecar - use as a
+	context manager. the sidecar is only created if some value is
+	large enough, and replaces any old one on a clean exit.
+	append adds to the existing sidecar in place, for journals"""
+
+	def __init__(self, path:T.Union[str, Path], append=False,
+	             threshold:int=None):
+		self.path = Path(path)
+		self.append = append
+		self.threshold = blobThreshold if threshold is None else threshold
+		self.count = 0
+		self._f = None #type: T.BinaryIO
+		self._offset = 0
+
+	@property
+	def _tempPath(self)->Path:
+		return self.path.with_name(self.path.name + ".tmp")
+
+	def add(self, value)->T.Optional[T.Tuple]:
+		"""write value if it should be a blob, returning
+		(offset, nbytes, dtype, shape) - otherwise return None"""
+		stored = _blobView(value, self.threshold)
+		if stored is None:
+			return None
+		view, dtype, shape = stored
+		if self._f is None:
+			if self.append:
+				self._f = open(self.path, "ab")
+				self._offset = self._f.seek(0, os.SEEK_END)
+			else:
+				self._f = open(self._tempPath, "wb")
+		padding = -self._offset % _alignment
+		self._f.write(bytes(padding))
+		offset = self._offset + padding
+		self._f.write(view)
+		self._offset = offset + view.nbytes
+		self.count += 1
+		return offset, view.nbytes, dtype, shape
+
+	def close(self, commit=True):
+		if self._f is not None:
+			self._f.close()
+		if self.append:
+			return
+		if self._f is None:
+			# nothing large any more, old sidecar is unused
+			if commit and self.path.is_file():
+				self.path.unlink()
+		elif commit:
+			os.replace(self._tempPath, self.path)
+		else:
+			self._tempPath.unlink()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, tb):
+		self.close(commit=excType is None)
+
+
+class _HashPickler(pickle.Pickler):
+	"""pickles mapped values by their location, and other
+	large values by digest, so hashing records stays cheap"""
+
+	def persistent_id(self, obj):
+		entry = _mappedEntry(obj)
+		if entry is not None:
+			ref, inode = entry
+			return ref.path, ref.offset, inode
+		stored = _blobView(obj, blobThreshold)
+		if stored is None:
+			return None
+		view, dtype, shape = stored
+		return hashlib.sha1(view).hexdigest(), str(dtype), shape
+
+
+def hashingDumps(payload)->bytes:
+	"""pickle payload for hashing - unlike pickle.dumps, this
+	handles mapped memoryviews and does not copy blob values"""
+	buffer = io.BytesIO()
+	_HashPickler(buffer, protocol=4).dump(payload)
+	return buffer.getvalue()
@@ -1,9 +1,11 @@
 
 from pathlib import Path
 import importlib, importlib.util, importlib.machinery, \
-        os, sys, pkgutil, inspect, pprint
+        os, sys, pkgutil, inspect, pprint, ast, json, traceback
 import typing as T
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from weakref import WeakSet
 
 from tree.lib.python import safeLoadModule
 from tree import Signal
@@ -38,6 +40,130 @@ def modulesInPackagePath(packagePath, includeParent=True,
 	return results
 
 
+def packageModuleFiles(packagePath:Path)->T.List[T.Tuple[str, Path]]:
+	"""return (module name, file path) for every module in
+	package tree at packagePath, parents before children -
+	names are relative to the folder containing packagePath"""
+	packagePath = Path(packagePath).resolve()
+	results = []
+	for rootPath, dirs, files in os.walk(packagePath):
+		# check if it's a valid python package
+		if not "__init__.py" in files:
+			dirs[:] = []
+			continue
+		dirs.sort()
+		rootPath = Path(rootPath)
+		packageName = ".".join(
+			rootPath.relative_to(packagePath.parent).parts)
+		results.append((packageName, rootPath / "__init__.py"))
+		for fileName in sorted(files):
+			if fileName.endswith(".py") and fileName != "__init__.py":
+				results.append((packageName + "." + fileName[:-3],
+				                rootPath / fileName))
+	return results
+
+def candidateClassNames(path:Path)->T.List[str]:
+	"""parse module source without importing it, returning names
+	at module level that may hold classes - class definitions,
+	and names assigned from calls, for classes made by type()
+	or factories"""
+	with open(path, "rb") as f:
+		tree = ast.parse(f.read(), filename=str(path))
+	names = []
+	for statement in tree.body:
+		if isinstance(statement, ast.ClassDef):
+			names.append(statement.name)
+		elif isinstance(statement, ast.Assign) and \
+				isinstance(statement.value, ast.Call):
+			names.extend(i.id for i in statement.targets
+			             if isinstance(i, ast.Name))
+	return names
+
+def loadModuleFromFile(moduleName:str, path:Path):
+	"""import module at path under moduleName, reusing it
+	if already imported from the same file"""
+	module = sys.modules.get(moduleName)
+	if module is not None and getattr(module, "__file__", None) and \
+			Path(module.__file__).resolve() == Path(path).resolve():
+		return module
+	searchLocations = [str(Path(path).parent)] \
+		if Path(path).name == "__init__.py" else None
+	spec = importlib.util.spec_from_file_location(
+		moduleName, path, submodule_search_locations=searchLocations)
+	module = importlib.util.module_from_spec(spec)
+	sys.modules[moduleName] = module
+	try:
+		spec.loader.exec_module(module)
+	except BaseException:
+		del sys.modules[moduleName]
+		raise
+	return module
+
+
+# class known from a scan manifest, not imported yet
+LazyClassEntry = namedtuple("LazyClassEntry",
+                            ("moduleName", "path", "attrName"))
+
+
+class ScanManifest(object):
+	"""cache of which classes each scanned module defines,
+	keyed by file path and checked against file mtime and size -
+	saved as json to path if given, otherwise kept in memory only"""
+
+	version = 2
+
+	def __init__(self, path:T.Union[Path, str]=None, key=""):
+		"""key identifies the scan settings - a manifest saved with
+		a different key is ignored"""
+		self.path = Path(path) if path else None
+		self.key = key
+		self.files = {} #type: T.Dict[str, T.Dict]
+		if self.path is not None and self.path.is_file():
+			try:
+				with open(self.path, "r") as f:
+					data = json.load(f)
+			except (OSError, ValueError):
+				data = {}
+			if data.get("version") == self.version and \
+					data.get("key") == self.key:
+				self.files = data.get("files", {})
+
+	@staticmethod
+	def _fileStamp(path:Path)->T.Tuple[int, int]:
+		stat = os.stat(path)
+		return stat.st_mtime_ns, stat.st_size
+
+	def classEntries(self, path:Path)->T.Optional[T.List[T.Tuple[str, str]]]:
+		"""recorded (module attribute name, class name) pairs for
+		module at path, or None if unknown or changed since recorded"""
+		entry = self.files.get(str(path))
+		if entry is None or \
+				tuple(entry["stamp"]) != self._fileStamp(path):
+			return None
+		return [tuple(i) for i in entry["classes"]]
+
+	def setClassEntries(self, path:Path, moduleName:str,
+	                    classEntries:T.List[T.Tuple[str, str]]):
+		self.files[str(path)] = {"stamp" : self._fileStamp(path),
+		                         "module" : moduleName,
+		                         "classes" : [list(i) for i in classEntries]}
+
+	def prune(self, livePaths:T.Set[str]):
+		"""drop entries of files no longer scanned"""
+		for i in set(self.files).difference(livePaths):
+			del self.files[i]
+
+	def save(self):
+		if self.path is None:
+			return
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		tempPath = self.path.with_name(self.path.name + ".tmp")
+		with open(tempPath, "w") as f:
+			json.dump({"version" : self.version, "key" : self.key,
+			           "files" : self.files}, f)
+		os.replace(tempPath, self.path)
+
+
 class ClassCatalogue(object):
 	"""object with logic for iterating over a set of packages
 	and gathering all valid classesToReload defined in them
@@ -53,10 +179,20 @@ class ClassCatalogue(object):
 	RegisterEvent = namedtuple("RegisterEvent",("newClasses",
 	                                            "newModules"))
 
-	def __init__(self, classPackagePaths:T.List[T.Union[Path, str]], baseClasses=T.Set[type]):
+	def __init__(self, classPackagePaths:T.List[T.Union[Path, str]], baseClasses=T.Set[type],
+	             manifestPath:T.Union[Path, str]=None):
+		"""manifestPath : json file caching scan results between
+		sessions - see ScanManifest"""
 		self.classModuleMap = {}
+		# { class name : class, or LazyClassEntry until first used }
+		self.classNameMap = {} #type: T.Dict[str, T.Union[type, LazyClassEntry]]
+		# { package name : __init__ path } from last scan
+		self._scannedPackages = {} #type: T.Dict[str, Path]
 		self.scanPackagePaths = list(map(Path, classPackagePaths))
 		self.scanBaseClasses = baseClasses
+		self.manifest = ScanManifest(manifestPath, key=",".join(sorted(
+			"{}.{}".format(i.__module__, i.__qualname__)
+			for i in baseClasses)))
 		self.classesChanged = Signal(name="classesRegistered")
 		self.classesReloaded = Signal(name="classesReloaded")
 
@@ -67,32 +203,102 @@ class ClassCatalogue(object):
 		"""return set of known classes"""
 		return set(self.classModuleMap.keys())
 
-	def gatherClasses(self):
+	def scanModules(self)->T.List[T.Tuple[str, Path, T.Optional[T.List]]]:
+		"""return (module name, path, recorded class entries) for
+		every module in class package paths - class entries are None
+		for modules changed since the manifest was saved"""
+		results = []
+		for path in self.scanPackagePaths:
+			for moduleName, filePath in packageModuleFiles(path):
+				results.append((moduleName, filePath,
+				                self.manifest.classEntries(filePath)))
+		return results
+
+	def gatherClasses(self, lazy=False):
 		"""iterate over class package paths,
 		gather valid subclasses, add them to class package map
-		this naturally has to load all modules
+
+		modules unchanged since the last scan are imported and their
+		recorded classes taken directly. changed modules are parsed
+		first, in parallel, and only imported if they define any
+		classes at module level - then only those are checked
+
+		if lazy, modules unchanged since the last scan are not
+		imported at all - their classes are only registered by name,
+		and imported on first classFromName()
 		"""
-		for path in self.scanPackagePaths:
-			for rootPath, dirs, files in os.walk(path):
-				# check if it's a valid python package
-				if not "__init__.py" in files:
+		scanned = self.scanModules()
+		changed = [i for i in scanned if i[2] is None]
+		with ThreadPoolExecutor() as pool:
+			candidates = dict(zip(
+				(i[1] for i in changed),
+				pool.map(candidateClassNames, (i[1] for i in changed))))
+
+		packages = self._scannedPackages
+		packages.update({i[0] : i[1] for i in scanned
+		                 if i[1].name == "__init__.py"})
+		for moduleName, filePath, entries in scanned:
+			if entries is not None:
+				if not entries:
+					continue
+				if lazy:
+					for attrName, className in entries:
+						self.classNameMap.setdefault(className, LazyClassEntry(
+							moduleName, filePath, attrName))
 					continue
-				rootPath = Path(rootPath)
-				results = modulesInPackagePath(rootPath)
-
-				# get members in modules
-				for module in results:
-					# # only unique members that are classesToReload
-					# members = set(
-					# 	[i[1] for i in inspect.getmembers(module, lambda x: isinstance(x, type))])
-					# for testClass in members:
-					# 	# skip invalid classesToReload
-					# 	if not self.checkValidClass(testClass, module):
-					# 		continue
-					# 	self.classModuleMap[testClass] = module
-					classes = self.getClassesInModule(module)
-					for modClass in classes:
-						self.classModuleMap[modClass] = module
+				module = self._loadScannedModule(moduleName, filePath, packages)
+				for attrName, className in entries:
+					self._addClass(getattr(module, attrName), module)
+				continue
+
+			# first scan of module, check candidates properly
+			names = candidates[filePath]
+			entries = []
+			if names:
+				module = self._loadScannedModule(moduleName, filePath, packages)
+				for name in names:
+					testClass = getattr(module, name, None)
+					if isinstance(testClass, type) and \
+							self.checkValidClass(testClass, module):
+						entries.append((name, testClass.__name__))
+						self._addClass(testClass, module)
+			# modules without candidates are never imported
+			self.manifest.setClassEntries(filePath, moduleName, entries)
+
+		self.manifest.prune({str(i[1]) for i in scanned})
+		self.manifest.save()
+
+	def _addClass(self, cls:type, module):
+		self.classModuleMap[cls] = module
+		self.classNameMap[cls.__name__] = cls
+
+	def classFromName(self, name:str)->T.Optional[type]:
+		"""return class registered under name, importing its module
+		if it is only known from a scan - None if unknown"""
+		entry = self.classNameMap.get(name)
+		if not isinstance(entry, LazyClassEntry):
+			return entry
+		module = self._loadScannedModule(
+			entry.moduleName, entry.path, self._scannedPackages)
+		cls = getattr(module, entry.attrName, None)
+		if not isinstance(cls, type):
+			del self.classNameMap[name]
+			return None
+		self._addClass(cls, module)
+		return cls
+
+	def classNames(self)->T.List[str]:
+		"""names of all known classes, imported or not"""
+		return list(self.classNameMap)
+
+	def _loadScannedModule(self, moduleName:str, filePath:Path,
+	                       packages:T.Dict[str, Path]):
+		"""import module, importing its parent packages first
+		so relative imports resolve"""
+		parentName = moduleName.rpartition(".")[0]
+		if parentName in packages:
+			self._loadScannedModule(parentName, packages[parentName], packages)
+		return loadModuleFromFile(moduleName, filePath)
 
 	def getClassesInModule(self, module):
 		classes = []
@@ -133,7 +339,7 @@ class ClassCatalogue(object):
 			if not self.checkValidClass(testClass, mod):
 				raise TypeError("Class {} is invalid to register in catalogue")
 
-			self.classModuleMap[testClass] = mod
+			self._addClass(testClass, mod)
 			registeredClasses.append(testClass)
 			registeredModules.append(mod)
 		# emit signal
@@ -149,37 +355,38 @@ class ClassCatalogue(object):
 		unknownClasses = set(classesToReload).difference(set(self.classModuleMap.keys()))
 		if unknownClasses:
 			raise RuntimeError("Tried to reload unknown classesToReload {}".format(unknownClasses))
+		return self.reloadModules(
+			{sys.modules[i.__module__] for i in classesToReload})
 
+	def reloadModules(self, modules:T.Iterable)->ReloadEvent:
+		"""reload only the given modules, pair each known class
+		defined in them with its new version, and emit classesReloaded
+		classes no longer found after reload are left as they were"""
 		oldClasses = []
 		newClasses = []
 		newModules = []
-
-		oldNewClassMap = {i : None for i in classesToReload}
-		newClassModuleMap = {}
-		#testClasses = set()
-		# get modules to reload
-		modulesToReload = set(self.classModuleMap[i] for i in classesToReload)
-		for module in modulesToReload:
+		for module in modules:
+			knownClasses = [i for i in self.classModuleMap
+			                if i.__module__ == module.__name__]
 			newModule = importlib.reload(module)
-			foundClasses = self.getClassesInModule(newModule)
-			#testClasses.update(foundClasses)
-			for foundClass in foundClasses:
-				newClassModuleMap[foundClass] = module
-
-		# pair up old class, new class and module
-		validClasses = set(newClassModuleMap.keys())
-		for oldClass in classesToReload:
-			newClass = self.getMatchingReloadedClass(oldClass, validClasses)
-			newModule = newClassModuleMap[newClass]
-			oldClasses.append(oldClass)
-			newClasses.append(newClass)
-			newModules.append(newModule)
+			foundClasses = set(self.getClassesInModule(newModule))
+			for oldClass in knownClasses:
+				newClass = self.getMatchingReloadedClass(oldClass, foundClasses)
+				if newClass is None or newClass is oldClass:
+					continue
+				del self.classModuleMap[oldClass]
+				oldClasses.append(oldClass)
+				newClasses.append(newClass)
+				newModules.append(newModule)
+			# name lookups now find the reloaded classes, and any new ones
+			for newClass in foundClasses:
+				self._addClass(newClass, newModule)
 
 		event = self.ReloadEvent(oldClasses,
 		                         newClasses,
 		                         newModules)
 		self.classesReloaded(event)
-
+		return event
 
 	def getMatchingReloadedClass(self, testClass:type, classPool:T.Set[type]):
 		"""associated an old class with its reloaded version
@@ -199,6 +406,68 @@ class ClassCatalogue(object):
 	def display(self):
 		print(self.displayStr())
 
+	def log(self, message):
+		print(message)
+
+
+
+class CatalogueWatcher(object):
+	"""polls the files of modules holding catalogue classes -
+	when one changes, only that module is reloaded, and live nodes
+	of its old classes in watched graphs are migrated to the new ones
+
+	there is no inotify in the stdlib, so this checks mtimes.
+	call poll() from a timer or event loop on the thread owning
+	the watched graphs - reloads and migration run wherever it's called
+	"""
+
+	def __init__(self, catalogue:ClassCatalogue):
+		self.catalogue = catalogue
+		self.graphs = WeakSet()
+		# { module name : file mtime when last checked }
+		self._stamps = {} #type: T.Dict[str, int]
+		self.poll()
+		catalogue.classesReloaded.connect(self._onClassesReloaded)
+
+	def watchGraph(self, graph):
+		"""migrate nodes in graph whenever classes reload"""
+		self.graphs.add(graph)
+
+	def _moduleFiles(self)->T.Dict[str, str]:
+		"""{ module name : file } for modules holding imported classes"""
+		files = {}
+		for cls in self.catalogue.classModuleMap:
+			module = sys.modules.get(cls.__module__)
+			if getattr(module, "__file__", None):
+				files[module.__name__] = module.__file__
+		return files
+
+	def poll(self)->T.List[ClassCatalogue.ReloadEvent]:
+		"""reload any module changed since last poll"""
+		events = []
+		for moduleName, path in self._moduleFiles().items():
+			try:
+				stamp = os.stat(path).st_mtime_ns
+			except OSError:
+				continue
+			lastStamp = self._stamps.get(moduleName)
+			self._stamps[moduleName] = stamp
+			if lastStamp is None or lastStamp == stamp:
+				continue
+			try:
+				events.append(self.catalogue.reloadModules(
+					[sys.modules[moduleName]]))
+			except Exception:
+				# probably saved mid-edit, try again on next change
+				self.catalogue.log("could not reload {}\n{}".format(
+					moduleName, traceback.format_exc()))
+		return events
+
+	def _onClassesReloaded(self, event:ClassCatalogue.ReloadEvent):
+		classMap = dict(zip(event.oldClasses, event.newClasses))
+		for graph in tuple(self.graphs):
+			graph.migrateNodeClasses(classMap)
+
 
 
 if __name__ == '__main__':
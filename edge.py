@@ -5,29 +5,90 @@ if TYPE_CHECKING:
 	from treegraph.node import GraphNode
 	from treegraph.attr import NodeAttr
 	from treegraph.graph import Graph
+	from treegraph.edgetable import EdgeTable
 
 from tree import Signal
 
 class GraphEdge(object):
-	"""connects two abstractNode/abstractAttr objects"""
+	"""connects two abstractNode/abstractAttr objects -
+	a lightweight view over one row of an EdgeTable, made on demand.
+	a table keeps one view per row, so each edge is a single object
+	while any view of it exists. a view holds no attrs or nodes of its
+	own until its edge is removed, then keeps them so stays readable"""
 
+	__slots__ = ("table", "row", "generation", "_detached", "__weakref__")
 
 	def __init__(self, source:"NodeAttr"=None,
 	             dest:"NodeAttr"=None,
 	             graph:"Graph"=None):
-		"""source and dest to be abstractAttrItems"""
-		self.graph = graph
-		if source:
-			self.sourceAttr = source
-			self.sourceNode = source.node
-		if dest:
-			self.destAttr = dest
-			self.destNode = dest.node
-		self.dataType = self.sourceAttr.dataType
+		"""source and dest to be abstractAttrItems -
+		edge is not part of any table until given to graph.addEdge()"""
+		self.table = graph.edgeTable if graph is not None else None
+		self.row = -1
+		self.generation = -1
+		# attrs and nodes, held only while not in a table
+		self._detached = (source, dest,
+		                  source.node if source is not None else None,
+		                  dest.node if dest is not None else None)
 
 		# signal on edge garbage collected / destroyed
 		# self.edgeDestroyed = Signal()
 
+	@classmethod
+	def fromRow(cls, table:EdgeTable, row:int)->GraphEdge:
+		"""return new view over existing row - use table.edge()
+		to reuse the row's current view"""
+		edge = cls.__new__(cls)
+		edge.bind(table, row)
+		return edge
+
+	def bind(self, table:EdgeTable, row:int):
+		"""make this the view of live row of table"""
+		self.table = table
+		self.row = row
+		self.generation = table.generations[row]
+		self._detached = None
+		table._registerView(row, self)
+
+	def detach(self):
+		"""keep objects of row, before table frees it"""
+		self._detached = self.table.rowObjects(self.row)
+
+	@property
+	def isLive(self)->bool:
+		"""True while edge is still held by its table"""
+		return self.table is not None and \
+		       self.table.isLive(self.row, self.generation)
+
+	def _rowObject(self, index:int):
+		if self._detached is not None:
+			return self._detached[index]
+		return self.table.rowObject(self.row,
+		                            self.table.refColumnNames[index])
+
+	@property
+	def sourceAttr(self)->"NodeAttr":
+		return self._rowObject(0)
+
+	@property
+	def destAttr(self)->"NodeAttr":
+		return self._rowObject(1)
+
+	@property
+	def sourceNode(self)->"GraphNode":
+		return self._rowObject(2)
+
+	@property
+	def destNode(self)->"GraphNode":
+		return self._rowObject(3)
+
+	@property
+	def graph(self)->"Graph":
+		return self.table.graph if self.table is not None else None
+
+	@property
+	def dataType(self):
+		return self.sourceAttr.dataType
 
 	def __str__(self):
 		""" dirty solution to remove edge objects from serialisation process """
@@ -0,0 +1,309 @@
+"""compact storage for graph edges, and the graph's only record of them -
+each edge is one row across parallel integer columns.
+
+attrs and nodes are interned once per table, and rows hold only their
+int ids, in array("i") columns. further integer columns link rows into
+a doubly linked list of edges out of and into each node, so the edges
+of a node are found without any per-edge python objects. queries over
+sets of nodes run vectorised over whole columns if numpy is available.
+
+GraphEdge objects are only made on demand, as views over a row - the
+table keeps at most one view per row, so views of the same edge are the
+same object. freed rows are reused by later edges - each row's
+generation is bumped when freed, so a view of a removed edge never
+matches a new one
+"""
+
+from __future__ import annotations
+
+import typing as T
+import struct
+from array import array
+from weakref import WeakValueDictionary
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+if T.TYPE_CHECKING:
+	from treegraph.node import GraphNode
+	from treegraph.attr import NodeAttr
+	from treegraph.graph import Graph
+	from treegraph.edge import GraphEdge
+
+
+class EdgeTable(object):
+	"""parallel columns of source attr, dest attr, source node
+	and dest node ids for every edge, with per-node adjacency links"""
+
+	refColumnNames = ("sourceAttr", "destAttr", "sourceNode", "destNode")
+	linkColumnNames = ("nextOut", "prevOut", "nextIn", "prevIn")
+
+	def __init__(self, graph:Graph=None):
+		self.graph = graph
+		# ref id columns - -1 in free rows
+		self.columns = {i : array("i") for i in self.refColumnNames
+		                } #type: T.Dict[str, array]
+		# row links of each node's edge lists, -1 ends a list
+		self.links = {i : array("i") for i in self.linkColumnNames
+		              } #type: T.Dict[str, array]
+		self.generations = array("i")
+		self._freeRows = array("i")
+		self._liveCount = 0
+
+		# interned attrs and nodes - { object : id }, and id -> object
+		self._refIds = {} #type: T.Dict[T.Any, int]
+		self._refs = [] #type: T.List[T.Any]
+		# rows using each ref, ref freed at 0
+		self._refCounts = array("i")
+		self._freeRefs = array("i")
+		# first row of each node's out / in list, indexed by ref id
+		self._outHeads = array("i")
+		self._inHeads = array("i")
+
+		# { row : its view, while one exists }
+		self._views = WeakValueDictionary() #type: T.Dict[int, GraphEdge]
+
+	def __len__(self):
+		return self._liveCount
+
+	@property
+	def rowCount(self)->int:
+		"""rows allocated, live or free - never more than the
+		most edges the table has held at once"""
+		return len(self.generations)
+
+	def clear(self):
+		"""drop all rows - existing views are detached"""
+		for row in list(self._views.keys()):
+			self._detachView(row)
+		for i in self.columns.values():
+			del i[:]
+		for i in self.links.values():
+			del i[:]
+		for i in (self.generations, self._freeRows, self._refCounts,
+		          self._freeRefs, self._outHeads, self._inHeads):
+			del i[:]
+		self._refIds.clear()
+		del self._refs[:]
+		self._liveCount = 0
+
+	# region refs
+	def refId(self, obj)->int:
+		"""return id of interned attr or node, or -1"""
+		return self._refIds.get(obj, -1)
+
+	def ref(self, refId:int):
+		return self._refs[refId]
+
+	def _intern(self, obj)->int:
+		"""return id of obj, interning it if needed, and count one use"""
+		refId = self._refIds.get(obj)
+		if refId is None:
+			if self._freeRefs:
+				refId = self._freeRefs.pop()
+				self._refs[refId] = obj
+			else:
+				refId = len(self._refs)
+				self._refs.append(obj)
+				self._refCounts.append(0)
+				self._outHeads.append(-1)
+				self._inHeads.append(-1)
+			self._refIds[obj] = refId
+		self._refCounts[refId] += 1
+		return refId
+
+	def _release(self, refId:int):
+		"""drop one use of ref, forgetting its object at none"""
+		self._refCounts[refId] -= 1
+		if self._refCounts[refId]:
+			return
+		del self._refIds[self._refs[refId]]
+		self._refs[refId] = None
+		self._freeRefs.append(refId)
+	#endregion
+
+	# region rows
+	def addRow(self, sourceAttr:NodeAttr, destAttr:NodeAttr)->int:
+		"""add edge row, reusing a freed one if any - return its index"""
+		ids = [self._intern(i) for i in (sourceAttr, destAttr,
+		                                 sourceAttr.node, destAttr.node)]
+		if self._freeRows:
+			row = self._freeRows.pop()
+			for name, refId in zip(self.refColumnNames, ids):
+				self.columns[name][row] = refId
+		else:
+			row = len(self.generations)
+			for name, refId in zip(self.refColumnNames, ids):
+				self.columns[name].append(refId)
+			for i in self.links.values():
+				i.append(-1)
+			self.generations.append(0)
+		self._link(row, ids[2], self._outHeads, "nextOut", "prevOut")
+		self._link(row, ids[3], self._inHeads, "nextIn", "prevIn")
+		self._liveCount += 1
+		return row
+
+	def removeRow(self, row:int):
+		"""free row - its view, if any, is detached and stays readable"""
+		if not self.isLive(row):
+			return
+		self._detachView(row)
+		self._unlink(row, self.columns["sourceNode"][row], self._outHeads,
+		             "nextOut", "prevOut")
+		self._unlink(row, self.columns["destNode"][row], self._inHeads,
+		             "nextIn", "prevIn")
+		for i in self.columns.values():
+			self._release(i[row])
+			i[row] = -1
+		self.generations[row] += 1
+		self._freeRows.append(row)
+		self._liveCount -= 1
+
+	def _detachView(self, row:int):
+		view = self._views.pop(row, None)
+		if view is not None:
+			view.detach()
+
+	def _link(self, row:int, nodeId:int, heads:array,
+	          nextName:str, prevName:str):
+		"""push row onto front of node's list"""
+		nextLinks, prevLinks = self.links[nextName], self.links[prevName]
+		head = heads[nodeId]
+		nextLinks[row] = head
+		prevLinks[row] = -1
+		if head != -1:
+			prevLinks[head] = row
+		heads[nodeId] = row
+
+	def _unlink(self, row:int, nodeId:int, heads:array,
+	            nextName:str, prevName:str):
+		nextLinks, prevLinks = self.links[nextName], self.links[prevName]
+		nextRow, prevRow = nextLinks[row], prevLinks[row]
+		if prevRow == -1:
+			heads[nodeId] = nextRow
+		else:
+			nextLinks[prevRow] = nextRow
+		if nextRow != -1:
+			prevLinks[nextRow] = prevRow
+		nextLinks[row] = prevLinks[row] = -1
+
+	def isLive(self, row:int, generation:int=None)->bool:
+		"""True if row holds an edge - if generation is given,
+		only if it is still the same edge"""
+		if not 0 <= row < len(self.generations) or \
+				self.columns["sourceAttr"][row] == -1:
+			return False
+		return generation is None or self.generations[row] == generation
+
+	def rowObjects(self, row:int
+	               )->T.Tuple[NodeAttr, NodeAttr, GraphNode, GraphNode]:
+		"""return source attr, dest attr, source node, dest node
+		of a live row"""
+		return tuple(self._refs[self.columns[i][row]]
+		             for i in self.refColumnNames)
+
+	def rowObject(self, row:int, column:str):
+		"""return one object of a live row"""
+		return self._refs[self.columns[column][row]]
+
+	def liveRows(self)->T.List[int]:
+		column = self.columns["sourceAttr"]
+		if np is not None and column:
+			return np.flatnonzero(self._npColumn(column) != -1).tolist()
+		return [i for i, refId in enumerate(column) if refId != -1]
+	#endregion
+
+	# region queries
+	@staticmethod
+	def _npColumn(column:array):
+		"""numpy view over column, without copying - don't keep it,
+		the column can't grow while it exists"""
+		return np.frombuffer(column, dtype=np.intc)
+
+	def _walk(self, row:int, nextLinks:array)->T.Iterator[int]:
+		while row != -1:
+			yield row
+			row = nextLinks[row]
+
+	def rowsOut(self, node:GraphNode)->T.List[int]:
+		"""rows of edges leaving node"""
+		nodeId = self.refId(node)
+		if nodeId == -1:
+			return []
+		return list(self._walk(self._outHeads[nodeId], self.links["nextOut"]))
+
+	def rowsIn(self, node:GraphNode)->T.List[int]:
+		"""rows of edges entering node"""
+		nodeId = self.refId(node)
+		if nodeId == -1:
+			return []
+		return list(self._walk(self._inHeads[nodeId], self.links["nextIn"]))
+
+	def rowsOfAttr(self, attr:NodeAttr)->T.List[int]:
+		"""rows of edges to or from attr - only the edges of
+		attr's node are checked"""
+		attrId = self.refId(attr)
+		if attrId == -1:
+			return []
+		sourceAttrs, destAttrs = self.columns["sourceAttr"], \
+		                         self.columns["destAttr"]
+		return [i for i in self.rowsIn(attr.node) if destAttrs[i] == attrId] + \
+		       [i for i in self.rowsOut(attr.node) if sourceAttrs[i] == attrId]
+
+	def _rowsMatching(self, nodes:T.Iterable[GraphNode],
+	                  columnNames:T.Sequence[str])->T.List[int]:
+		"""rows whose ids in every named column are among nodes,
+		in row order"""
+		ids = {self.refId(i) for i in nodes}
+		ids.discard(-1)
+		if not ids:
+			return []
+		columns = [self.columns[i] for i in columnNames]
+		if np is not None:
+			idArray = np.fromiter(ids, dtype=np.intc, count=len(ids))
+			mask = np.isin(self._npColumn(columns[0]), idArray)
+			for column in columns[1:]:
+				mask &= np.isin(self._npColumn(column), idArray)
+			return np.flatnonzero(mask).tolist()
+		return [row for row, refIds in enumerate(zip(*columns))
+		        if all(i in ids for i in refIds)]
+
+	def rowsInto(self, nodes:T.Iterable[GraphNode])->T.List[int]:
+		"""rows of all edges with dest in nodes, in row order"""
+		return self._rowsMatching(nodes, ("destNode", ))
+
+	def rowsFrom(self, nodes:T.Iterable[GraphNode])->T.List[int]:
+		"""rows of all edges with source in nodes, in row order"""
+		return self._rowsMatching(nodes, ("sourceNode", ))
+
+	def rowsWithin(self, nodes:T.Iterable[GraphNode])->T.List[int]:
+		"""rows of edges with both source and dest in nodes"""
+		return self._rowsMatching(nodes, ("sourceNode", "destNode"))
+
+	def edge(self, row:int)->GraphEdge:
+		"""return view over live row, reusing any existing one"""
+		view = self._views.get(row)
+		if view is None:
+			from treegraph.edge import GraphEdge
+			view = GraphEdge.fromRow(self, row)
+		return view
+
+	def edges(self, rows:T.Iterable[int])->T.List[GraphEdge]:
+		"""return views over rows"""
+		return [self.edge(i) for i in rows]
+
+	def _registerView(self, row:int, view:GraphEdge):
+		self._views[row] = view
+	#endregion
+
+	@property
+	def nbytes(self)->int:
+		"""bytes held by columns and the ref table - the ref table
+		counts one pointer per slot, not the interned objects"""
+		arrays = list(self.columns.values()) + list(self.links.values()) + [
+			self.generations, self._freeRows, self._refCounts,
+			self._freeRefs, self._outHeads, self._inHeads]
+		return sum(i.itemsize * len(i) for i in arrays) + \
+		       struct.calcsize("P") * len(self._refs)
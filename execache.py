@@ -0,0 +1,160 @@
+"""content-addressed cache of node results -
+a node's key is a hash of its class and class version, its settings,
+and the values reaching each of its inputs. on a hit, outputs are
+restored without calling execute(). only node classes setting
+cacheResults are cached
+
+an in-memory tier keeps recently used results up to a byte budget,
+an optional on-disk tier keeps everything under a directory
+"""
+
+from __future__ import annotations
+
+import typing as T
+import hashlib, inspect, os, pickle, threading
+from collections import OrderedDict
+from pathlib import Path
+
+from treegraph.lib.branch import treeValues
+from treegraph.blobstore import hashingDumps
+
+if T.TYPE_CHECKING:
+	from treegraph.node import GraphNode
+
+
+def hashValue(value)->str:
+	"""hash of a value's pickled bytes - raises TypeError
+	for values that cannot be pickled. values mapped from blob
+	sidecars hash by location, without being read"""
+	try:
+		data = hashingDumps(value)
+	except Exception as e:
+		raise TypeError("cannot hash value {}".format(value)) from e
+	return hashlib.sha1(data).hexdigest()
+
+
+class NodeResultCache(object):
+	"""two-tier result cache for node outputs
+	stored results are pickled { output address : value } maps"""
+
+	def __init__(self, maxBytes=256 * 1024 * 1024,
+	             cacheDir:T.Union[str, Path]=None):
+		self.maxBytes = maxBytes
+		self.cacheDir = Path(cacheDir) if cacheDir else None
+		if self.cacheDir:
+			self.cacheDir.mkdir(parents=True, exist_ok=True)
+
+		self._memory = OrderedDict() #type: OrderedDict[str, bytes]
+		self._memoryBytes = 0
+		self._classVersions = {} #type: T.Dict[type, str]
+		self._lock = threading.Lock()
+
+		self.hits = 0
+		self.misses = 0
+
+	# region keys
+	def classVersion(self, nodeCls:T.Type[GraphNode])->str:
+		"""use class's own classVersion if defined,
+		otherwise hash the source of every class in its mro -
+		base class edits change results just as much"""
+		if nodeCls.classVersion is not None:
+			return str(nodeCls.classVersion)
+		if nodeCls not in self._classVersions:
+			sourceHash = hashlib.sha1()
+			for baseCls in nodeCls.__mro__:
+				try:
+					source = inspect.getsource(baseCls)
+				except (OSError, TypeError):
+					# builtins, or classes defined interactively
+					source = baseCls.__qualname__
+				sourceHash.update(source.encode("utf-8"))
+			self._classVersions[nodeCls] = sourceHash.hexdigest()
+		return self._classVersions[nodeCls]
+
+	def nodeKey(self, node:GraphNode)->T.Optional[str]:
+		"""return cache key for node's current state, or None
+		if node cannot be cached"""
+		if not node.cacheResults:
+			return None
+		nodeCls = type(node)
+		keyHash = hashlib.sha1()
+		keyHash.update("{}.{}".format(
+			nodeCls.__module__, nodeCls.__qualname__).encode("utf-8"))
+		keyHash.update(self.classVersion(nodeCls).encode("utf-8"))
+		try:
+			settings = sorted(treeValues(node.settings).items())
+			keyHash.update(hashValue(settings).encode("utf-8"))
+			for address, value in sorted(treeValues(node.inputRoot).items()):
+				keyHash.update(repr(address).encode("utf-8"))
+				keyHash.update(hashValue(value).encode("utf-8"))
+		except TypeError:
+			return None
+		return keyHash.hexdigest()
+	#endregion
+
+	def _diskPath(self, key:str)->Path:
+		return self.cacheDir / key[:2] / (key + ".pkl")
+
+	def _storeMemory(self, key:str, data:bytes):
+		if len(data) > self.maxBytes:
+			return
+		with self._lock:
+			if key in self._memory:
+				self._memoryBytes -= len(self._memory.pop(key))
+			self._memory[key] = data
+			self._memoryBytes += len(data)
+			# evict least recently used
+			while self._memoryBytes > self.maxBytes:
+				oldKey, oldData = self._memory.popitem(last=False)
+				self._memoryBytes -= len(oldData)
+
+	def get(self, key:str)->T.Optional[T.Dict[T.Tuple[str, ...], object]]:
+		"""return stored outputs for key, or None"""
+		with self._lock:
+			data = self._memory.get(key)
+			if data is not None:
+				self._memory.move_to_end(key)
+				self.hits += 1
+		if data is None and self.cacheDir:
+			path = self._diskPath(key)
+			if path.is_file():
+				data = path.read_bytes()
+				self._storeMemory(key, data)
+				with self._lock:
+					self.hits += 1
+		if data is None:
+			with self._lock:
+				self.misses += 1
+			return None
+		return pickle.loads(data)
+
+	def put(self, key:str, outputs:T.Dict[T.Tuple[str, ...], object]):
+		"""store outputs under key - unpicklable outputs are skipped"""
+		try:
+			data = pickle.dumps(outputs, protocol=4)
+		except Exception:
+			return
+		self._storeMemory(key, data)
+		if self.cacheDir:
+			path = self._diskPath(key)
+			path.parent.mkdir(exist_ok=True)
+			# write then rename, so readers never see partial files
+			tempPath = path.with_suffix(".tmp{}".format(os.getpid()))
+			tempPath.write_bytes(data)
+			os.replace(tempPath, path)
+
+	def clear(self, disk=False):
+		with self._lock:
+			self._memory.clear()
+			self._memoryBytes = 0
+		if disk and self.cacheDir:
+			for i in self.cacheDir.glob("*/*.pkl"):
+				i.unlink()
+
+	@property
+	def memoryBytes(self)->int:
+		return self._memoryBytes
+
+	def __len__(self):
+		return len(self._memory)
+
@@ -0,0 +1,324 @@
+"""scheduling node execution across a concurrent.futures pool -
+each node is submitted as soon as all of its upstream nodes in the
+path have completed.
+
+pre- and post-execution always run on the calling thread, so
+node state signals never fire from a worker - only the main
+execution function is handed to the pool
+"""
+
+from __future__ import annotations
+
+import typing as T
+import pickle, tracemalloc
+from enum import Enum
+from collections import deque, namedtuple
+from concurrent import futures
+
+from tree import Tree
+
+from treegraph.constant import NodeState
+from treegraph.lib.branch import treeValues, applyTreeValues
+from treegraph.blobstore import BlobRef, blobRef
+from treegraph.exeprofile import PhaseTimer
+
+if T.TYPE_CHECKING:
+	from treegraph.node import GraphNode
+	from treegraph.graph import Graph
+	from treegraph.execache import NodeResultCache
+	from treegraph.exeprofile import ExecutionProfiler
+
+
+class ExecutionMode(Enum):
+	"""options for how GraphStateComponent runs an execution path"""
+	serial = "serial"
+	thread = "thread"
+	process = "process"
+
+
+class NodeExecutor(object):
+	"""wraps a concurrent.futures pool to run the main stage
+	function of nodes.
+	if no pool is passed, one is created on entering and
+	shut down on exit.
+	if a profiler is given, main execution is timed wherever it runs"""
+
+	poolCls = futures.ThreadPoolExecutor
+
+	def __init__(self, maxWorkers:int=None, pool:futures.Executor=None,
+	             profiler:ExecutionProfiler=None):
+		self.maxWorkers = maxWorkers
+		self._ownsPool = pool is None
+		self.pool = pool
+		self.profiler = profiler
+
+	def __enter__(self):
+		if self.pool is None:
+			self.pool = self.poolCls(max_workers=self.maxWorkers)
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		if self._ownsPool and self.pool is not None:
+			self.pool.shutdown(wait=True)
+			self.pool = None
+
+	def mainFunction(self, node:GraphNode, stageIndex=0)->T.Callable:
+		"""return node's main stage function, wrapped for profiling"""
+		fn = node.stageFunctions(stageIndex)[1]
+		if self.profiler is not None:
+			fn = self.profiler.wrapPhase(node, "execute", fn)
+		return fn
+
+	def submit(self, node:GraphNode, stageIndex=0)->futures.Future:
+		"""submit the main function of node's execution stage"""
+		if self.profiler is not None:
+			self.profiler.markQueued(node)
+		return self.pool.submit(self.mainFunction(node, stageIndex))
+
+	def runPending(self)->bool:
+		"""called on the main thread before waiting on futures -
+		run the next node queued to run there, if any.
+		returns False if nothing was waiting"""
+		return False
+
+	def collect(self, node:GraphNode, future:futures.Future):
+		"""called on the main thread once node's future is done -
+		raises any exception from execution, otherwise propagates
+		node's outputs along its edges, as cached outputs are"""
+		self.collectResult(node, future)
+		node.propagateOutputs()
+
+	def collectResult(self, node:GraphNode, future:futures.Future):
+		"""bring node's results back from its future"""
+		future.result()
+
+
+class ThreadNodeExecutor(NodeExecutor):
+	"""run nodes on a thread pool - best for nodes blocking
+	on io or subprocesses"""
+	poolCls = futures.ThreadPoolExecutor
+
+
+# everything needed to run a node's execute() in another process -
+# class is pickled by reference, so must be importable there.
+# input values mapped from a blob sidecar are sent as their BlobRefs
+NodeExecutionPayload = namedtuple("NodeExecutionPayload",
+                                  ("nodeCls", "name", "inputs", "settings"))
+
+def makeExecutionPayload(node:GraphNode)->NodeExecutionPayload:
+	"""gather node's class, input values and serialised settings"""
+	inputs = {}
+	for address, value in treeValues(node.inputRoot).items():
+		ref = blobRef(value)
+		inputs[address] = value if ref is None else ref
+	return NodeExecutionPayload(
+		type(node), node.name, inputs,
+		node.settings.serialise())
+
+def executePayload(payload:NodeExecutionPayload
+                   )->T.Dict[T.Tuple[str, ...], object]:
+	"""run in worker process - rebuild a detached node from payload,
+	execute it, return its output values"""
+	node = payload.nodeCls(name=payload.name)
+	# map blobs again here, sharing pages with the main process
+	applyTreeValues(node.inputRoot, {
+		k : v.open() if isinstance(v, BlobRef) else v
+		for k, v in payload.inputs.items()})
+	applyTreeValues(node.settings,
+	                treeValues(Tree.fromDict(payload.settings)),
+	                create=True)
+	node.execute()
+	return treeValues(node.outputRoot)
+
+def profiledExecutePayload(payload:NodeExecutionPayload, trackMemory=False
+                           )->T.Tuple[T.Dict[T.Tuple[str, ...], object], T.Dict]:
+	"""run payload in worker process, also returning PhaseTimer timing"""
+	if trackMemory and not tracemalloc.is_tracing():
+		tracemalloc.start()
+	with PhaseTimer(trackMemory=trackMemory) as timer:
+		outputs = executePayload(payload)
+	return outputs, timer.timing
+
+def executePickledPayload(data:bytes, profile=False, trackMemory=False):
+	"""worker process entry for payloads pickled in the main process,
+	so the pool only has to copy bytes"""
+	payload = pickle.loads(data)
+	if profile:
+		return profiledExecutePayload(payload, trackMemory)
+	return executePayload(payload)
+
+
+class ProcessNodeExecutor(NodeExecutor):
+	"""run nodes on a process pool, for cpu-bound work -
+	nodes are shipped as NodeExecutionPayloads, and their output
+	values merged back on completion.
+
+	node classes with pinToMainProcess set, or whose payload cannot
+	be pickled, are queued to run on the calling thread instead,
+	one at a time between waits on the pool"""
+	poolCls = futures.ProcessPoolExecutor
+
+	def __init__(self, maxWorkers:int=None, pool:futures.Executor=None,
+	             profiler:ExecutionProfiler=None):
+		super(ProcessNodeExecutor, self).__init__(
+			maxWorkers=maxWorkers, pool=pool, profiler=profiler)
+		# futures running in worker processes, returning output maps
+		self._remoteFutures = set() #type: T.Set[futures.Future]
+		# (node, stage index, future) to run on the calling thread
+		self._mainQueue = deque() #type: T.Deque[T.Tuple[GraphNode, int, futures.Future]]
+
+	def submit(self, node:GraphNode, stageIndex=0) ->futures.Future:
+		if not node.pinToMainProcess:
+			try:
+				data = pickle.dumps(makeExecutionPayload(node), protocol=4)
+			except Exception as e:
+				node.log("cannot send node {} to process pool, "
+				         "running in main process: {}".format(node.name, e))
+			else:
+				if self.profiler is None:
+					future = self.pool.submit(executePickledPayload, data)
+				else:
+					self.profiler.markQueued(node)
+					future = self.pool.submit(executePickledPayload, data,
+					                          True, self.profiler.trackMemory)
+				self._remoteFutures.add(future)
+				return future
+
+		future = futures.Future()
+		self._mainQueue.append((node, stageIndex, future))
+		return future
+
+	def runPending(self)->bool:
+		if not self._mainQueue:
+			return False
+		node, stageIndex, future = self._mainQueue.popleft()
+		try:
+			self.mainFunction(node, stageIndex)()
+			future.set_result(None)
+		except Exception as e:
+			future.set_exception(e)
+		return True
+
+	def collectResult(self, node:GraphNode, future:futures.Future):
+		if future in self._remoteFutures:
+			self._remoteFutures.discard(future)
+			outputs = future.result()
+			if self.profiler is not None:
+				# timed in worker process
+				outputs, timing = outputs
+				self.profiler.addRecord(node, "execute", timing)
+			applyTreeValues(node.outputRoot, outputs)
+		else:
+			future.result()
+
+
+class ExecutionScheduler(object):
+	"""runs a sequence of nodes through an executor, respecting
+	dependencies between them.
+	a failed node blocks everything downstream of it in the path,
+	without stopping unrelated branches.
+	if a result cache is given, nodes with cached outputs are
+	completed without being submitted"""
+
+	def __init__(self, graph:Graph, sequence:T.Sequence[GraphNode],
+	             executor:NodeExecutor, stageIndex=0,
+	             cache:NodeResultCache=None,
+	             profiler:ExecutionProfiler=None):
+		self.graph = graph
+		self.sequence = list(sequence)
+		self.executor = executor
+		self.stageIndex = stageIndex
+		self.cache = cache
+		self.profiler = profiler
+		if profiler is not None:
+			executor.profiler = profiler
+
+		self.completeNodes = [] #type: T.List[GraphNode]
+		self.failedNodes = [] #type: T.List[GraphNode]
+		self.blockedNodes = set() #type: T.Set[GraphNode]
+
+	def _blockFuture(self, node:GraphNode, pathNodes:T.Set[GraphNode]):
+		blocked = pathNodes.intersection(self.graph.getNodesInFuture(node))
+		for i in blocked:
+			self.graph.log("node {} blocked by failure of {}".format(
+				i.name, node.name))
+		self.blockedNodes.update(blocked)
+
+	def _stageFunctions(self, node:GraphNode)->tuple:
+		"""node's stage functions, with pre and post wrapped for profiling"""
+		stageFns = node.stageFunctions(self.stageIndex)
+		if self.profiler is None:
+			return stageFns
+		return (self.profiler.wrapPhase(node, "preExecution", stageFns[0]),
+		        stageFns[1],
+		        self.profiler.wrapPhase(node, "postExecution", stageFns[2]))
+
+	def run(self):
+		"""execute all nodes, blocking until done"""
+		pathNodes = set(self.sequence)
+		waiting = {i : len(pathNodes.intersection(i.directHistory))
+		           for i in self.sequence}
+		ready = deque(i for i in self.sequence if not waiting[i])
+		running = {} #type: T.Dict[futures.Future, GraphNode]
+		cacheKeys = {} #type: T.Dict[GraphNode, str]
+
+		with self.executor:
+			while ready or running:
+				while ready:
+					node = ready.popleft()
+					stageFns = self._stageFunctions(node)
+					try:
+						stageFns[0]()
+					except Exception as e:
+						stageFns[2](type(e), e, e.__traceback__)
+						self.failedNodes.append(node)
+						self._blockFuture(node, pathNodes)
+						continue
+					if self.cache is not None:
+						key = self.cache.nodeKey(node)
+						if key is not None and node.restoreCachedOutputs(
+								self.cache, key):
+							stageFns[2]()
+							self._onNodeComplete(node, waiting, ready)
+							continue
+						cacheKeys[node] = key
+					running[self.executor.submit(node, self.stageIndex)] = node
+
+				if not running:
+					break
+				# main thread work runs while the pool is busy
+				self.executor.runPending()
+				done, _ = futures.wait(running,
+				                       return_when=futures.FIRST_COMPLETED)
+				for future in done:
+					node = running.pop(future)
+					stageFns = self._stageFunctions(node)
+					try:
+						self.executor.collect(node, future)
+					except Exception as e:
+						stageFns[2](type(e), e, e.__traceback__)
+					else:
+						stageFns[2]()
+
+					if node.state == NodeState.failed:
+						self.failedNodes.append(node)
+						self._blockFuture(node, pathNodes)
+						continue
+					if cacheKeys.get(node) is not None:
+						self.cache.put(cacheKeys[node],
+						               treeValues(node.outputRoot))
+					self._onNodeComplete(node, waiting, ready)
+		return self.failedNodes
+
+	def _onNodeComplete(self, node:GraphNode, waiting:T.Dict[GraphNode, int],
+	                    ready:T.Deque[GraphNode]):
+		"""release any downstream nodes now ready to run"""
+		self.completeNodes.append(node)
+		self.graph.markClean(node)
+		for i in node.directFuture:
+			if i not in waiting:
+				continue
+			waiting[i] -= 1
+			if not waiting[i] and i not in self.blockedNodes:
+				ready.append(i)
+
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import typing as T
+import threading, time
+from contextlib import nullcontext
 from functools import partial
 from enum import Enum
 
@@ -13,6 +15,9 @@ from treegraph.edge import GraphEdge
 from treegraph.group import NodeSet
 
 from treegraph.constant import NodeState
+from treegraph.exeprofile import ExecutionProfiler
+from treegraph.executor import ExecutionMode, ExecutionScheduler, \
+	ThreadNodeExecutor, ProcessNodeExecutor
 
 
 # should probably have its functions moved to a lib
@@ -33,14 +38,57 @@ class GraphExecutionManager(object):
 
 	def __enter__(self):
 		"""set graph state"""
-		self.graph.setState(Graph.State.executing)
+		self.graph.setState(self.graph.State.executing)
 		return self
 
 	def __exit__(self, exc_type, exc_val, exc_tb):
 		"""reset graph state"""
 		if exc_type:
-			self.graph.setState(Graph.State.failed)
-		self.graph.setState(Graph.State.neutral)
+			self.graph.setState(self.graph.State.failed)
+		self.graph.setState(self.graph.State.neutral)
+
+
+class DeferredStateSignals(object):
+	"""context manager collecting node state changes in a graph
+	instead of emitting each node's stateChanged -
+	changes are published together as { node : state } snapshots
+	through graph.nodeStatesChanged, at most every interval seconds,
+	or once on exit if interval is None.
+	snapshots are only published on the thread that entered"""
+
+	def __init__(self, graph:Graph, interval:float=None):
+		self.graph = graph
+		self.interval = interval
+		self._pending = {} #type: T.Dict[GraphNode, str]
+		self._lock = threading.Lock()
+		self._lastPublish = 0.0
+		self._threadId = None
+
+	def __enter__(self):
+		self._threadId = threading.get_ident()
+		self._lastPublish = time.perf_counter()
+		self.graph.deferredStateSignals = self
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.graph.deferredStateSignals = None
+		self.publish()
+
+	def record(self, node:GraphNode, state):
+		with self._lock:
+			self._pending[node] = state
+		if self.interval is None or threading.get_ident() != self._threadId:
+			return
+		if time.perf_counter() - self._lastPublish >= self.interval:
+			self.publish()
+
+	def publish(self):
+		"""emit pending changes now"""
+		with self._lock:
+			snapshot, self._pending = self._pending, {}
+		self._lastPublish = time.perf_counter()
+		if snapshot:
+			self.graph.nodeStatesChanged(snapshot)
 
 
 class GraphStateComponent(ObjectComponent):
@@ -48,6 +96,20 @@ class GraphStateComponent(ObjectComponent):
 	node execution"""
 	parentType : Graph
 
+	# if True, node state signals are not emitted during execution -
+	# graph.nodeStatesChanged gets { node : state } snapshots instead,
+	# every stateSnapshotInterval seconds, or once at the end if None
+	deferStateSignals = False
+	stateSnapshotInterval = None #type: float
+
+	def stateSignalContext(self):
+		"""context deferring node state signals, if enabled
+		and not already deferred"""
+		graph = self.parentObject
+		if not self.deferStateSignals or graph.deferredStateSignals is not None:
+			return nullcontext()
+		return DeferredStateSignals(graph, self.stateSnapshotInterval)
+
 	### region node execution ###
 	def getExecPath(self, nodes):
 		"""creates execution path from unordered nodes"""
@@ -58,26 +120,95 @@ class GraphStateComponent(ObjectComponent):
 		self.parentObject.log("exec path is {}".format(i.name for i in newPath.sequence))
 		return newPath
 
-	def executeNodes(self, nodes=None, index=-1):
-		"""executes nodes in given sequence to given index"""
+	def executeNodes(self, nodes=None, index=-1,
+	                 mode=ExecutionMode.serial, maxWorkers=None,
+	                 profiler:ExecutionProfiler=None):
+		"""executes nodes in given sequence to given index
+		in thread or process mode, each node runs as soon as its
+		upstream nodes are done, on a pool of maxWorkers.
+		pass an ExecutionProfiler to record node timings"""
 
 		execPath = self.getExecPath(nodes=nodes)
+		return self.executeSequence(execPath.sequence, mode=mode,
+		                            maxWorkers=maxWorkers, profiler=profiler)
+
+	def executeDirty(self, nodes=None,
+	                 mode=ExecutionMode.serial, maxWorkers=None,
+	                 profiler:ExecutionProfiler=None):
+		"""re-run only dirty nodes on path to given nodes, or on
+		the whole graph - clean nodes already complete are skipped"""
+		graph = self.parentObject
+		execPath = self.getExecPath(nodes=nodes)
+		sequence = [i for i in execPath.sequence
+		            if graph.isDirty(i) or i.state != NodeState.complete]
+		graph.log("{} of {} nodes dirty".format(
+			len(sequence), len(execPath.sequence)))
+		return self.executeSequence(sequence, mode=mode,
+		                            maxWorkers=maxWorkers, profiler=profiler)
+
+	def executeSequence(self, sequence:T.Sequence[GraphNode],
+	                    mode=ExecutionMode.serial, maxWorkers=None,
+	                    profiler:ExecutionProfiler=None):
+		"""execute ordered nodes - nodes completing successfully
+		are marked clean"""
+		if profiler is not None and not profiler.active:
+			with profiler:
+				return self.executeSequence(sequence, mode=mode,
+				                            maxWorkers=maxWorkers,
+				                            profiler=profiler)
+		if mode != ExecutionMode.serial:
+			return self.executeParallel(sequence, mode=mode,
+			                            maxWorkers=maxWorkers,
+			                            profiler=profiler)
 		self.parentObject.setState("executing")
 		# enter graph-level execution state here
-		with GraphExecutionManager(self.parentObject):
-			for i in execPath.sequence:
+		with GraphExecutionManager(self.parentObject), \
+				self.stateSignalContext():
+			for i in sequence:
 
 				try:
-					kSuccess = i.execStage(0)
+					kSuccess = i.execStage(
+						0, cache=self.parentObject.resultCache,
+						profiler=profiler)
 					# enter and exit node-level execution state
 					self.parentObject.log("all according to kSuccess")
 				except RuntimeError("NOT ACCORDING TO KSUCCESS"):
 					pass
+				if i.state == NodeState.complete:
+					self.parentObject.markClean(i)
 
 		# exit graph-level execution
 		self.parentObject.setState("neutral")
 		self.parentObject.log("execution complete")
 
+	def getNodeExecutor(self, mode=ExecutionMode.thread, maxWorkers=None):
+		"""return executor object to run nodes for given mode"""
+		if mode == ExecutionMode.thread:
+			return ThreadNodeExecutor(maxWorkers=maxWorkers)
+		if mode == ExecutionMode.process:
+			return ProcessNodeExecutor(maxWorkers=maxWorkers)
+		raise RuntimeError("no node executor for mode {}".format(mode))
+
+	def executeParallel(self, sequence:T.Sequence[GraphNode],
+	                    mode=ExecutionMode.thread, maxWorkers=None,
+	                    profiler:ExecutionProfiler=None
+	                    )->T.List[GraphNode]:
+		"""execute ordered nodes with independent branches run concurrently
+		returns list of failed nodes"""
+		scheduler = ExecutionScheduler(
+			self.parentObject, sequence,
+			self.getNodeExecutor(mode, maxWorkers),
+			cache=self.parentObject.resultCache,
+			profiler=profiler)
+		with GraphExecutionManager(self.parentObject), \
+				self.stateSignalContext():
+			failed = scheduler.run()
+		for i in failed:
+			self.parentObject.log("node {} failed".format(i.name))
+		self.parentObject.log("execution complete, {} of {} nodes run".format(
+			len(scheduler.completeNodes), len(sequence)))
+		return failed
+
 	def resetNodes(self, nodes=None):
 		"""resets nodes to pre-executed state"""
 		if not nodes:
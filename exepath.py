@@ -56,30 +56,21 @@ class ExecutionPath(object):
 
 		# safety
 		self.boundaryNodes = self.passedNodes.union(self.seedNodes)
-		self.allNodes = self.boundaryNodes.union(self.graph.getNodesBetween(
-			nodes=self.boundaryNodes))
+		# everything between seeds and targets is exactly
+		# the targets' combined history
+		self.allNodes = self.boundaryNodes.union(
+			self.graph.getCombinedHistory(self.passedNodes))
 
 	def buildToNodes(self):
-		"""get order only containing targets' critical paths"""
+		"""get order only containing targets' critical paths -
+		filters graph's maintained topological order,
+		no further traversal needed"""
 		self.resetIndices()
 
 		self.currentIndex = 1
-		for i in self.seedNodes:
+		self.sequence = []
+		for i in self.graph.topologicalOrder(self.allNodes):
 			self.setIndex(i)
-			testSet = self.passedNodes.union({i})
-			between = self.graph.getNodesBetween(testSet, include=True)
-			for n in between:
-				self.setIndexBranchSafe(n)
-		# donezo????????????
-
-	def setIndexBranchSafe(self, node:GraphNode):
-		"""sets index of target, or looks back til it finds a node with an index"""
-		if node.index:
-			return
-		for i in node.directHistory:
-			if not i.index:
-				self.setIndexBranchSafe(i)
-		self.setIndex(node)
 
 	def setIndex(self, node):
 		"""sets node index to current index and increments"""
@@ -95,7 +86,21 @@ class ExecutionPath(object):
 		"""gets execution path to nodes"""
 		path = ExecutionPath(graph)
 		path.setNodes(targets)
-		path.resetIndices()
+		path.buildToNodes()
+		return path
+
+	@staticmethod
+	def getExecPathForNodes(graph:"Graph"=None,
+	                        nodes:T.Set[GraphNode]=None)->ExecutionPath:
+		"""gets execution path over exactly the given nodes -
+		they must already include their own history, so no
+		traversal is done. seeds are those with no edges in"""
+		path = ExecutionPath(graph)
+		path.passedNodes = set(nodes)
+		path.seedNodes = {i for i in nodes
+		                  if not graph.nodeEdges(i, outputs=False)}
+		path.boundaryNodes = path.passedNodes.union(path.seedNodes)
+		path.allNodes = set(path.boundaryNodes)
 		path.buildToNodes()
 		return path
 
@@ -103,7 +108,10 @@ class ExecutionPath(object):
 	def getExecPathToAll(graph=None):
 		"""execute everything"""
 		path = ExecutionPath(graph)
-		path.setNodes(graph.nodes)
-		path.resetIndices()
-		path.buildToNodes() #?
+		# no need to gather history when every node is included
+		path.passedNodes = set(graph.nodes)
+		path.seedNodes = graph.getSeedNodes()
+		path.boundaryNodes = path.passedNodes.union(path.seedNodes)
+		path.allNodes = set(path.boundaryNodes)
+		path.buildToNodes()
 		return path
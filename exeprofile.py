@@ -0,0 +1,217 @@
+"""instrumentation for graph execution -
+records wall and cpu time of each node's pre-, main and post-execution,
+time spent queued in parallel modes, the thread and process each
+phase ran on, and optionally the peak memory allocated during it.
+
+results export to a chrome trace_event json (open in chrome://tracing
+or perfetto), or a sorted text summary
+"""
+
+from __future__ import annotations
+
+import typing as T
+import json, os, threading, time, tracemalloc
+from collections import namedtuple, defaultdict
+from pathlib import Path
+
+if T.TYPE_CHECKING:
+	from treegraph.node import GraphNode
+
+
+PhaseRecord = namedtuple("PhaseRecord", (
+	"nodeName", "nodeUid", "phase",
+	"start", "wall", "cpu",
+	"threadId", "threadName", "pid",
+	"memoryDelta"))
+
+
+class PhaseTimer(object):
+	"""context manager measuring a single phase on the current thread -
+	timing is available as a dict after exit.
+	perf_counter is system-wide monotonic, so start times from
+	worker processes line up with the main process"""
+
+	def __init__(self, trackMemory=False):
+		self.trackMemory = trackMemory and tracemalloc.is_tracing()
+		self.timing = {}
+
+	def __enter__(self):
+		if self.trackMemory:
+			self._memStart = tracemalloc.get_traced_memory()[0]
+			tracemalloc.reset_peak()
+		self._cpuStart = time.thread_time()
+		self._start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		end = time.perf_counter()
+		cpuEnd = time.thread_time()
+		memoryDelta = None
+		if self.trackMemory:
+			memoryDelta = tracemalloc.get_traced_memory()[1] - self._memStart
+		thread = threading.current_thread()
+		self.timing = {
+			"start" : self._start,
+			"wall" : end - self._start,
+			"cpu" : cpuEnd - self._cpuStart,
+			"threadId" : thread.ident,
+			"threadName" : thread.name,
+			"pid" : os.getpid(),
+			"memoryDelta" : memoryDelta,
+		}
+
+
+class ExecutionProfiler(object):
+	"""collects PhaseRecords over one or more executions -
+	pass to GraphStateComponent.executeNodes.
+	if trackMemory, tracemalloc is started for the profiler's lifetime -
+	in parallel modes memory is shared between concurrent nodes,
+	so per-node deltas are approximate"""
+
+	phases = ("preExecution", "execute", "postExecution")
+
+	def __init__(self, trackMemory=False):
+		self.trackMemory = trackMemory
+		self.records = [] #type: T.List[PhaseRecord]
+		self.queueWaits = {} #type: T.Dict[str, float]
+		self._queuedTimes = {} #type: T.Dict[str, float]
+		self._lock = threading.Lock()
+		self._startedTracing = False
+		self.active = False
+
+	def __enter__(self):
+		self.active = True
+		if self.trackMemory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self._startedTracing = True
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.active = False
+		if self._startedTracing:
+			tracemalloc.stop()
+			self._startedTracing = False
+
+	def clear(self):
+		with self._lock:
+			self.records.clear()
+			self.queueWaits.clear()
+			self._queuedTimes.clear()
+
+	# region recording
+	def addRecord(self, node:GraphNode, phase:str, timing:T.Dict):
+		"""add record from timing dict produced by a PhaseTimer"""
+		record = PhaseRecord(node.name, str(node.uid), phase, **timing)
+		with self._lock:
+			self.records.append(record)
+			queued = self._queuedTimes.pop(record.nodeUid, None)
+			if queued is not None and phase == "execute":
+				self.queueWaits[record.nodeUid] = max(
+					0.0, record.start - queued)
+
+	def phase(self, node:GraphNode, phase:str)->"_ProfiledPhase":
+		"""context manager recording one phase of node"""
+		return _ProfiledPhase(self, node, phase)
+
+	def wrapPhase(self, node:GraphNode, phase:str,
+	              fn:T.Callable)->T.Callable:
+		"""return function recording phase when called,
+		on whichever thread runs it"""
+		def _profiled(*args, **kwargs):
+			with self.phase(node, phase):
+				return fn(*args, **kwargs)
+		return _profiled
+
+	def markQueued(self, node:GraphNode):
+		"""call when node is submitted to a pool"""
+		with self._lock:
+			self._queuedTimes[str(node.uid)] = time.perf_counter()
+	#endregion
+
+	# region output
+	def nodeTotals(self)->T.List[T.Dict]:
+		"""per-node totals, most expensive first"""
+		totals = defaultdict(lambda : {"wall" : 0.0, "cpu" : 0.0,
+		                               "memoryDelta" : None})
+		for i in self.records:
+			entry = totals[i.nodeUid]
+			entry["name"] = i.nodeName
+			entry[i.phase] = entry.get(i.phase, 0.0) + i.wall
+			entry["wall"] += i.wall
+			entry["cpu"] += i.cpu
+			if i.memoryDelta is not None:
+				entry["memoryDelta"] = max(entry["memoryDelta"] or 0,
+				                           i.memoryDelta)
+			entry["queue"] = self.queueWaits.get(i.nodeUid, 0.0)
+			entry["pids"] = entry.get("pids", set()) | {i.pid}
+		return sorted(totals.values(), key=lambda x: x["wall"], reverse=True)
+
+	def summary(self, limit:int=None)->str:
+		"""text table of node timings, sorted by total wall time"""
+		header = "{:<32} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12}".format(
+			"node", "total ms", "cpu ms", "pre ms", "exec ms", "post ms",
+			"queue ms", "peak mem")
+		lines = [header, "-" * len(header)]
+		for entry in self.nodeTotals()[:limit]:
+			lines.append(
+				"{:<32} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>12}".format(
+				entry["name"][:32],
+				entry["wall"] * 1000, entry["cpu"] * 1000,
+				entry.get("preExecution", 0.0) * 1000,
+				entry.get("execute", 0.0) * 1000,
+				entry.get("postExecution", 0.0) * 1000,
+				entry["queue"] * 1000,
+				"-" if entry["memoryDelta"] is None else entry["memoryDelta"]
+			))
+		return "\n".join(lines)
+
+	def toChromeTrace(self)->T.Dict:
+		"""return chrome trace_event dict of complete events,
+		timestamps in microseconds from first recorded phase"""
+		if not self.records:
+			return {"traceEvents" : [], "displayTimeUnit" : "ms"}
+		origin = min(i.start for i in self.records)
+		events = []
+		threadNames = {}
+		for i in self.records:
+			args = {"cpu_ms" : i.cpu * 1000, "uid" : i.nodeUid}
+			if i.memoryDelta is not None:
+				args["peak_memory_bytes"] = i.memoryDelta
+			if i.phase == "execute" and i.nodeUid in self.queueWaits:
+				args["queue_ms"] = self.queueWaits[i.nodeUid] * 1000
+			events.append({
+				"name" : "{} : {}".format(i.nodeName, i.phase),
+				"cat" : i.phase,
+				"ph" : "X",
+				"ts" : (i.start - origin) * 1e6,
+				"dur" : i.wall * 1e6,
+				"pid" : i.pid,
+				"tid" : i.threadId,
+				"args" : args,
+			})
+			threadNames[(i.pid, i.threadId)] = i.threadName
+		for (pid, tid), name in threadNames.items():
+			events.append({"name" : "thread_name", "ph" : "M",
+			               "pid" : pid, "tid" : tid,
+			               "args" : {"name" : name}})
+		return {"traceEvents" : events, "displayTimeUnit" : "ms"}
+
+	def saveChromeTrace(self, path:T.Union[str, Path]):
+		with open(path, "w") as f:
+			json.dump(self.toChromeTrace(), f)
+	#endregion
+
+
+class _ProfiledPhase(PhaseTimer):
+	"""phase timer adding its record to a profiler on exit"""
+
+	def __init__(self, profiler:ExecutionProfiler, node:GraphNode, phase:str):
+		super(_ProfiledPhase, self).__init__(trackMemory=profiler.trackMemory)
+		self.profiler = profiler
+		self.node = node
+		self.phaseName = phase
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		super(_ProfiledPhase, self).__exit__(exc_type, exc_val, exc_tb)
+		self.profiler.addRecord(self.node, self.phaseName, self.timing)
+
@@ -10,9 +10,10 @@ import typing as Ty
 
 from functools import partial
 
-import pprint, inspect, itertools
-from weakref import WeakSet, WeakValueDictionary
-from collections import defaultdict
+import pprint, inspect, itertools, os
+from weakref import WeakSet, WeakValueDictionary, WeakKeyDictionary
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
 from functools import partial
 from enum import Enum
 
@@ -21,9 +22,11 @@ from tree import Tree, Signal
 from treegraph.node import GraphNode
 from treegraph.attr import NodeAttr
 from treegraph.edge import GraphEdge
+from treegraph.edgetable import EdgeTable
 from treegraph.group import NodeSet
 
 from treegraph.exepath import ExecutionPath
+from treegraph.topology import TopologicalOrder, DisjointSet
 
 
 #from treegraph.plugin import defaultNodes
@@ -32,6 +35,19 @@ from treegraph.catalogue import ClassCatalogue
 
 from treegraph.functionset import GraphFunctionSet
 
+if TYPE_CHECKING:
+	from treegraph.execache import NodeResultCache
+	from treegraph.graphjournal import ChangeTracker
+	from treegraph.exegraph import DeferredStateSignals
+
+# aggregated changes emitted once at the end of Graph.batch()
+BatchChanges = namedtuple("BatchChanges", (
+	"addedNodes", "removedNodes",
+	"addedEdges", "removedEdges",
+	"addedSets", "removedSets",
+	"migratedNodes"))
+
+
 class Graph(
 	#Tree
 	GraphNode # maybe a bad idea
@@ -94,14 +110,63 @@ class Graph(
 	             ):
 		super(Graph, self).__init__(name=name, uid=uid)
 		#self.edges = set() # single source of truth on edges
-
-		def _edgeItemFactory():
-			return WeakSet()
-		self.attrEdgeMap = defaultdict(_edgeItemFactory) #type: Dict[NodeAttr, Set[GraphEdge]]
+		# columnar store of edge rows, and the only record of edges -
+		# GraphEdges are views into it, made on demand
+		self.edgeTable = EdgeTable(self)
+
+		# adjacency index, kept up to date by addEdge / deleteEdge / deleteNode
+		# { node : { neighbour node : number of edges between them } }
+		self._historyMap = {} #type: Dict[GraphNode, Dict[GraphNode, int]]
+		self._futureMap = {} #type: Dict[GraphNode, Dict[GraphNode, int]]
+
+		# topology generation increments on every node or edge change -
+		# transitive history / future is cached against it
+		self._topologyGeneration = 0
+		self._inlineCacheGeneration = 0
+		# { (node, future) : all nodes reachable in that direction }
+		self._inlineCache = {} #type: Dict[Tuple[GraphNode, bool], T.FrozenSet[GraphNode]]
+		# topological order of nodes, repaired as edges are added
+		self._topoOrder = TopologicalOrder()
+		# connected components, merged as edges are added -
+		# rebuilt lazily once any edge or node is removed
+		self._islands = DisjointSet()
+		self._islandsStale = False
+
+		# nodes whose results are out of date - anything downstream
+		# of a dirty node is also dirty
+		self._dirtyNodes = set() #type: Set[GraphNode]
+		# results of evaluate() are reused within one epoch
+		self._evaluationEpoch = 0
+		# { node : epoch it was last evaluated in }
+		self._evaluatedEpochs = WeakKeyDictionary() #type: Dict[GraphNode, int]
+
+		# lookup of direct child nodes, kept up to date from
+		# structureChanged and each node's nameChanged
+		self._uidNodeMap = {} #type: Dict[str, GraphNode]
+		self._nameNodeMap = {} #type: Dict[str, List[GraphNode]]
+		self._nameWatchedNodes = WeakSet() #type: Set[GraphNode]
+
+		# { node uid : hash of node's stored state when last saved
+		# or loaded } - lets folder saves skip unchanged nodes
+		self.savedRecordHashes = {} #type: Dict[str, str]
+		# records changes since last save, for saveIncremental()
+		self.changeTracker = None #type: ChangeTracker
+
+		# optional NodeResultCache used during execution
+		self.resultCache = None #type: NodeResultCache
+
+		# batch editing - see batch()
+		self._batchDepth = 0
+		# { change field : { item : None } }, ordered and deduplicated
+		self._batchChanges = None #type: Dict[str, Dict]
+		self._lazyTopology = False
+		self._batchEdges = [] #type: List[GraphEdge]
+		# { batch edge : source attr of the edge it replaced }
+		self._batchReplaced = {} #type: Dict[GraphEdge, NodeAttr]
+		self._batchDirtySeeds = set() #type: Set[GraphNode]
 
 		#self.selectedNodes = []
 		self.setProperty("nodeSets", {})
-		self.setProperty("edges", set())
 
 		self.transforms = {} # map of node
 
@@ -112,7 +177,16 @@ class Graph(
 		self.nodeChanged = self.structureChanged
 		# nodeSetsChanged signature : node set, event type
 		self.nodeSetsChanged = Signal()
+		# batchChanged signature : BatchChanges
+		self.batchChanged = Signal()
+		# emits { node : state } snapshots while node state signals
+		# are deferred during execution
+		self.nodeStatesChanged = Signal()
+		self.deferredStateSignals = None #type: DeferredStateSignals
 		self.wireSignals()
+		self.structureChanged.connect(self._onNodeStructureChanged)
+		for i in self.nodes:
+			self._indexNode(i)
 
 		self._isAcyclic = True
 
@@ -145,11 +219,27 @@ class Graph(
 	def isAcyclic(self)->bool:
 		return self._isAcyclic
 	def setAcyclic(self, state:bool):
+		if state and not self._isAcyclic:
+			cyclic = self._topoOrder.rebuild(self.nodes, self._directFuture)
+			if cyclic:
+				raise RuntimeError("graph contains cycles through {}, "
+				                   "cannot be set acyclic".format(
+					[i.name for i in cyclic]))
 		self._isAcyclic = state
 
 	@property
 	def edges(self)->Set[GraphEdge]:
-		return self.getProperty("edges")
+		"""views of every edge in graph"""
+		return set(self.edgeTable.edges(self.edgeTable.liveRows()))
+
+	@property
+	def topologyGeneration(self)->int:
+		"""counter incremented whenever nodes or edges change"""
+		return self._topologyGeneration
+
+	def topologyChanged(self):
+		"""invalidates all cached topology queries"""
+		self._topologyGeneration += 1
 
 	@property
 	def nodeSets(self)->Dict[str, NodeSet]:
@@ -157,9 +247,12 @@ class Graph(
 
 	@property
 	def nodes(self)->List[GraphNode]:
-		"""DOES NOT exclude child graphs"""
-		return [i for i in self.branches if isinstance(i, GraphNode)
-		        ]
+		"""DOES NOT exclude child graphs
+		child nodes come from the graph's index, not its own stored
+		state, so listing them never loads an unloaded subgraph"""
+		with self.loadDeferred():
+			return [i for i in self.branches if isinstance(i, GraphNode)
+			        ]
 
 	@property
 	def subGraphs(self)->List[Graph]:
@@ -184,7 +277,18 @@ class Graph(
 
 	def clearSession(self):
 		#self.nodeGraph.clear()
-		self.edges.clear()
+		self.edgeTable.clear()
+		self._batchEdges.clear()
+		self._batchReplaced.clear()
+		for i in (self._historyMap, self._futureMap):
+			i.clear()
+		self._topoOrder.clear()
+		self._islands.clear()
+		self._islandsStale = False
+		self._evaluatedEpochs.clear()
+		self._uidNodeMap.clear()
+		self._nameNodeMap.clear()
+		self.topologyChanged()
 		for i in self.branches:
 			if i.name in self.reservedKeys:
 				continue
@@ -207,8 +311,15 @@ class Graph(
 	#region node class processing
 	@property
 	def registeredNodeClasses(self)->Dict[str, type]:
-		"""dict of { class name, class object } for nodes"""
-		return {i.__name__ : i for i in  self.classCatalogue.classes}
+		"""dict of { class name, class object } for nodes -
+		imports any classes not loaded yet, so prefer
+		nodeClassFromName() and registeredClassNames"""
+		return {i : self.classCatalogue.classFromName(i)
+		        for i in self.classCatalogue.classNames()}
+
+	def nodeClassFromName(self, name:str)->T.Optional[T.Type[GraphNode]]:
+		"""return registered node class, importing it on first use"""
+		return self.classCatalogue.classFromName(name)
 
 	@classmethod
 	def registerNodeClasses(cls,
@@ -216,20 +327,159 @@ class Graph(
 		"""updates class catalogue with given classes"""
 		cls.classCatalogue.registerClasses(toRegister)
 
+	def migrateNodeClasses(self, classMap:Dict[type, type])->List[GraphNode]:
+		"""switch nodes of old classes over to new ones in place,
+		as after reloading their module - identity, attrs, settings
+		and edges are kept. each graph is migrated in one batch,
+		listing its own migrated nodes in migratedNodes.
+		subgraphs are migrated too - returns all migrated nodes"""
+		migrated = []
+		with self.batch():
+			for node in self.nodes:
+				newClass = classMap.get(type(node))
+				if newClass is not None:
+					try:
+						node.__class__ = newClass
+						migrated.append(node)
+						self._batchChanges["migratedNodes"][node] = None
+					except TypeError as e:
+						self.log("could not migrate {} to {}: {}".format(
+							node, newClass, e))
+				if isinstance(node, Graph):
+					migrated.extend(node.migrateNodeClasses(classMap))
+			if self.changeTracker is not None:
+				# class path is saved in node records
+				self.changeTracker.changedNodes.update(
+					i for i in migrated if i.parent is self)
+		return migrated
+
 	@property
 	def registeredClassNames(self):
-		return list(self.registeredNodeClasses.keys())
+		return self.classCatalogue.classNames()
 
 	# endregion
 
 	@property
 	def knownUIDs(self):
-		return [i.uid for i in self.nodes]
+		return list(self._uidNodeMap.keys())
 
 	@property
 	def knownNames(self):
-		# return [i["node"].name for i in list(self.nodeGraph.values())]
-		return [i.name for i in self.nodes]
+		return [k for k, v in self._nameNodeMap.items() if v]
+
+	#region node lookup index
+	def _indexNode(self, node:GraphNode):
+		self._uidNodeMap[node.uid] = node
+		nameNodes = self._nameNodeMap.setdefault(node.name, [])
+		if node not in nameNodes:
+			nameNodes.append(node)
+		if node not in self._nameWatchedNodes:
+			node.nameChanged.connect(self._onNodeNameChanged)
+			self._nameWatchedNodes.add(node)
+
+	def _unindexNode(self, node:GraphNode):
+		if self._uidNodeMap.get(node.uid) is node:
+			del self._uidNodeMap[node.uid]
+		nameNodes = self._nameNodeMap.get(node.name, [])
+		if node in nameNodes:
+			nameNodes.remove(node)
+
+	def _onNodeStructureChanged(self, branch, parent=None, oldParent=None,
+	                            eventType=Tree.StructureEvents.branchAdded):
+		if not isinstance(branch, GraphNode):
+			return
+		if eventType == Tree.StructureEvents.branchAdded:
+			if branch.parent is self:
+				self._indexNode(branch)
+				self._recordChange("addedNodes", "removedNodes", branch)
+		elif eventType in (Tree.StructureEvents.beforeBranchRemoved,
+		                   Tree.StructureEvents.branchRemoved):
+			if self._uidNodeMap.get(branch.uid) is branch:
+				self._recordChange("removedNodes", "addedNodes", branch)
+			self._unindexNode(branch)
+
+	def _onNodeNameChanged(self, branch, newName, oldName):
+		# nodes stay connected after removal, so check node is still ours
+		if self._uidNodeMap.get(branch.uid) is not branch:
+			return
+		oldNodes = self._nameNodeMap.get(oldName, [])
+		if branch in oldNodes:
+			oldNodes.remove(branch)
+		newNodes = self._nameNodeMap.setdefault(newName, [])
+		if branch not in newNodes:
+			newNodes.append(branch)
+	#endregion
+
+	#region batch editing
+	@property
+	def isBatching(self)->bool:
+		"""True inside a batch() block - per-item edge, node and set
+		events are held back until the block exits"""
+		return self._batchDepth > 0
+
+	@contextmanager
+	def batch(self):
+		"""group many edits into one -
+		topological order and dirty state are only updated on exit,
+		then batchChanged is emitted once with every change made.
+		edges found to close a cycle on exit are rejected.
+		batches may be nested, only the outermost one does any work"""
+		if not self._batchDepth:
+			self._batchChanges = {i : {} for i in BatchChanges._fields}
+			self._lazyTopology = True
+		self._batchDepth += 1
+		try:
+			yield self
+		finally:
+			self._batchDepth -= 1
+			if not self._batchDepth:
+				self._endBatch()
+				changes = BatchChanges(
+					**{k : list(v) for k, v in self._batchChanges.items()})
+				self._batchChanges = None
+				if any(changes):
+					self.batchChanged(changes)
+
+	def _endBatch(self):
+		"""rebuild topology deferred during batch, rejecting
+		any batch edges that close cycles"""
+		self._lazyTopology = False
+		batchEdges, self._batchEdges = self._batchEdges, []
+		replacedSources, self._batchReplaced = self._batchReplaced, {}
+		nodes = set(self._topoOrder).union(self.nodes)
+		cyclic = self._topoOrder.rebuild(nodes, self._directFuture)
+		if cyclic and self.isAcyclic:
+			# pull out every batch edge inside the cycles, then add
+			# them back one by one, so only those closing a cycle fail
+			suspects = [i for i in batchEdges if i.isLive
+			            and i.sourceNode in cyclic and i.destNode in cyclic]
+			attrs = [(i.sourceAttr, i.destAttr, replacedSources.get(i))
+			         for i in suspects]
+			for i in suspects:
+				self.deleteEdge(i)
+			cyclic = self._topoOrder.rebuild(nodes, self._directFuture)
+			for sourceAttr, destAttr, replacedSource in attrs:
+				if not self.addEdge(sourceAttr, destAttr) and \
+						replacedSource is not None:
+					# rejected edge doesn't take the place of the old one
+					self.addEdge(replacedSource, destAttr)
+		dirtySeeds, self._batchDirtySeeds = self._batchDirtySeeds, set()
+		for i in dirtySeeds:
+			self.markDirty(i)
+		self.topologyChanged()
+
+	def _recordChange(self, field:str, opposite:str, item)->bool:
+		"""record item change if batching - an item added and removed
+		within the same batch cancels out.
+		returns False if not batching, and event should be emitted"""
+		if self._batchChanges is None:
+			return False
+		if item in self._batchChanges[opposite]:
+			del self._batchChanges[opposite][item]
+		else:
+			self._batchChanges[field][item] = None
+		return True
+	#endregion
 
 	### region node creation and deletion
 
@@ -238,9 +488,9 @@ class Graph(
 		does not directly add node to graph
 		"""
 
-		if not nodeType in self.registeredClassNames:
+		nodeClass = self.nodeClassFromName(nodeType)
+		if nodeClass is None:
 			raise RuntimeError("nodeType "+nodeType+" not registered in graph")
-		nodeClass = self.registeredNodeClasses[nodeType]
 		newInstance = nodeClass(name=name or nodeClass.__name__,
 		                          )
 		if add:
@@ -252,8 +502,28 @@ class Graph(
 		"""adds a node to the active graph"""
 		# add node as branch
 		self.addChild(node)
+		self._topoOrder.add(node)
+		self._islands.add(node)
+		self.topologyChanged()
+		self.markDirty(node)
 		return node
 
+	def addNodes(self, specs:T.Iterable[T.Tuple[T.Union[str, T.Type[GraphNode]], str]]
+	             )->List[GraphNode]:
+		"""create and add many nodes in one batch
+		:param specs: (node type, name) pairs - type may be a
+			registered class name or a node class
+		:returns list of new nodes, in order given"""
+		nodes = []
+		with self.batch():
+			for nodeType, name in specs:
+				if isinstance(nodeType, str):
+					nodes.append(self.createNode(nodeType, name))
+				else:
+					nodes.append(self.addNode(
+						nodeType(name=name or nodeType.__name__)))
+		return nodes
+
 	def deleteNode(self, node:GraphNode):
 		if self.state != self.State.neutral:
 			return False
@@ -261,6 +531,12 @@ class Graph(
 			self.deleteEdge(i)
 		for i in self.nodeSets.keys():
 			self.removeNodeFromSet(node, i)
+		for i in (self._historyMap, self._futureMap):
+			i.pop(node, None)
+		self._topoOrder.remove(node)
+		self._islandsStale = True
+		self._dirtyNodes.discard(node)
+		self.topologyChanged()
 
 		self.remove(node,
 		            #delete=True
@@ -271,13 +547,12 @@ class Graph(
 	#endregion
 
 	### region node querying
-	def nodesFromName(self, name):
+	def nodesFromName(self, name)->List[GraphNode]:
 		"""may by its nature return multiple nodes"""
-		return [i for i in self.nodes if i.name == name]
+		return list(self._nameNodeMap.get(name, ()))
 
-	def nodeFromUID(self, uid):
-		# return self.nodeGraph[uid]["node"]
-		return [i for i in self.nodes ]
+	def nodeFromUID(self, uid)->T.Optional[GraphNode]:
+		return self._uidNodeMap.get(uid)
 
 	def getNode(self, node)->Union[GraphNode, Dict]:
 		"""returns an GraphNode object from
@@ -286,7 +561,8 @@ class Graph(
 		if isinstance(node, GraphNode):
 			node = node
 		elif isinstance(node, str):
-			node = self.nodesFromName(node)[0] # don't do this
+			node = self.nodeFromUID(node) or \
+			       (self.nodesFromName(node) or [None])[0]
 		elif isinstance(node, int):
 			node = self.nodeFromUID(node)
 		elif isinstance(node, NodeAttr):
@@ -302,7 +578,8 @@ class Graph(
 	### region adding edges
 	def addEdge(self, sourceAttr:NodeAttr, destAttr:NodeAttr, newEdge=None):
 		"""adds edge between two attributes
-		DOES NOT CHECK LEGALITY
+		only checks for cycles, as part of repairing topological order -
+		returns False if edge is rejected
 		edges in future should not use bidirectional references -
 		only inputs know their own drivers - outputs know nothing
 		"""
@@ -311,32 +588,177 @@ class Graph(
 
 			return False
 
-		self.log( "")
-		self.log( " ADDING EDGE")
-		newEdge = newEdge or GraphEdge(
-			source=sourceAttr, dest=destAttr, graph=self)
+		if not self.isBatching:
+			self.log( "")
+			self.log( " ADDING EDGE")
+		sourceNode, destNode = sourceAttr.node, destAttr.node
 
-		# add edge to master edge set
-		self.edges.add(newEdge)
-		self.attrEdgeMap[sourceAttr].add(newEdge)
+		if self._lazyTopology:
+			# order is rebuilt once batch exits
+			if sourceNode is destNode:
+				return False
+		elif self.isAcyclic and not self._topoOrder.insertEdge(
+				sourceNode, destNode,
+				self._directFuture, self._directHistory):
+			self.log("edge from {} to {} would create a cycle, skipping".format(
+				sourceNode.name, destNode.name))
+			return False
 
 		# remove existing dest connections
-		self.attrEdgeMap[destAttr].clear()
-		self.attrEdgeMap[destAttr].add(newEdge)
-		self.edgesChanged(newEdge, self.EdgeEvents.added)
+		replaced = None
+		for i in self.attrEdges(destAttr):
+			if i.destAttr is destAttr:
+				replaced = i.sourceAttr
+				self.deleteEdge(i)
+
+		# add row to edge table - any edge given becomes its view
+		row = self.edgeTable.addRow(sourceAttr, destAttr)
+		if newEdge is None:
+			newEdge = self.edgeTable.edge(row)
+		else:
+			newEdge.bind(self.edgeTable, row)
+		if self._lazyTopology:
+			self._batchEdges.append(newEdge)
+			if replaced is not None:
+				self._batchReplaced[newEdge] = replaced
+		self._indexEdge(newEdge)
+		if not self._recordChange("addedEdges", "removedEdges", newEdge):
+			self.edgesChanged(newEdge, self.EdgeEvents.added)
 		return newEdge
 
 
+	def addEdges(self, pairs:T.Iterable[T.Tuple[NodeAttr, NodeAttr]],
+	             rejected:List[T.Tuple[NodeAttr, NodeAttr]]=None
+	             )->List[GraphEdge]:
+		"""add many edges in one batch - whole batch is checked
+		for cycles in a single topological pass before anything
+		is added, raising RuntimeError if any would be created.
+		as with addEdge, a later edge into the same dest attr
+		replaces an earlier one.
+		pairs addEdge still refuses are logged, and appended to
+		rejected if given
+		:returns list of new edges"""
+		# last edge into each dest attr wins
+		destSources = {} #type: Dict[NodeAttr, NodeAttr]
+		for sourceAttr, destAttr in pairs:
+			if sourceAttr.node is destAttr.node:
+				raise RuntimeError("cannot connect {} to its own node".format(
+					sourceAttr))
+			if self.isAcyclic and (
+					sourceAttr.role == NodeAttr.Roles.Input or
+					destAttr.role == NodeAttr.Roles.Output):
+				raise RuntimeError("connection from {} to {} is in the "
+				                   "wrong order".format(sourceAttr, destAttr))
+			destSources.pop(destAttr, None)
+			destSources[destAttr] = sourceAttr
+
+		if self.isAcyclic:
+			cyclic = self._batchEdgeCycles(destSources)
+			if cyclic:
+				raise RuntimeError("edges would create cycles through {}".format(
+					sorted(i.name for i in cyclic)))
+
+		edges = []
+		with self.batch():
+			for destAttr, sourceAttr in destSources.items():
+				edge = self.addEdge(sourceAttr, destAttr)
+				if edge:
+					edges.append(edge)
+				else:
+					self.log("edge from {} to {} rejected".format(
+						sourceAttr, destAttr))
+					if rejected is not None:
+						rejected.append((sourceAttr, destAttr))
+		return edges
+
+	def connectMany(self, sourceAttr:NodeAttr,
+	                destAttrs:T.Iterable[NodeAttr],
+	                rejected:List[T.Tuple[NodeAttr, NodeAttr]]=None
+	                )->List[GraphEdge]:
+		"""connect one source attr to every dest attr given -
+		see addEdges for rejected"""
+		return self.addEdges(((sourceAttr, i) for i in destAttrs),
+		                     rejected=rejected)
+
+	def _batchEdgeCycles(self, destSources:Dict[NodeAttr, NodeAttr]
+	                     )->Set[GraphNode]:
+		"""return nodes left in cycles if existing edges into dest attrs
+		were replaced by edges from their new source attrs"""
+		removed = defaultdict(lambda : defaultdict(int))
+		added = defaultdict(list)
+		for destAttr, sourceAttr in destSources.items():
+			for edge in self.attrEdges(destAttr):
+				if edge.destAttr is destAttr:
+					removed[edge.sourceNode][edge.destNode] += 1
+			added[sourceAttr.node].append(destAttr.node)
+
+		def _successors(node):
+			result = [n for n, count in self._futureMap.get(node, {}).items()
+			          if count > removed.get(node, {}).get(n, 0)]
+			result.extend(added.get(node, ()))
+			return result
+
+		nodes = set(self._topoOrder).union(self.nodes)
+		for destAttr, sourceAttr in destSources.items():
+			nodes.add(sourceAttr.node)
+			nodes.add(destAttr.node)
+		return TopologicalOrder().rebuild(nodes, _successors)
+
 	def deleteEdge(self, edge):
 		if self.state != self.State.neutral:
 			print("graph state is not neutral, skipping")
 			return False
 		# in theory this should be it
-		self.edges.remove(edge)
-		self.edgesChanged(edge, self.EdgeEvents.removed)
-		print("graph deleteEdge complete")
+		# any view of the edge can be given, and stays readable after
+		if not edge.isLive or edge.table is not self.edgeTable:
+			return False
+		self.edgeTable.removeRow(edge.row)
+		self._unindexEdge(edge)
+		if not self._recordChange("removedEdges", "addedEdges", edge):
+			self.edgesChanged(edge, self.EdgeEvents.removed)
+			print("graph deleteEdge complete")
 		return
 
+	def _indexEdge(self, edge:GraphEdge):
+		"""add edge to adjacency index"""
+		source, dest = edge.sourceNode, edge.destNode
+		future = self._futureMap.setdefault(source, {})
+		future[dest] = future.get(dest, 0) + 1
+		history = self._historyMap.setdefault(dest, {})
+		history[source] = history.get(source, 0) + 1
+		if not self._islandsStale:
+			self._islands.union(source, dest)
+		self.topologyChanged()
+		self.markDirty(dest)
+
+	def _unindexEdge(self, edge:GraphEdge):
+		"""remove edge from adjacency index - neighbours are only
+		forgotten once their last edge is removed"""
+		source, dest = edge.sourceNode, edge.destNode
+		for nodeMap, node, other in (
+				(self._futureMap, source, dest),
+				(self._historyMap, dest, source)):
+			counts = nodeMap.get(node)
+			if not counts or other not in counts:
+				continue
+			counts[other] -= 1
+			if not counts[other]:
+				del counts[other]
+		self._islandsStale = True
+		self.topologyChanged()
+		self.markDirty(dest)
+
+	def _directFuture(self, node:GraphNode)->T.Iterable[GraphNode]:
+		return self._futureMap.get(node, ())
+
+	def _directHistory(self, node:GraphNode)->T.Iterable[GraphNode]:
+		return self._historyMap.get(node, ())
+
+	def edgeMultiplicity(self, source:GraphNode, dest:GraphNode)->int:
+		"""return number of edges running from source node
+		to dest node"""
+		return self._futureMap.get(source, {}).get(dest, 0)
+
 
 	def nodeEdges(self, node:GraphNode, outputs=False,
 	              all=False)->Set[GraphEdge]:
@@ -346,23 +768,30 @@ class Graph(
 		if all:
 			return self.nodeEdges(node, outputs=True).union(
 				self.nodeEdges(node, outputs=False)	)
-		# edges = WeakSet()
-		edges = set()
-		tree = node.outputRoot if outputs else node.inputRoot
-		for i in tree.allBranches():
-			edges.update(self.attrEdgeMap[i])
-		return edges
+		rows = self.edgeTable.rowsOut(node) if outputs \
+			else self.edgeTable.rowsIn(node)
+		return set(self.edgeTable.edges(rows))
+
+	def attrEdges(self, attr:NodeAttr)->Set[GraphEdge]:
+		"""return edges to or from attr"""
+		return set(self.edgeTable.edges(self.edgeTable.rowsOfAttr(attr)))
+
+	def edgesInto(self, nodes:T.Iterable[GraphNode])->List[GraphEdge]:
+		"""all edges with dest node in nodes, queried
+		over the whole edge table at once"""
+		return self.edgeTable.edges(self.edgeTable.rowsInto(nodes))
+
+	def edgesFrom(self, nodes:T.Iterable[GraphNode])->List[GraphEdge]:
+		"""all edges with source node in nodes"""
+		return self.edgeTable.edges(self.edgeTable.rowsFrom(nodes))
 
 	def adjacentNodes(self, node, future=True, history=True)->Set[GraphNode]:
 		"""return direct neighbours of node"""
-		# nodes = WeakSet()
 		nodes = set()
 		if future:
-			for i in self.nodeEdges(node, outputs=True):
-				nodes.add(i.destAttr.node)
+			nodes.update(self._futureMap.get(node, ()))
 		if history:
-			for i in self.nodeEdges(node, outputs=False):
-				nodes.add(i.sourceAttr.node)
+			nodes.update(self._historyMap.get(node, ()))
 		return nodes
 
 	# endregion
@@ -396,22 +825,48 @@ class Graph(
 		return future
 
 	def getInlineNodes(self, node:GraphNode, history=True, future=True,
-	                   )->Set[GraphNode]:
+	                   )->T.AbstractSet[GraphNode]:
 		"""gets all nodes directly in the path of selected node
 		forwards and backwards is handy way of working out islands
-		can't work out how to factor out the copying"""
-		inline = set()
+		single-direction results are cached frozensets, don't modify them"""
+		if history and future:
+			return self._walkInline(node, future=False).union(
+				self._walkInline(node, future=True))
 		if future:
-			for n in self.adjacentNodes(node, history=False, future=True):
-				inline.add(n)
-				inline.update(self.getInlineNodes(
-						n, history=False, future=True))
+			return self._walkInline(node, future=True)
 		if history:
-			for n in self.adjacentNodes(node, history=True, future=False):
-				inline.add(n)
-				inline.update(self.getInlineNodes(
-						n, history=True, future=False))
-		return inline
+			return self._walkInline(node, future=False)
+		return frozenset()
+
+	def _walkInline(self, node:GraphNode, future=True)->T.FrozenSet[GraphNode]:
+		"""iterative search of all nodes upstream or downstream of node,
+		visiting each node once.
+		results are cached until the topology generation changes"""
+		if self._inlineCacheGeneration != self._topologyGeneration:
+			self._inlineCache.clear()
+			self._inlineCacheGeneration = self._topologyGeneration
+		result = self._inlineCache.get((node, future))
+		if result is not None:
+			return result
+
+		nodeMap = self._futureMap if future else self._historyMap
+		found = set()
+		toVisit = list(nodeMap.get(node, ()))
+		while toVisit:
+			n = toVisit.pop()
+			if n in found:
+				continue
+			found.add(n)
+			# anything cached beyond this node can be taken as it is
+			cached = self._inlineCache.get((n, future))
+			if cached is not None:
+				found.update(cached)
+				continue
+			toVisit.extend(nodeMap.get(n, ()))
+
+		result = frozenset(found)
+		self._inlineCache[(node, future)] = result
+		return result
 
 	def getContainedEdges(self, nodes=None):
 		"""get edges entirely contained in a set of nodes"""
@@ -456,12 +911,15 @@ class Graph(
 			if source in source.node.inputs or dest in dest.node.outputs:
 				self.log("attempted connection in wrong order")
 				return False
-			elif source.node in dest.node.future:
+			elif self._lazyTopology:
+				# order may be stale mid-batch, walk graph instead
+				if source.node in self.getNodesInFuture(dest.node):
+					self.log("source node in destination's future")
+					return False
+			elif self._topoOrder.wouldCreateCycle(
+					source.node, dest.node, self._directFuture):
 				self.log("source node in destination's future")
 				return False
-			elif dest.node in source.node.history:
-				self.log("dest node in source's past")
-				return False
 		return True
 
 	def checkNodeConnections(self, node):
@@ -507,10 +965,15 @@ class Graph(
 
 	def orderNodes(self, nodes:Set[GraphNode], dfs=True)\
 			->List[GraphNode]:
-		""" sort nodes in order - assumes all nodes are connected
-		if dfs, do depth-first, else b r e a d-first """
-		path = ExecutionPath.getExecPathToNodes(self, nodes)
-		return sorted(list(nodes), key=lambda x: x.index)
+		""" sort nodes in order - nodes do not need to be connected
+		dfs is ignored, order is read from maintained topological order """
+		return self._topoOrder.ordered(nodes)
+
+	def topologicalOrder(self, nodes:T.Iterable[GraphNode]=None)->List[GraphNode]:
+		"""return given nodes, or all nodes, in topological order"""
+		if nodes is None:
+			nodes = self.nodes
+		return self._topoOrder.ordered(nodes)
 
 	def getLongestPath(self, seeds=List[GraphNode],
 	                   ends=List[GraphNode]):
@@ -528,34 +991,107 @@ class Graph(
 
 	def getIslands(self, nodes:Sequence[GraphNode]=None)\
 			->Dict[int, Set[GraphNode]]:
-		""" Return sets of totally disjoint nodes
+		""" Return sets of totally disjoint nodes -
+		if nodes given, only those nodes are grouped
 		"""
-		toTest = set(nodes or self.nodes)
-		regions = defaultdict(set)
-		index = 0
-		while toTest:
-			seed = toTest.pop()
-			island = {seed}
-			found = 0
-			for node in self.getInlineNodes(seed):
-				# has node already been found
-				if node not in toTest:
-					for n in island:
-						regions[node.index].add(n)
-					found = 1
-					break
-				toTest.remove(node)
-				island.add(node)
-			if found:
-				continue
-
-			regions[index].update(island)
-			index += 1
-		return regions
+		if self._islandsStale:
+			self._islands.rebuild(self.nodes, self._directFuture)
+			self._islandsStale = False
+		if nodes is None:
+			nodes = self.nodes
+		return dict(enumerate(self._islands.groups(nodes)))
 
 	#endregion
 
+	### region dirty state
+	@property
+	def dirtyNodes(self)->Set[GraphNode]:
+		return set(self._dirtyNodes)
 
+	def isDirty(self, node:GraphNode)->bool:
+		return node in self._dirtyNodes
+
+	def markDirty(self, node:GraphNode):
+		"""mark node and its whole future as needing execution
+		ignored while graph is executing, as propagating outputs
+		changes inputs downstream"""
+		if self.state != self.State.neutral:
+			return
+		if node in self._dirtyNodes:
+			# future of a dirty node is always dirty already
+			return
+		self._dirtyNodes.add(node)
+		if self._lazyTopology:
+			# future marked once batch exits
+			self._batchDirtySeeds.add(node)
+			return
+		self._dirtyNodes.update(self.getNodesInFuture(node))
+
+	def markClean(self, node:GraphNode):
+		"""called once node has executed successfully"""
+		self._dirtyNodes.discard(node)
+
+	#endregion
+
+	#region demand-driven evaluation
+	def beginEvaluationEpoch(self)->int:
+		"""start a new evaluation epoch - nodes evaluated in
+		earlier epochs are run again when next needed"""
+		self._evaluationEpoch += 1
+		return self._evaluationEpoch
+
+	def _evaluationInputs(self, attr:NodeAttr
+	                      )->Tuple[Set[GraphNode], List[GraphEdge]]:
+		"""return nodes needed to compute attr, and any edges
+		feeding attr directly - an output needs its node and that
+		node's whole history, an input only the history of the
+		edges into it"""
+		if attr.role == NodeAttr.Roles.Output:
+			targetEdges = []
+			toVisit = [attr.node]
+		else:
+			targetEdges = [i for i in self.attrEdges(attr)
+			               if i.destAttr is attr]
+			toVisit = [i.sourceNode for i in targetEdges]
+		needed = set()
+		while toVisit:
+			node = toVisit.pop()
+			if node in needed:
+				continue
+			needed.add(node)
+			toVisit.extend(i.sourceNode for i in
+			               self.nodeEdges(node, outputs=False))
+		return needed, targetEdges
+
+	def evaluate(self, attr:NodeAttr):
+		"""pull the value of attr, running only the upstream nodes
+		it depends on, and return it.
+		inputs are pulled along edges before each node runs -
+		nodes already evaluated this epoch and not dirty since
+		are not run again.
+		raises RuntimeError if a needed node fails"""
+		from treegraph.exegraph import GraphExecutionManager
+		if attr.node.graph is not self:
+			return attr.node.graph.evaluate(attr)
+		needed, targetEdges = self._evaluationInputs(attr)
+		path = ExecutionPath.getExecPathForNodes(self, needed)
+		with GraphExecutionManager(self):
+			for node in path.sequence:
+				for edge in self.nodeEdges(node, outputs=False):
+					edge.propagate()
+				if self._evaluatedEpochs.get(node) == self._evaluationEpoch \
+						and not self.isDirty(node):
+					continue
+				node.execStage(0, cache=self.resultCache)
+				if node.state != node.State.complete:
+					raise RuntimeError("evaluating {} failed at node {}".format(
+						attr, node.name))
+				self.markClean(node)
+				self._evaluatedEpochs[node] = self._evaluationEpoch
+			for edge in targetEdges:
+				edge.propagate()
+		return attr.value
+	#endregion
 
 
 	### region node sets
@@ -564,8 +1100,17 @@ class Graph(
 		return list(self.nodeSets.keys())
 
 	def addNodeSet(self, name):
-		self.nodeSets[name] = NodeSet(name)
-		self.nodeSetsChanged()
+		nodeSet = self.nodeSets[name] = NodeSet(graph=self, name=name)
+		if not self._recordChange("addedSets", "removedSets", nodeSet):
+			self.nodeSetsChanged(nodeSet, self.SetEvents.added)
+		return nodeSet
+
+	def removeNodeSet(self, name):
+		nodeSet = self.nodeSets.pop(name, None)
+		if nodeSet is None:
+			return
+		if not self._recordChange("removedSets", "addedSets", nodeSet):
+			self.nodeSetsChanged(nodeSet, self.SetEvents.removed)
 
 	def getNodeSet(self, name):
 		if not name in self.nodeSets:
@@ -577,8 +1122,8 @@ class Graph(
 		:param node : GraphNode
 		:param setName : str"""
 		origSet = self.nodeSets.get(setName)
-		if not origSet:
-			self.nodeSets[setName] = NodeSet(name=setName)
+		if origSet is None:
+			self.addNodeSet(setName)
 		self.nodeSets[setName].add(node)
 
 	def removeNodeFromSet(self, node, setName):
@@ -644,16 +1189,56 @@ class Graph(
 		         "name" : self.name,
 		         "memory" : self.nodeMemory.serialise(),
 		         }
-		for uid, entry in self.nodeGraph.items():
-			graph["nodes"][uid] = entry["node"].serialise()
+		for node in self.nodes:
+			graph["nodes"][node.uid] = node.serialise()
 			# don't worry about directHistory and directFuture - these will be reconstructed
 			# from edges
 		graph["edges"] = [i.serialise() for i in self.edges]
-		graph["nodeSets"] = {k : [i.name for i in v] for k, v in self.nodeSets.items()}
+		graph["nodeSets"] = {k : [i.name for i in v.nodes] for k, v in self.nodeSets.items()}
 		# add another section for groupings when necessary
 
 		return graph
 
+	def save(self, path:T.Union[str, "Path"], mode:SaveMode=SaveMode.singleFile):
+		"""save graph to path -
+		singleFile streams to one binary file, see graphfile
+		separateFiles writes a folder with a file per node, see graphfolder"""
+		from treegraph.graphjournal import journalPath, startTracking
+		from treegraph.blobstore import blobPath
+		if mode == self.SaveMode.separateFiles:
+			from treegraph.graphfolder import saveGraphFolder
+			saveGraphFolder(self, path)
+		else:
+			from treegraph.graphfile import saveGraph
+			saveGraph(self, path)
+			# journal is folded into the new file
+			for i in (journalPath(path), blobPath(journalPath(path))):
+				if i.is_file():
+					i.unlink()
+		startTracking(self)
+
+	def saveIncremental(self, path:T.Union[str, "Path"], compactRatio=0.5):
+		"""save only what has changed since the last save or load -
+		see graphjournal"""
+		from treegraph.graphjournal import saveIncremental
+		saveIncremental(self, path, compactRatio=compactRatio)
+
+	@classmethod
+	def load(cls, path:T.Union[str, "Path"])->Graph:
+		"""load graph saved by save() - folders are loaded lazily,
+		each node reading its own file on first access.
+		any journal from saveIncremental() is replayed on top"""
+		from treegraph.graphjournal import replayJournal, startTracking
+		if os.path.isdir(path):
+			from treegraph.graphfolder import loadGraphFolder
+			graph = loadGraphFolder(path, graphCls=cls)
+		else:
+			from treegraph.graphfile import loadGraph
+			graph = loadGraph(path, graphCls=cls)
+			replayJournal(graph, path)
+		startTracking(graph)
+		return graph
+
 	@staticmethod
 	def fromDict(regen:dict):
 		"""my bones"""
@@ -0,0 +1,447 @@
+"""streaming binary file format for graphs -
+a short header, then a sequence of length-prefixed records, each
+a marshalled payload tagged with a record type.
+
+payloads are plain data only - loading never unpickles, imports or
+calls anything named in a file. node classes named in a file are only
+looked up in modules already imported, or in the graph's catalogue.
+values marshal can't hold are written as tagged tuples, and rebuilt
+from a fixed set of kinds, see encodeValue.
+
+nodes are written one record at a time, subgraphs opening and closing
+around their contents, then each graph's edges, node sets and node
+memory cells. reading and writing only ever hold one record in memory.
+large binary and array values go to a sidecar file, see blobstore.
+
+record framing : 1 byte type, 8 byte big-endian payload length, payload
+"""
+
+from __future__ import annotations
+
+import typing as T
+import marshal, os, struct, sys
+from contextlib import ExitStack
+from enum import Enum
+from pathlib import Path
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+from treegraph.node import GraphNode
+from treegraph.datatype import DataTypeBase
+from treegraph.blobstore import BlobWriter, BlobRef, blobPath
+from treegraph.lib.branch import branchFromAddress, treeValues, \
+	applyTreeValues, branchRecord, applyBranchRecord, pruneBranches
+
+if T.TYPE_CHECKING:
+	from tree import Tree
+	from treegraph.attr import NodeAttr
+	from treegraph.graph import Graph
+
+
+fileMagic = b"TGRF"
+# version 1 files were pickled, and are not read
+formatVersion = 2
+
+_frame = struct.Struct(">BQ")
+_marshalVersion = 4
+
+
+class RecordType(object):
+	"""single byte record tags"""
+	header = 1
+	node = 2
+	beginGraph = 3
+	endGraph = 4
+	edge = 5
+	nodeSet = 6
+	memoryCell = 7
+	# graph folders only - node entry without stored state
+	nodeIndex = 8
+
+
+class GraphFileError(RuntimeError):
+	"""raised on malformed or unsupported graph files"""
+
+class TruncatedRecordError(GraphFileError):
+	"""raised when a file ends partway through a record,
+	as when a write was interrupted"""
+
+
+# region value encoding
+# first item of tuples standing in for values marshal can't hold
+_tag = "\0tgr"
+
+class ValueKind(object):
+	"""second item of tagged tuples"""
+	tuple = "tuple" # (tag, kind, items) - a real tuple starting with tag
+	blob = "blob" # (tag, kind, offset, nbytes, dtype, shape)
+	array = "array" # (tag, kind, dtype, shape, bytes)
+	dataType = "dataType" # (tag, kind, class name)
+	enum = "enum" # (tag, kind, (module, qualname), member name)
+
+_plainTypes = (type(None), bool, int, float, complex, str, bytes)
+
+def _dtypeData(dtype):
+	return dtype.descr if dtype.fields else dtype.str
+
+def encodeValue(value, blobs:BlobWriter=None):
+	"""return value as plain data that marshal can write -
+	raises GraphFileError for values that cannot be saved.
+	if blobs is given, large values are written there by reference"""
+	if isinstance(value, (bytes, bytearray, memoryview)) or (
+			np is not None and isinstance(value, np.ndarray)):
+		stored = blobs.add(value) if blobs is not None else None
+		if stored is not None:
+			offset, nbytes, dtype, shape = stored
+			return (_tag, ValueKind.blob, offset, nbytes,
+			        None if dtype is None else _dtypeData(dtype), shape)
+		if isinstance(value, (bytes, bytearray, memoryview)):
+			return bytes(value)
+		if value.dtype.hasobject:
+			raise GraphFileError("cannot save object array {}".format(value))
+		return (_tag, ValueKind.array, _dtypeData(value.dtype), value.shape,
+		        value.tobytes())
+	if isinstance(value, _plainTypes):
+		return value
+	if isinstance(value, tuple):
+		items = tuple(encodeValue(i, blobs) for i in value)
+		if value and value[0] == _tag:
+			return (_tag, ValueKind.tuple, items)
+		return items
+	if isinstance(value, list):
+		return [encodeValue(i, blobs) for i in value]
+	if isinstance(value, dict):
+		return {encodeValue(k, blobs) : encodeValue(v, blobs)
+		        for k, v in value.items()}
+	if isinstance(value, (set, frozenset)):
+		return type(value)(encodeValue(i, blobs) for i in value)
+	if isinstance(value, type) and issubclass(value, DataTypeBase):
+		return (_tag, ValueKind.dataType, value.__name__)
+	if isinstance(value, Enum):
+		return (_tag, ValueKind.enum, classPath(type(value)), value.name)
+	if np is not None and isinstance(value, np.generic):
+		return encodeValue(value.item(), blobs)
+	raise GraphFileError("cannot save value {} of type {}".format(
+		value, type(value)))
+
+def _dataTypeFromName(name:str):
+	for cls in [DataTypeBase] + DataTypeBase.allDataTypes():
+		if cls.__name__ == name:
+			return cls
+	raise GraphFileError("unknown data type {}".format(name))
+
+def _enumFromData(path:T.Tuple[str, str], name:str)->Enum:
+	enumCls = loadClass(path, default=None, baseCls=Enum)
+	if enumCls is None:
+		raise GraphFileError("enum {} not found".format(path))
+	return enumCls[name]
+
+def decodeValue(data, blobPath:T.Union[str, Path]=None):
+	"""rebuild value from plain data written by encodeValue"""
+	if isinstance(data, _plainTypes):
+		return data
+	if isinstance(data, tuple):
+		if not (data and data[0] == _tag):
+			return tuple(decodeValue(i, blobPath) for i in data)
+		kind = data[1]
+		if kind == ValueKind.tuple:
+			return tuple(decodeValue(i, blobPath) for i in data[2])
+		if kind == ValueKind.blob:
+			if blobPath is None:
+				raise GraphFileError("blob reference without sidecar")
+			offset, nbytes, dtype, shape = data[2:]
+			return BlobRef(str(Path(blobPath).absolute()), offset, nbytes,
+			               dtype, shape).open()
+		if kind == ValueKind.array:
+			if np is None:
+				raise GraphFileError("numpy is needed to load arrays")
+			dtype, shape, buffer = data[2:]
+			return np.frombuffer(buffer, dtype=np.dtype(dtype)
+			                     ).reshape(shape).copy()
+		if kind == ValueKind.dataType:
+			return _dataTypeFromName(data[2])
+		if kind == ValueKind.enum:
+			return _enumFromData(*data[2:])
+		raise GraphFileError("unknown value kind {}".format(kind))
+	if isinstance(data, list):
+		return [decodeValue(i, blobPath) for i in data]
+	if isinstance(data, dict):
+		return {decodeValue(k, blobPath) : decodeValue(v, blobPath)
+		        for k, v in data.items()}
+	if isinstance(data, (set, frozenset)):
+		return type(data)(decodeValue(i, blobPath) for i in data)
+	# marshal can also hold code objects - never accept them
+	raise GraphFileError("unexpected {} in record".format(type(data)))
+#endregion
+
+
+# region framing
+class RecordWriter(object):
+	"""writes framed records to a binary file object"""
+
+	def __init__(self, f:T.BinaryIO, writeHeader=True,
+	             blobs:BlobWriter=None):
+		"""writeHeader False to append records to an existing file.
+		if blobs is given, large values are written there by reference"""
+		self.f = f
+		self.blobs = blobs
+		if writeHeader:
+			self.f.write(fileMagic + bytes((formatVersion, )))
+
+	def write(self, recordType:int, payload):
+		data = marshal.dumps(encodeValue(payload, self.blobs), _marshalVersion)
+		self.f.write(_frame.pack(recordType, len(data)))
+		self.f.write(data)
+
+
+class RecordReader(object):
+	"""iterates (record type, payload) pairs from a binary file object"""
+
+	def __init__(self, f:T.BinaryIO, blobPath:T.Union[str, Path]=None):
+		"""blobPath is the sidecar to map blob references from"""
+		self.f = f
+		self.blobPath = blobPath
+		magic = f.read(len(fileMagic) + 1)
+		if len(magic) < len(fileMagic) + 1 and \
+				fileMagic.startswith(magic[:len(fileMagic)]):
+			raise TruncatedRecordError("truncated file header")
+		if magic[:len(fileMagic)] != fileMagic:
+			raise GraphFileError("not a treegraph binary file")
+		if magic[-1] != formatVersion:
+			raise GraphFileError("graph file version {} is not supported, "
+			                     "expected version {}".format(
+				magic[-1], formatVersion))
+
+	def __iter__(self):
+		while True:
+			frame = self.f.read(_frame.size)
+			if not frame:
+				return
+			if len(frame) < _frame.size:
+				raise TruncatedRecordError("truncated record header")
+			recordType, length = _frame.unpack(frame)
+			data = self.f.read(length)
+			if len(data) < length:
+				raise TruncatedRecordError("truncated record payload")
+			try:
+				payload = marshal.loads(data)
+			except (EOFError, ValueError, TypeError) as e:
+				raise GraphFileError("malformed record payload") from e
+			yield recordType, decodeValue(payload, self.blobPath)
+#endregion
+
+
+# region record conversion
+def classPath(cls:type)->T.Tuple[str, str]:
+	return cls.__module__, cls.__qualname__
+
+def loadClass(path:T.Tuple[str, str], graph:Graph=None,
+              default:type=GraphNode, baseCls:type=GraphNode)->type:
+	"""find class by module and qualname, if that module is already
+	imported - otherwise fall back to classes registered on graph by
+	name, then to default. modules are never imported from a file,
+	and anything found that isn't a subclass of baseCls is ignored,
+	so files can't name arbitrary callables"""
+	moduleName, qualName = path
+	obj = sys.modules.get(moduleName)
+	for name in qualName.split(".") if obj is not None else ():
+		obj = getattr(obj, name, None)
+	if isinstance(obj, type) and issubclass(obj, baseCls):
+		return obj
+	if graph is not None:
+		cls = graph.nodeClassFromName(qualName.split(".")[-1])
+		if cls is not None:
+			return cls
+		graph.log("node class {} not found, loading as {}".format(
+			qualName, default.__name__))
+	return default
+
+def attrTreeRecord(root:NodeAttr)->T.List[T.Tuple]:
+	"""flat pre-order list of (address, dataType, desc, value)
+	for every attribute below root"""
+	record = []
+	toVisit = [(i, (i.name, )) for i in reversed(root.branches)]
+	while toVisit:
+		attr, address = toVisit.pop()
+		record.append((address, attr.dataType, attr.desc, attr.value))
+		toVisit.extend((i, address + (i.name, ))
+		               for i in reversed(attr.branches))
+	return record
+
+def applyAttrTreeRecord(root:NodeAttr, record:T.List[T.Tuple], exact=False):
+	"""create any attributes missing below root, and set values -
+	if exact, attributes not in record are removed"""
+	if exact:
+		pruneBranches(root, {i[0] for i in record})
+	for address, dataType, desc, value in record:
+		attr = branchFromAddress(root, address)
+		if attr is None:
+			parent = branchFromAddress(root, address[:-1])
+			if parent is None:
+				continue
+			attr = parent.addAttr(address[-1], dataType=dataType, desc=desc)
+		if value is not None:
+			attr.value = value
+
+def nodeRecord(node:GraphNode)->T.Dict:
+	node.ensureLoaded()
+	dataTree = branchFromAddress(node, ("data", ))
+	return {
+		"uid" : node.uid,
+		"name" : node.name,
+		"cls" : classPath(type(node)),
+		"input" : attrTreeRecord(node.inputRoot),
+		"output" : attrTreeRecord(node.outputRoot),
+		"settings" : branchRecord(node.settings),
+		"data" : branchRecord(dataTree) if dataTree is not None else [],
+		"extras" : dict(node.extras),
+	}
+
+def nodeFromRecord(record:T.Dict, graph:Graph, default:type=GraphNode
+                   )->GraphNode:
+	"""create node of recorded class, not yet added to graph"""
+	nodeCls = loadClass(record["cls"], graph, default)
+	node = nodeCls(name=record["name"], uid=record["uid"])
+	applyNodeRecord(node, record)
+	return node
+
+def applyNodeRecord(node:GraphNode, record:T.Dict, exact=False):
+	"""restore attributes, settings and extras onto existing node -
+	if exact, anything the record doesn't hold is removed, so node
+	matches the record entirely"""
+	applyAttrTreeRecord(node.inputRoot, record["input"], exact)
+	applyAttrTreeRecord(node.outputRoot, record["output"], exact)
+	applyBranchRecord(node.settings, record["settings"], exact)
+	if record["data"]:
+		applyBranchRecord(node.data, record["data"], exact)
+	elif exact:
+		dataTree = branchFromAddress(node, ("data", ))
+		if dataTree is not None:
+			pruneBranches(dataTree, ())
+	if exact:
+		node.extras.clear()
+	node.extras.update(record["extras"])
+
+def edgeRecord(edge)->T.Tuple:
+	"""(source uid, source attr address, dest uid, dest attr address)"""
+	return (edge.sourceNode.uid,
+	        tuple(edge.sourceAttr.relAddress(fromBranch=edge.sourceNode)),
+	        edge.destNode.uid,
+	        tuple(edge.destAttr.relAddress(fromBranch=edge.destNode)))
+#endregion
+
+
+def _writeGraphContents(writer:RecordWriter, graph:Graph):
+	from treegraph.graph import Graph
+	for node in graph.nodes:
+		if isinstance(node, Graph):
+			writer.write(RecordType.beginGraph, nodeRecord(node))
+			_writeGraphContents(writer, node)
+			writer.write(RecordType.endGraph, None)
+		else:
+			writer.write(RecordType.node, nodeRecord(node))
+	for edge in graph.edges:
+		writer.write(RecordType.edge, edgeRecord(edge))
+	for name, nodeSet in graph.nodeSets.items():
+		writer.write(RecordType.nodeSet, (name, [i.uid for i in nodeSet.nodes]))
+	# saving never adds the memory branch to graph
+	memory = branchFromAddress(graph, ("nodeMemory", )) #type: Tree
+	for cell in memory.branches if memory is not None else ():
+		writer.write(RecordType.memoryCell, (cell.name, treeValues(cell)))
+
+def saveGraph(graph:Graph, path:T.Union[str, Path]):
+	"""write graph to binary file at path -
+	written to a temp file and renamed, so a failed save leaves
+	any old file as it was"""
+	path = Path(path)
+	tempPath = path.with_name(path.name + ".tmp")
+	try:
+		with BlobWriter(blobPath(path)) as blobs, open(tempPath, "wb") as f:
+			writer = RecordWriter(f, blobs=blobs)
+			writer.write(RecordType.header, {
+				"uid" : graph.uid,
+				"name" : graph.name,
+				"cls" : classPath(type(graph)),
+			})
+			_writeGraphContents(writer, graph)
+	except BaseException:
+		if tempPath.is_file():
+			tempPath.unlink()
+		raise
+	os.replace(tempPath, path)
+
+
+def loadGraph(path:T.Union[str, Path], graphCls:T.Type[Graph]=None)->Graph:
+	"""read graph from binary file at path -
+	each graph is built inside a batch, so topology is ordered
+	once per graph rather than once per edge"""
+	from treegraph.graph import Graph
+	with open(path, "rb") as f, ExitStack() as batches:
+		records = iter(RecordReader(f, blobPath(path)))
+		recordType, header = next(records, (None, None))
+		if recordType != RecordType.header:
+			raise GraphFileError("graph file has no header record")
+		rootCls = graphCls or loadClass(header["cls"], default=Graph)
+		root = rootCls(name=header["name"], uid=header["uid"])
+		batches.enter_context(root.batch())
+
+		stack = [root]
+		nodes = {} #type: T.Dict[str, GraphNode]
+		# edges may reference nodes not read yet, in enclosing graphs
+		pendingEdges = [] #type: T.List[T.Tuple[Graph, T.Tuple]]
+
+		for recordType, payload in records:
+			graph = stack[-1]
+			if recordType in (RecordType.node, RecordType.beginGraph):
+				default = Graph if recordType == RecordType.beginGraph \
+					else GraphNode
+				node = graph.addNode(nodeFromRecord(payload, graph, default))
+				nodes[payload["uid"]] = node
+				if recordType == RecordType.beginGraph:
+					stack.append(node)
+					batches.enter_context(node.batch())
+			elif recordType == RecordType.endGraph:
+				stack.pop()
+			elif recordType == RecordType.edge:
+				if not addEdgeRecord(graph, payload, nodes):
+					pendingEdges.append((graph, payload))
+			elif recordType == RecordType.nodeSet:
+				name, uids = payload
+				graph.addNodeSet(name)
+				for uid in uids:
+					if uid in nodes:
+						graph.addNodeToSet(nodes[uid], name)
+			elif recordType == RecordType.memoryCell:
+				name, values = payload
+				memory = graph("nodeMemory", create=True)
+				applyTreeValues(memory(name, create=True), values, create=True)
+
+		for graph, payload in pendingEdges:
+			if not addEdgeRecord(graph, payload, nodes):
+				graph.log("could not restore edge {}".format(payload))
+	return root
+
+def addEdgeRecord(graph:Graph, record:T.Tuple,
+                  nodes:T.Dict[str, GraphNode])->bool:
+	"""add edge from record to graph - returns False if either
+	node or attr cannot be found"""
+	sourceUid, sourceAddress, destUid, destAddress = record
+	if sourceUid not in nodes or destUid not in nodes:
+		return False
+	attrs = []
+	for uid, address in ((sourceUid, sourceAddress), (destUid, destAddress)):
+		# attrs made by the node class are found without loading the node,
+		# only attrs added at runtime need its stored state
+		node = nodes[uid]
+		attr = branchFromAddress(node.unloadedBranch(address[0]), address[1:])
+		if attr is None and not node.isLoaded:
+			node.ensureLoaded()
+			attr = branchFromAddress(node, address)
+		if attr is None:
+			return False
+		attrs.append(attr)
+	sourceAttr, destAttr = attrs
+	return bool(graph.addEdge(sourceAttr, destAttr))
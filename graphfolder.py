@@ -0,0 +1,243 @@
+"""folder layout for Graph.SaveMode.separateFiles -
+
+	graphDir/
+		index.tgr       header, then (uid, name, class) of every node,
+		                edges, node sets and node memory cells
+		nodes/<uid>.tgr single record of one node's stored state
+		<subgraph uid>/ folder of the same layout for each subgraph
+	*.blobs         sidecar of large values next to any of the above,
+	                see blobstore
+
+loading only reads index files - each node is created empty from its
+class, and its attributes, settings and data are read from its own
+file the first time any of them are accessed.
+
+saving skips nodes still unloaded from the same folder, and nodes whose
+stored state has not changed since they were last saved or loaded
+"""
+
+from __future__ import annotations
+
+import typing as T
+import hashlib, os, shutil
+from contextlib import ExitStack
+from pathlib import Path
+
+from treegraph.node import GraphNode
+from treegraph.blobstore import BlobWriter, blobPath, hashingDumps
+from treegraph.lib.branch import branchFromAddress, treeValues, \
+	applyTreeValues
+from treegraph.graphfile import RecordType, RecordWriter, RecordReader, \
+	GraphFileError, classPath, loadClass, nodeRecord, applyNodeRecord, \
+	edgeRecord, addEdgeRecord
+
+if T.TYPE_CHECKING:
+	from treegraph.graph import Graph
+
+
+indexName = "index.tgr"
+nodeDirName = "nodes"
+
+
+def nodeFilePath(graphDir:Path, uid)->Path:
+	return graphDir / nodeDirName / "{}.tgr".format(uid)
+
+
+class _NodeFileLoad(object):
+	"""pending load of one node's stored state from its file -
+	kept as an object so saving can see where an unloaded node lives"""
+
+	def __init__(self, path:Path):
+		self.path = path
+
+	def __call__(self, node:GraphNode):
+		with open(self.path, "rb") as f:
+			for recordType, payload in RecordReader(f, blobPath(self.path)):
+				if recordType == RecordType.node:
+					applyNodeRecord(node, payload)
+					# node may be loaded after being removed from its graph
+					if node.parent is not None:
+						node.parent.savedRecordHashes[node.uid] = \
+							_hashRecord(payload)
+					return
+		raise GraphFileError("no node record in {}".format(self.path))
+
+
+def _hashRecord(record:T.Dict)->str:
+	return hashlib.sha1(hashingDumps(record)).hexdigest()
+
+
+# region saving
+def _writeNodeFile(path:Path, record:T.Dict):
+	"""write then rename, so an interrupted save leaves the old file"""
+	tempPath = path.with_suffix(".tmp")
+	with BlobWriter(blobPath(path)) as blobs, open(tempPath, "wb") as f:
+		RecordWriter(f, blobs=blobs).write(RecordType.node, record)
+	os.replace(tempPath, path)
+
+def _saveNode(node:GraphNode, graphDir:Path,
+              changedNodes:T.Set[GraphNode]=None)->bool:
+	"""write node's file if needed - returns True if written.
+	if changedNodes is given, other nodes with files are trusted
+	without hashing"""
+	path = nodeFilePath(graphDir, node.uid)
+	if changedNodes is not None and node not in changedNodes \
+			and path.is_file():
+		return False
+	pending = node._pendingLoad
+	if isinstance(pending, _NodeFileLoad):
+		if pending.path.resolve() == path.resolve():
+			return False
+		# unloaded node from another folder - copy without reading
+		shutil.copyfile(pending.path, path)
+		if blobPath(pending.path).is_file():
+			shutil.copyfile(blobPath(pending.path), blobPath(path))
+		elif blobPath(path).is_file():
+			blobPath(path).unlink()
+		return True
+	record = nodeRecord(node)
+	recordHash = _hashRecord(record)
+	hashes = node.parent.savedRecordHashes
+	if hashes.get(node.uid) == recordHash and path.is_file():
+		return False
+	_writeNodeFile(path, record)
+	hashes[node.uid] = recordHash
+	return True
+
+def _indexedNodes(graphDir:Path)->T.Dict[str, bool]:
+	"""{ uid : is graph } for nodes in existing index at graphDir"""
+	path = graphDir / indexName
+	if not path.is_file():
+		return {}
+	indexed = {}
+	try:
+		with open(path, "rb") as f:
+			for recordType, payload in RecordReader(f, blobPath(path)):
+				if recordType == RecordType.nodeIndex:
+					indexed[str(payload["uid"])] = payload["isGraph"]
+	except GraphFileError:
+		pass
+	return indexed
+
+def saveGraphFolder(graph:Graph, path:T.Union[str, Path],
+                    changedNodes:T.Set[GraphNode]=None)->int:
+	"""write graph to folder at path, creating it if needed -
+	returns number of node files written.
+	changedNodes limits which existing node files are checked"""
+	from treegraph.graph import Graph
+	graphDir = Path(path)
+	(graphDir / nodeDirName).mkdir(parents=True, exist_ok=True)
+	# only files this folder's last save wrote are ever cleared out
+	oldNodes = _indexedNodes(graphDir)
+	written = 0
+	with BlobWriter(blobPath(graphDir / indexName)) as blobs, \
+			open(graphDir / (indexName + ".tmp"), "wb") as f:
+		writer = RecordWriter(f, blobs=blobs)
+		writer.write(RecordType.header, {
+			"uid" : graph.uid,
+			"name" : graph.name,
+			"cls" : classPath(type(graph)),
+		})
+		for node in graph.nodes:
+			isGraph = isinstance(node, Graph)
+			writer.write(RecordType.nodeIndex, {
+				"uid" : node.uid, "name" : node.name,
+				"cls" : classPath(type(node)), "isGraph" : isGraph})
+			written += _saveNode(node, graphDir, changedNodes)
+			if isGraph:
+				written += saveGraphFolder(node, graphDir / str(node.uid),
+				                           changedNodes)
+		for edge in graph.edges:
+			writer.write(RecordType.edge, edgeRecord(edge))
+		for name, nodeSet in graph.nodeSets.items():
+			writer.write(RecordType.nodeSet,
+			             (name, [i.uid for i in nodeSet.nodes]))
+		memory = branchFromAddress(graph, ("nodeMemory", ))
+		for cell in memory.branches if memory is not None else ():
+			writer.write(RecordType.memoryCell, (cell.name, treeValues(cell)))
+	os.replace(graphDir / (indexName + ".tmp"), graphDir / indexName)
+
+	# clear out files of deleted nodes and subgraphs
+	liveUids = {str(i.uid) for i in graph.nodes}
+	for uid, isGraph in oldNodes.items():
+		if uid in liveUids:
+			continue
+		nodePath = nodeFilePath(graphDir, uid)
+		for i in (nodePath, blobPath(nodePath)):
+			if i.is_file():
+				i.unlink()
+		if isGraph and (graphDir / uid / indexName).is_file():
+			shutil.rmtree(graphDir / uid)
+	return written
+#endregion
+
+
+# region loading
+def _loadGraphContents(graph:Graph, graphDir:Path,
+                       nodes:T.Dict[str, GraphNode],
+                       pendingEdges:T.List, batches:ExitStack,
+                       subGraphLoads:T.List):
+	"""create placeholder nodes from index at graphDir -
+	subgraphs are filled from their own index, and their pending
+	loads added to subGraphLoads, to be set once they are built"""
+	from treegraph.graph import Graph
+	batches.enter_context(graph.batch())
+	with open(graphDir / indexName, "rb") as f:
+		records = iter(RecordReader(f, blobPath(graphDir / indexName)))
+		next(records, None) # header
+		for recordType, payload in records:
+			if recordType == RecordType.nodeIndex:
+				default = Graph if payload["isGraph"] else GraphNode
+				nodeCls = loadClass(payload["cls"], graph, default)
+				node = nodeCls(name=payload["name"], uid=payload["uid"])
+				load = _NodeFileLoad(nodeFilePath(graphDir, payload["uid"]))
+				graph.addNode(node)
+				nodes[payload["uid"]] = node
+				if payload["isGraph"]:
+					# building contents goes through the subgraph's
+					# branches, which would load it straight away
+					subGraphLoads.append((node, load))
+					_loadGraphContents(node, graphDir / str(node.uid),
+					                   nodes, pendingEdges, batches,
+					                   subGraphLoads)
+				else:
+					node._pendingLoad = load
+			elif recordType == RecordType.edge:
+				if not addEdgeRecord(graph, payload, nodes):
+					pendingEdges.append((graph, payload))
+			elif recordType == RecordType.nodeSet:
+				name, uids = payload
+				graph.addNodeSet(name)
+				for uid in uids:
+					if uid in nodes:
+						graph.addNodeToSet(nodes[uid], name)
+			elif recordType == RecordType.memoryCell:
+				name, values = payload
+				memory = graph("nodeMemory", create=True)
+				applyTreeValues(memory(name, create=True), values, create=True)
+
+def loadGraphFolder(path:T.Union[str, Path],
+                    graphCls:T.Type[Graph]=None)->Graph:
+	"""create graph of placeholder nodes from folder at path"""
+	from treegraph.graph import Graph
+	graphDir = Path(path)
+	with open(graphDir / indexName, "rb") as f:
+		recordType, header = next(iter(RecordReader(f)), (None, None))
+	if recordType != RecordType.header:
+		raise GraphFileError("graph index has no header record")
+	rootCls = graphCls or loadClass(header["cls"], default=Graph)
+	root = rootCls(name=header["name"], uid=header["uid"])
+
+	nodes = {} #type: T.Dict[str, GraphNode]
+	pendingEdges = []
+	subGraphLoads = []
+	with ExitStack() as batches:
+		_loadGraphContents(root, graphDir, nodes, pendingEdges, batches,
+		                   subGraphLoads)
+		for graph, payload in pendingEdges:
+			if not addEdgeRecord(graph, payload, nodes):
+				graph.log("could not restore edge {}".format(payload))
+	for graph, load in subGraphLoads:
+		graph._pendingLoad = load
+	return root
+#endregion
@@ -0,0 +1,418 @@
+"""incremental saving -
+a ChangeTracker on each graph records which nodes, edges, node sets
+and node memory cells have changed since the graph was last saved or
+loaded, from the graph's own signals.
+
+for single-file saves, changes are appended as records to a journal
+file next to the main file, and replayed on top of it when loading.
+once the journal grows past a fraction of the main file it is
+compacted, by a full save that folds it back in.
+for folder saves, only changed node files are rewritten
+"""
+
+from __future__ import annotations
+
+import typing as T
+import os
+from pathlib import Path
+from weakref import WeakSet
+
+from tree import Tree
+
+from treegraph.node import GraphNode
+from treegraph.lib.branch import branchFromAddress, branchRecord, \
+	applyBranchRecord
+from treegraph.blobstore import BlobWriter, blobPath
+from treegraph.graphfile import RecordType, RecordWriter, RecordReader, \
+	TruncatedRecordError, nodeRecord, nodeFromRecord, applyNodeRecord, \
+	edgeRecord, addEdgeRecord
+
+if T.TYPE_CHECKING:
+	from treegraph.graph import Graph, BatchChanges
+	from treegraph.edge import GraphEdge
+
+
+journalSuffix = ".journal"
+
+# journal record types continue on from graphfile's
+class JournalRecordType(object):
+	nodeChanged = 20 # (graph path, isGraph, node record)
+	nodeRemoved = 21 # (graph path, uid)
+	edgeAdded = 22 # (graph path, edge record)
+	edgeRemoved = 23 # (graph path, edge record)
+	nodeSets = 24 # (graph path, { set name : [uids] })
+	memoryCell = 25 # (graph path, cell name, branch record or None if removed)
+
+
+def journalPath(path:T.Union[str, Path])->Path:
+	path = Path(path)
+	return path.with_name(path.name + journalSuffix)
+
+
+class ChangeTracker(object):
+	"""records changes to one graph since it was last saved -
+	subgraphs get trackers of their own"""
+
+	def __init__(self, graph:Graph):
+		self.graph = graph
+		self.changedNodes = set() #type: T.Set[GraphNode]
+		# nodes added since last save - subset of changedNodes
+		self.addedNodes = set() #type: T.Set[GraphNode]
+		self.removedNodes = set() #type: T.Set[str]
+		# insertion-ordered, so edges are journaled in the order added
+		self.addedEdges = {} #type: T.Dict[GraphEdge, None]
+		self.removedEdges = [] #type: T.List[T.Tuple]
+		self.changedCells = set() #type: T.Set[str]
+		self._setsSnapshot = self._nodeSetsMap()
+		self._watchedNodes = WeakSet() #type: T.Set[GraphNode]
+
+		graph.structureChanged.connect(self._onStructureChanged)
+		graph.edgesChanged.connect(self._onEdgesChanged)
+		graph.batchChanged.connect(self._onBatchChanged)
+		self._memory = None #type: Tree
+		self._watchMemory()
+		for node in graph.nodes:
+			self._watchNode(node)
+
+	@classmethod
+	def forGraph(cls, graph:Graph)->ChangeTracker:
+		"""return graph's tracker, creating it if needed"""
+		if graph.changeTracker is None:
+			graph.changeTracker = cls(graph)
+		return graph.changeTracker
+
+	def clear(self):
+		"""forget all changes, as after a full save"""
+		self.changedNodes.clear()
+		self.addedNodes.clear()
+		self.removedNodes.clear()
+		self.addedEdges.clear()
+		self.removedEdges.clear()
+		self.changedCells.clear()
+		self._setsSnapshot = self._nodeSetsMap()
+
+	def _nodeSetsMap(self)->T.Dict[str, T.List[str]]:
+		return {k : [i.uid for i in v.nodes]
+		        for k, v in self.graph.nodeSets.items()}
+
+	def nodeSetsChanged(self)->bool:
+		# sets aren't signalled on membership change, and are small
+		return self._nodeSetsMap() != self._setsSnapshot
+
+	def hasChanges(self)->bool:
+		return bool(self.changedNodes or self.removedNodes or
+		            self.addedEdges or self.removedEdges or
+		            self.changedCells or self.nodeSetsChanged())
+
+	# region signal handlers
+	def _watchNode(self, node:GraphNode):
+		"""connect to node's trees directly, without triggering
+		a pending load"""
+		if node in self._watchedNodes:
+			return
+		self._watchedNodes.add(node)
+		onChange = lambda *args, **kwargs : self._onNodeChanged(node)
+		for tree in (node.unloadedBranch("input"),
+		             node.unloadedBranch("output")):
+			tree.valueChanged.connect(onChange)
+			tree.structureChanged.connect(onChange)
+		for signal in (node.settingsChanged, node.nameChanged,
+		               node.valueChanged, node.structureChanged):
+			signal.connect(onChange)
+
+	def _watchMemory(self):
+		"""connect to graph's memory branch once it exists -
+		tracking never creates it"""
+		with self.graph.loadDeferred():
+			memory = branchFromAddress(self.graph, ("nodeMemory", ))
+		if memory is None or memory is self._memory:
+			return
+		self._memory = memory
+		memory.valueChanged.connect(self._onMemoryChanged)
+		memory.structureChanged.connect(self._onMemoryChanged)
+
+	def _onNodeChanged(self, node:GraphNode):
+		if node.parent is self.graph:
+			self.changedNodes.add(node)
+
+	def _onStructureChanged(self, branch, parent=None, oldParent=None,
+	                        eventType=Tree.StructureEvents.branchAdded):
+		if not isinstance(branch, GraphNode):
+			if eventType == Tree.StructureEvents.branchAdded:
+				self._watchMemory()
+			return
+		if eventType == Tree.StructureEvents.branchAdded:
+			if branch.parent is self.graph:
+				self._watchNode(branch)
+				self.changedNodes.add(branch)
+				self.addedNodes.add(branch)
+		elif eventType in (Tree.StructureEvents.beforeBranchRemoved,
+		                   Tree.StructureEvents.branchRemoved):
+			if branch not in self._watchedNodes:
+				# node in a subgraph, tracked there
+				return
+			self.changedNodes.discard(branch)
+			if branch in self.addedNodes:
+				# never saved, nothing to remove
+				self.addedNodes.discard(branch)
+				return
+			self.removedNodes.add(branch.uid)
+
+	def _onEdgesChanged(self, edge:GraphEdge=None, event=None):
+		if edge is None:
+			return
+		if event == self.graph.EdgeEvents.added:
+			self.addedEdges[edge] = None
+		elif event == self.graph.EdgeEvents.removed:
+			self._edgeRemoved(edge)
+
+	def _edgeRemoved(self, edge:GraphEdge):
+		if edge in self.addedEdges:
+			del self.addedEdges[edge]
+			return
+		self.removedEdges.append(edgeRecord(edge))
+
+	def _onBatchChanged(self, changes:BatchChanges):
+		for edge in changes.removedEdges:
+			self._edgeRemoved(edge)
+		self.addedEdges.update(dict.fromkeys(changes.addedEdges))
+
+	def _onMemoryChanged(self, branch=None, *args, **kwargs):
+		memory = self._memory
+		if not isinstance(branch, Tree) or branch is memory:
+			return
+		cell = branch
+		while cell.parent is not None and cell.parent is not memory:
+			cell = cell.parent
+		self.changedCells.add(cell.name)
+	#endregion
+
+
+def startTracking(graph:Graph):
+	"""treat graph and all subgraphs as just saved"""
+	for i in _allGraphs(graph):
+		ChangeTracker.forGraph(i).clear()
+
+
+def _graphPath(graph:Graph, root:Graph)->T.Tuple[str, ...]:
+	"""uids of subgraphs from root down to graph"""
+	path = []
+	while graph is not root:
+		path.append(graph.uid)
+		graph = graph.parent
+	return tuple(reversed(path))
+
+def _graphFromPath(root:Graph, path:T.Sequence[str])->T.Optional[Graph]:
+	graph = root
+	for uid in path:
+		graph = graph.nodeFromUID(uid)
+		if graph is None:
+			return None
+	return graph
+
+def _allGraphs(graph:Graph)->T.List[Graph]:
+	from treegraph.graph import Graph
+	graphs = [graph]
+	for i in graph.nodes:
+		if isinstance(i, Graph):
+			graphs.extend(_allGraphs(i))
+	return graphs
+
+
+# region writing
+def _writeNewNode(writer:RecordWriter, node:GraphNode, root:Graph):
+	"""write node and, for new subgraphs, everything inside them"""
+	from treegraph.graph import Graph
+	graphPath = _graphPath(node.parent, root)
+	isGraph = isinstance(node, Graph)
+	writer.write(JournalRecordType.nodeChanged,
+	             (graphPath, isGraph, nodeRecord(node)))
+	if not isGraph:
+		return
+	innerPath = graphPath + (node.uid, )
+	for i in node.nodes:
+		_writeNewNode(writer, i, root)
+	for edge in node.edges:
+		writer.write(JournalRecordType.edgeAdded, (innerPath, edgeRecord(edge)))
+	writer.write(JournalRecordType.nodeSets,
+	             (innerPath, {k : [i.uid for i in v.nodes]
+	                          for k, v in node.nodeSets.items()}))
+	memory = branchFromAddress(node, ("nodeMemory", ))
+	for cell in memory.branches if memory is not None else ():
+		writer.write(JournalRecordType.memoryCell,
+		             (innerPath, cell.name, branchRecord(cell)))
+
+def _newGraphs(graphs:T.List[Graph])->T.Set[Graph]:
+	"""subgraphs added since last save, and everything inside them -
+	these are written whole along with their parent's changes"""
+	newGraphs = set()
+	for graph in graphs[1:]:
+		if graph.parent in newGraphs or \
+				graph in ChangeTracker.forGraph(graph.parent).addedNodes:
+			newGraphs.add(graph)
+	return newGraphs
+
+def writeJournal(root:Graph, f:T.BinaryIO, writeHeader=True,
+                 blobs:BlobWriter=None):
+	"""write records for every tracked change under root,
+	then clear trackers"""
+	from treegraph.graph import Graph
+	writer = RecordWriter(f, writeHeader=writeHeader, blobs=blobs)
+	graphs = _allGraphs(root)
+	newGraphs = _newGraphs(graphs)
+	changed = [(graph, _graphPath(graph, root), ChangeTracker.forGraph(graph))
+	           for graph in graphs if graph not in newGraphs]
+
+	# removals first, so replaying never collides with new items
+	for graph, graphPath, tracker in changed:
+		for record in tracker.removedEdges:
+			writer.write(JournalRecordType.edgeRemoved, (graphPath, record))
+		for uid in tracker.removedNodes:
+			writer.write(JournalRecordType.nodeRemoved, (graphPath, uid))
+	for graph, graphPath, tracker in changed:
+		for node in tracker.changedNodes:
+			if node in tracker.addedNodes:
+				_writeNewNode(writer, node, root)
+			else:
+				writer.write(JournalRecordType.nodeChanged, (
+					graphPath, isinstance(node, Graph), nodeRecord(node)))
+	for graph, graphPath, tracker in changed:
+		for edge in tracker.addedEdges:
+			if edge.isLive:
+				writer.write(JournalRecordType.edgeAdded,
+				             (graphPath, edgeRecord(edge)))
+		if tracker.nodeSetsChanged():
+			writer.write(JournalRecordType.nodeSets,
+			             (graphPath, tracker._nodeSetsMap()))
+		memory = branchFromAddress(graph, ("nodeMemory", ))
+		for name in tracker.changedCells:
+			cell = None if memory is None else \
+				branchFromAddress(memory, (name, ))
+			writer.write(JournalRecordType.memoryCell, (
+				graphPath, name,
+				branchRecord(cell) if cell is not None else None))
+
+	startTracking(root)
+#endregion
+
+
+def saveIncremental(graph:Graph, path:T.Union[str, Path],
+                    compactRatio=0.5):
+	"""append changes since last save to path's journal -
+	does a full save if there is no main file yet, or if the journal
+	has grown past compactRatio of the main file's size"""
+	path = Path(path)
+	if path.is_dir():
+		from treegraph.graphfolder import saveGraphFolder
+		changed = set()
+		for i in _allGraphs(graph):
+			changed.update(ChangeTracker.forGraph(i).changedNodes)
+		saveGraphFolder(graph, path, changedNodes=changed)
+		startTracking(graph)
+		return
+	journal = journalPath(path)
+	if not path.is_file() or (journal.is_file() and journal.stat().st_size >
+	                          compactRatio * path.stat().st_size):
+		compact(graph, path)
+		return
+	if not any(ChangeTracker.forGraph(i).hasChanges()
+	           for i in _allGraphs(graph)):
+		return
+	writeHeader = not (journal.is_file() and journal.stat().st_size)
+	with open(journal, "ab") as f, \
+			BlobWriter(blobPath(journal), append=True) as blobs:
+		writeJournal(graph, f, writeHeader=writeHeader, blobs=blobs)
+
+def compact(graph:Graph, path:T.Union[str, Path]):
+	"""full save folding in journal, then remove journal"""
+	graph.save(path)
+
+
+# region replay
+def replayJournal(root:Graph, path:T.Union[str, Path])->int:
+	"""apply journal records next to path onto root,
+	returns number of records applied.
+	a partial record at the end, left by an interrupted save, is
+	skipped and cut from the journal, so later appends stay readable"""
+	journal = journalPath(path)
+	if not journal.is_file():
+		return 0
+	nodes = {}
+	for graph in _allGraphs(root):
+		nodes.update({i.uid : i for i in graph.nodes})
+	count = 0
+	# end of last whole record read
+	validEnd = 0
+	truncated = False
+	with open(journal, "rb") as f, root.batch():
+		try:
+			reader = RecordReader(f, blobPath(journal))
+			validEnd = f.tell()
+			for recordType, payload in reader:
+				validEnd = f.tell()
+				_applyJournalRecord(root, recordType, payload, nodes)
+				count += 1
+		except TruncatedRecordError:
+			truncated = True
+	if truncated:
+		root.log("journal {} ends in a partial record, ignoring "
+		         "it".format(journal))
+		os.truncate(journal, validEnd)
+	return count
+
+def _applyJournalRecord(root:Graph, recordType:int, payload,
+                        nodes:T.Dict[str, GraphNode]):
+	from treegraph.graph import Graph
+	graph = _graphFromPath(root, payload[0])
+	if graph is None:
+		root.log("journal record for missing graph {}, skipping".format(
+			payload[0]))
+		return
+	if recordType == JournalRecordType.nodeChanged:
+		graphPath, isGraph, record = payload
+		node = graph.nodeFromUID(record["uid"])
+		if node is None:
+			node = graph.addNode(nodeFromRecord(
+				record, graph, Graph if isGraph else GraphNode))
+			nodes[node.uid] = node
+		else:
+			if node.name != record["name"]:
+				node.setName(record["name"])
+			# records hold full node state - anything missing was removed
+			applyNodeRecord(node, record, exact=True)
+	elif recordType == JournalRecordType.nodeRemoved:
+		node = graph.nodeFromUID(payload[1])
+		if node is not None:
+			graph.deleteNode(node)
+			nodes.pop(payload[1], None)
+	elif recordType == JournalRecordType.edgeAdded:
+		addEdgeRecord(graph, payload[1], nodes)
+	elif recordType == JournalRecordType.edgeRemoved:
+		destNode = nodes.get(payload[1][2])
+		edges = graph.nodeEdges(destNode) if destNode is not None else ()
+		for edge in edges:
+			if edgeRecord(edge) == payload[1]:
+				graph.deleteEdge(edge)
+				break
+	elif recordType == JournalRecordType.nodeSets:
+		# record holds every set - replace graph's sets with it
+		for name in list(graph.nodeSets.keys()):
+			if name not in payload[1]:
+				graph.removeNodeSet(name)
+		for name, nodeSet in graph.nodeSets.items():
+			for node in tuple(nodeSet.nodes):
+				nodeSet.remove(node)
+		for name, uids in payload[1].items():
+			graph.getNodeSet(name)
+			for uid in uids:
+				if uid in nodes:
+					graph.addNodeToSet(nodes[uid], name)
+	elif recordType == JournalRecordType.memoryCell:
+		graphPath, name, values = payload
+		memory = graph("nodeMemory", create=True)
+		if values is None:
+			if any(i.name == name for i in memory.branches):
+				memory.remove(name)
+			return
+		applyBranchRecord(memory(name, create=True), values, exact=True)
+#endregion
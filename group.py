@@ -12,5 +12,22 @@ class NodeSet(AbstractRelation):
 	"""defines a basic group of nodes"""
 	def __init__(self, graph=None, name=""):
 		super(NodeSet, self).__init__(graph)
+		self.name = name
+
+	def add(self, node):
+		if node not in self.nodes:
+			self.nodes.append(node)
+
+	def remove(self, node):
+		self.nodes.remove(node)
+
+	def __contains__(self, item):
+		return item in self.nodes
+
+	def __iter__(self):
+		return iter(self.nodes)
+
+	def __len__(self):
+		return len(self.nodes)
 
 
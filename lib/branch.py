@@ -0,0 +1,85 @@
+"""small helpers for moving values between trees of matching shape
+only relies on branch names, so works across processes and
+across trees regenerated from dicts
+"""
+from __future__ import annotations
+import typing as T
+
+if T.TYPE_CHECKING:
+	from tree import Tree
+
+
+def branchFromAddress(root:Tree, address:T.Sequence[str])->T.Optional[Tree]:
+	"""return branch at address of names below root, or None"""
+	branch = root
+	for name in address:
+		branch = next((i for i in branch.branches if i.name == name), None)
+		if branch is None:
+			return None
+	return branch
+
+def treeValues(root:Tree)->T.Dict[T.Tuple[str, ...], object]:
+	"""flat map of { address tuple : value } for every
+	branch below root with a value"""
+	values = {}
+	toVisit = [(i, (i.name, )) for i in root.branches]
+	while toVisit:
+		branch, address = toVisit.pop()
+		if branch.value is not None:
+			values[address] = branch.value
+		toVisit.extend((i, address + (i.name, )) for i in branch.branches)
+	return values
+
+def applyTreeValues(root:Tree, values:T.Dict[T.Sequence[str], object],
+                    create=False):
+	"""set values from address map onto root's branches -
+	if create, missing branches are created by lookup,
+	otherwise they are skipped"""
+	for address, value in values.items():
+		branch = branchFromAddress(root, address)
+		if branch is None:
+			if not create:
+				continue
+			branch = root
+			for name in address:
+				branch = branch(name, create=True)
+		branch.value = value
+
+def branchRecord(root:Tree)->T.List[T.Tuple[T.Tuple[str, ...], object]]:
+	"""flat pre-order list of (address, value) for every branch
+	below root, including those without values - unlike treeValues,
+	this records the tree's full structure"""
+	record = []
+	toVisit = [(i, (i.name, )) for i in reversed(root.branches)]
+	while toVisit:
+		branch, address = toVisit.pop()
+		record.append((address, branch.value))
+		toVisit.extend((i, address + (i.name, ))
+		               for i in reversed(branch.branches))
+	return record
+
+def pruneBranches(root:Tree, addresses:T.Collection[T.Tuple[str, ...]]):
+	"""remove every branch below root whose address is not in addresses"""
+	toVisit = [(i, (i.name, )) for i in root.branches]
+	while toVisit:
+		branch, address = toVisit.pop()
+		if address not in addresses:
+			branch.parent.remove(branch.name)
+			continue
+		toVisit.extend((i, address + (i.name, )) for i in branch.branches)
+
+def applyBranchRecord(root:Tree, record:T.List[T.Tuple[T.Tuple[str, ...], object]],
+                      exact=False):
+	"""create branches from record below root and set their values -
+	if exact, branches not in record are removed"""
+	if exact:
+		pruneBranches(root, {address for address, value in record})
+	for address, value in record:
+		branch = root
+		for name in address:
+			branch = branch(name, create=True)
+		branch.value = value
+
+def copyTreeValues(source:Tree, target:Tree, create=False):
+	"""copy values from one tree onto another of matching shape"""
+	applyTreeValues(target, treeValues(source), create=create)
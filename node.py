@@ -8,6 +8,7 @@ from __future__ import annotations
 
 from typing import Union, TYPE_CHECKING, Set, Callable, Type
 from enum import Enum
+from contextlib import contextmanager
 from functools import partial, reduce
 from tree.lib.path import Path, PurePath
 from tree.lib.object import PostInitMixin
@@ -21,12 +22,15 @@ from treegraph.datatype import DataTypes
 from treegraph.attr import NodeAttr
 
 from treegraph.settings import NodeSettings
+from treegraph.lib.branch import treeValues, applyTreeValues
 
 from tree.lib.constant import AtomicWidgetType, AtomicWidgetSemanticType
 from tree.util.ui import markBranchForUIWidget
 
 if TYPE_CHECKING:
 	from treegraph import Graph, GraphEdge
+	from treegraph.execache import NodeResultCache
+	from treegraph.exeprofile import ExecutionProfiler
 
 
 
@@ -54,6 +58,20 @@ class GraphNode( Tree, PostInitMixin,  GraphNodeBase,
 
 	State = NodeState
 
+	# set True on node classes that must execute in the main process,
+	# eg those calling into ui or host applications
+	pinToMainProcess = False
+
+	# result caching - set cacheResults True on pure nodes, whose outputs
+	# depend only on their settings and inputs.
+	# if classVersion is None, cache keys use a hash of the class sources
+	cacheResults = False
+	classVersion = None
+
+	# set on placeholder nodes loaded from a graph folder -
+	# called once to restore attributes, settings and data on first access
+	_pendingLoad = None #type: Callable[[GraphNode], None]
+
 
 	# physical coords of node in graph
 	position = Tree.TreePropertyDescriptor("position", default=[0, 0])
@@ -123,14 +141,56 @@ class GraphNode( Tree, PostInitMixin,  GraphNodeBase,
 		                [i.settings for i in reversed(self.trunk())])
 
 
+	@property
+	def isLoaded(self)->bool:
+		"""False for placeholder nodes whose stored state
+		has not been read yet"""
+		return self._pendingLoad is None
+
+	def ensureLoaded(self):
+		if self._pendingLoad is not None:
+			load, self._pendingLoad = self._pendingLoad, None
+			load(self)
+
+	def __call__(self, *args, **kwargs):
+		"""any branch lookup loads stored state first"""
+		self.ensureLoaded()
+		return super(GraphNode, self).__call__(*args, **kwargs)
+
+	@property
+	def branches(self):
+		self.ensureLoaded()
+		return super(GraphNode, self).branches
+
+	@contextmanager
+	def loadDeferred(self):
+		"""suspend any pending load, for lookups of branches that
+		exist before stored state is read"""
+		# tree lookups may go through branches internally
+		pending, self._pendingLoad = self._pendingLoad, None
+		try:
+			yield self
+		finally:
+			if self._pendingLoad is None:
+				self._pendingLoad = pending
+
+	def unloadedBranch(self, name:str)->Tree:
+		"""return direct branch without loading stored state -
+		only branches made by the node class exist before loading"""
+		with self.loadDeferred():
+			return super(GraphNode, self).__call__(name)
+
 	@property
 	def inputRoot(self)->NodeAttr:
+		self.ensureLoaded()
 		return self("input")
 	@property
 	def outputRoot(self)->NodeAttr:
+		self.ensureLoaded()
 		return self("output")
 	@property
 	def settings(self)->NodeSettings:
+		self.ensureLoaded()
 		return self("settings")
 
 	@property
@@ -156,17 +216,15 @@ class GraphNode( Tree, PostInitMixin,  GraphNodeBase,
 
 	@property
 	def directFuture(self)-> Set[GraphNode]:
-		""" all nodes in this node's direct history
-		might get a bit pricey but
-		not a problem for now """
-		return self.graph.adjacentNodes(self, future=True)
+		""" all nodes in this node's direct future
+		read from graph adjacency index """
+		return self.graph.adjacentNodes(self, future=True, history=False)
 
 	@property
 	def directHistory(self) -> Set[GraphNode]:
 		""" all nodes in this node's direct history
-		might get a bit pricey but
-		not a problem for now """
-		return self.graph.adjacentNodes(self, history=True)
+		read from graph adjacency index """
+		return self.graph.adjacentNodes(self, future=False, history=True)
 
 	@property
 	def data(self):
@@ -175,6 +233,7 @@ class GraphNode( Tree, PostInitMixin,  GraphNodeBase,
 		abstractNodes only have access to data - graph may know more
 		:rtype Tree """
 		#data = self.graph.getNodeMemoryCell(self)
+		self.ensureLoaded()
 		return self("data", create=True)
 		#return data
 
@@ -192,6 +251,10 @@ class GraphNode( Tree, PostInitMixin,  GraphNodeBase,
 			i.connect(self.settingsChanged)
 		self.settingsChanged.connect(self.onSettingsChanged)
 
+		# changing inputs or settings invalidates previous results
+		self.inputRoot.valueChanged.connect(self.setDirty)
+		self.settingsChanged.connect(self.setDirty)
+
 
 	# signal-fired methods
 	def onNodeChanged(self, *args, **kwargs):
@@ -210,8 +273,18 @@ class GraphNode( Tree, PostInitMixin,  GraphNodeBase,
 		"""putting here as temp, this all needs restructuring"""
 		self.addChild(Tree("settings", None))
 
+	def setDirty(self, *args, **kwargs):
+		"""mark this node and its future for re-execution"""
+		if isinstance(self.graph, GraphNodeBase):
+			self.graph.markDirty(self)
+
 	def setState(self, state:State):
 		self.state = state
+		deferred = getattr(self.graph, "deferredStateSignals", None)
+		if deferred is not None:
+			# graph publishes state changes in batches
+			deferred.record(self, state)
+			return
 		self.stateChanged()
 
 
@@ -270,18 +343,45 @@ class GraphNode( Tree, PostInitMixin,  GraphNodeBase,
 			"main" : (self.preExecution, self.execute, self.postExecution)
 		}
 
-	def execStage(self, stageIndex=0):
-		"""handle pre-, main and post-execution functions on given stage"""
-		key = tuple(self.executionStages().keys())[stageIndex]
-		execFunctions = self.executionStages()[key]
+	def stageFunctions(self, stageIndex=0)->tuple:
+		"""return (pre, main, post) functions for given stage"""
+		return tuple(self.executionStages().values())[stageIndex]
+
+	def execStage(self, stageIndex=0, cache:NodeResultCache=None,
+	              profiler:ExecutionProfiler=None):
+		"""handle pre-, main and post-execution functions on given stage
+		if a result cache is given and holds outputs for this node's
+		current inputs and settings, they are restored instead of
+		running the main function.
+		if a profiler is given, each function is timed"""
+		execFunctions = self.stageFunctions(stageIndex)
+		if profiler is not None:
+			execFunctions = tuple(
+				profiler.wrapPhase(self, phase, fn) for phase, fn in
+				zip(profiler.phases, execFunctions))
 
 		errorType, errorVal, errorTb = None, None, None
 		preResult = execFunctions[0]()
+		cacheKey = cache.nodeKey(self) if cache is not None else None
+		if cacheKey is not None and self.restoreCachedOutputs(cache, cacheKey):
+			return execFunctions[2]()
 		try:
 			mainResult = execFunctions[1]()
 		except Exception as e:
-			errorType = e
+			errorType, errorVal, errorTb = type(e), e, e.__traceback__
 		postResult = execFunctions[2](errorType, errorVal, errorTb)
+		if cacheKey is not None and self.state == self.State.complete:
+			cache.put(cacheKey, treeValues(self.outputRoot))
+
+	def restoreCachedOutputs(self, cache:NodeResultCache, key:str)->bool:
+		"""look up outputs in cache, set and propagate them if found
+		returns True on a hit"""
+		outputs = cache.get(key)
+		if outputs is None:
+			return False
+		applyTreeValues(self.outputRoot, outputs)
+		self.propagateOutputs()
+		return True
 
 	def execToStage(self, stageIndex=0):
 		endIndex = stageIndex if stageIndex > -1 else (len(self.executionStages()) + stageIndex)
@@ -293,7 +393,10 @@ class GraphNode( Tree, PostInitMixin,  GraphNodeBase,
 
 
 	def propagateOutputs(self):
-		"""references the value of every output to that of every connected input"""
+		"""references the value of every output to that of every connected input
+		detached nodes (eg those executing in a worker process) have nothing to do"""
+		if self.graph is None:
+			return
 		for i in self.outEdges:
 			i.dest[1].value = i.source[1].value
 
@@ -416,7 +519,7 @@ class GraphNode( Tree, PostInitMixin,  GraphNodeBase,
 			"settings" : self.settings.serialise(),
 			#"CLASS" : self.__class__.__name__
 		}
-		if self.real:
+		if getattr(self, "real", None):
 			serial["real"] = self.real.serialise()
 			#serial["memory"] = self.real.memory.serialise()
 		return serial
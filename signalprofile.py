@@ -0,0 +1,178 @@
+"""opt-in instrumentation for node and graph signals -
+while a SignalProfiler is active, Signal.__call__ is patched at class
+level to count and time emissions of watched signals.
+
+each emission is timed inclusive of every slot it calls, and also
+exclusive of nested emissions, as self time - slots are stored inside
+the tree library, so the time of one emission is the time of its slots.
+nested emissions are tracked per thread, giving cascade depth and the
+chain of signals from the outermost emission down to each one.
+
+signals are identified by the class of the object holding them and
+their attribute name, so watch() objects before profiling
+"""
+
+from __future__ import annotations
+
+import typing as T
+import threading, time
+from collections import defaultdict
+
+from tree import Signal
+
+if T.TYPE_CHECKING:
+	from treegraph.graph import Graph
+
+
+# (sender class name, signal attribute name)
+SignalKey = T.Tuple[str, str]
+
+
+class SignalProfiler(object):
+	"""use as a context manager around the edits to measure -
+	only one profiler can be active at once"""
+
+	_active = None #type: SignalProfiler
+	_originalCall = None #type: T.Callable
+
+	def __init__(self):
+		# { id(signal) : (signal, key) } - holds signals while profiling
+		self._keys = {} #type: T.Dict[int, T.Tuple[Signal, SignalKey]]
+		# { key : [count, inclusive seconds, self seconds] }
+		self.signalStats = defaultdict(lambda : [0, 0.0, 0.0])
+		# { chain of keys from outermost emission : [count, inclusive seconds] }
+		self.chainStats = defaultdict(lambda : [0, 0.0])
+		self.maxDepth = 0
+		self._lock = threading.Lock()
+		self._local = threading.local()
+
+	# region watching
+	def watch(self, obj):
+		"""profile every Signal held as an attribute of obj"""
+		for name, value in vars(obj).items():
+			if isinstance(value, Signal):
+				self._keys.setdefault(id(value), (value, (type(obj).__name__, name)))
+
+	def watchGraph(self, graph:Graph, attrs=False):
+		"""watch graph, its nodes and subgraphs -
+		if attrs, also each node's attributes"""
+		from treegraph.graph import Graph
+		self.watch(graph)
+		for node in graph.nodes:
+			if isinstance(node, Graph):
+				self.watchGraph(node, attrs=attrs)
+				continue
+			self.watch(node)
+			if attrs:
+				toVisit = list(node.inputRoot.branches) + \
+				          list(node.outputRoot.branches)
+				while toVisit:
+					attr = toVisit.pop()
+					self.watch(attr)
+					toVisit.extend(attr.branches)
+	#endregion
+
+	# region patching
+	def __enter__(self):
+		if SignalProfiler._active is not None:
+			raise RuntimeError("a SignalProfiler is already active")
+		SignalProfiler._active = self
+		SignalProfiler._originalCall = Signal.__call__
+		Signal.__call__ = _profiledCall
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		Signal.__call__ = SignalProfiler._originalCall
+		SignalProfiler._active = None
+		SignalProfiler._originalCall = None
+
+	def _stack(self)->T.List[T.List]:
+		"""this thread's open emissions, as [chain, nested seconds]"""
+		stack = getattr(self._local, "stack", None)
+		if stack is None:
+			stack = self._local.stack = []
+		return stack
+
+	def _record(self, chain:T.Tuple[SignalKey, ...], inclusive:float,
+	            nested:float):
+		with self._lock:
+			stats = self.signalStats[chain[-1]]
+			stats[0] += 1
+			stats[1] += inclusive
+			stats[2] += inclusive - nested
+			chainStats = self.chainStats[chain]
+			chainStats[0] += 1
+			chainStats[1] += inclusive
+			self.maxDepth = max(self.maxDepth, len(chain))
+	#endregion
+
+	# region output
+	def clear(self):
+		with self._lock:
+			self.signalStats.clear()
+			self.chainStats.clear()
+			self.maxDepth = 0
+
+	def senderCounts(self)->T.Dict[str, int]:
+		"""{ sender class name : emissions }"""
+		counts = defaultdict(int)
+		for (senderName, signalName), stats in self.signalStats.items():
+			counts[senderName] += stats[0]
+		return dict(counts)
+
+	def costliestChains(self, limit=10
+	                    )->T.List[T.Tuple[T.Tuple[SignalKey, ...], int, float]]:
+		"""(chain, count, inclusive seconds) of cascades at least
+		two signals deep, most total time first"""
+		chains = [(k, v[0], v[1]) for k, v in self.chainStats.items()
+		          if len(k) > 1]
+		return sorted(chains, key=lambda x: x[2], reverse=True)[:limit]
+
+	def report(self, limit=10)->str:
+		"""text tables of signal costs, sender classes and chains"""
+		header = "{:<40} {:>8} {:>10} {:>10} {:>10}".format(
+			"signal", "count", "total ms", "self ms", "mean us")
+		lines = [header, "-" * len(header)]
+		for key, (count, inclusive, selfTime) in sorted(
+				self.signalStats.items(), key=lambda x: x[1][1],
+				reverse=True)[:limit]:
+			lines.append("{:<40} {:>8} {:>10.3f} {:>10.3f} {:>10.2f}".format(
+				".".join(key)[:40], count, inclusive * 1000, selfTime * 1000,
+				inclusive / count * 1e6))
+		lines.append("")
+		lines.append("emissions by sender class :")
+		for name, count in sorted(self.senderCounts().items(),
+		                          key=lambda x: x[1], reverse=True):
+			lines.append("  {:<38} {:>8}".format(name, count))
+		lines.append("")
+		lines.append("max cascade depth : {}".format(self.maxDepth))
+		lines.append("costliest chains :")
+		for chain, count, inclusive in self.costliestChains(limit):
+			lines.append("  {:>10.3f} ms  x{:<6} {}".format(
+				inclusive * 1000, count,
+				" -> ".join(".".join(i) for i in chain)))
+		return "\n".join(lines)
+	#endregion
+
+
+def _profiledCall(signal, *args, **kwargs):
+	"""replaces Signal.__call__ while a profiler is active"""
+	profiler = SignalProfiler._active
+	# profiler may have exited on another thread, restoring the original
+	original = SignalProfiler._originalCall or Signal.__call__
+	entry = profiler._keys.get(id(signal)) if profiler is not None else None
+	if entry is None or entry[0] is not signal:
+		return original(signal, *args, **kwargs)
+	stack = profiler._stack()
+	chain = (stack[-1][0] if stack else ()) + (entry[1], )
+	frame = [chain, 0.0]
+	stack.append(frame)
+	start = time.perf_counter()
+	try:
+		return original(signal, *args, **kwargs)
+	finally:
+		inclusive = time.perf_counter() - start
+		stack.pop()
+		if stack:
+			stack[-1][1] += inclusive
+		profiler._record(chain, inclusive, frame[1])
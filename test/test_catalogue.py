@@ -0,0 +1,104 @@
+import os, sys, tempfile, unittest
+from pathlib import Path
+
+from treegraph import Graph, GraphNode
+from treegraph.catalogue import ClassCatalogue, CatalogueWatcher, ScanManifest
+from treegraph.graphjournal import startTracking
+
+class TestCatalogue(unittest.TestCase):
+	""" test for class scanning """
+
+	def test_catalogueManifest(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			packageDir = Path(tempDir) / "manifestnodes"
+			packageDir.mkdir()
+			(packageDir / "__init__.py").write_text("")
+			(packageDir / "helpers.py").write_text("value = 3\n")
+			(packageDir / "nodes.py").write_text(
+				"from treegraph.node import GraphNode\n"
+				"class ScannedNode(GraphNode):\n\tpass\n"
+				"class Other(object):\n\tpass\n"
+				"GenNode = type('GenNode', (ScannedNode, ), {})\n")
+			manifestPath = Path(tempDir) / "manifest.json"
+
+			catalogue = ClassCatalogue([packageDir], {GraphNode},
+			                           manifestPath=manifestPath)
+			catalogue.gatherClasses()
+			self.assertEqual({i.__name__ for i in catalogue.classes},
+			                 {"GraphNode", "ScannedNode", "GenNode"})
+
+			manifest = ScanManifest(manifestPath, key=catalogue.manifest.key)
+			nodesPath = (packageDir / "nodes.py").resolve()
+			self.assertEqual(manifest.classEntries(nodesPath),
+			                 [("ScannedNode", "ScannedNode"),
+			                  ("GenNode", "GenNode")])
+			# modules without classes are never imported
+			self.assertEqual(
+				manifest.classEntries((packageDir / "helpers.py").resolve()), [])
+
+			# changed files are scanned again
+			with open(nodesPath, "a") as f:
+				f.write("class Extra(ScannedNode):\n\tpass\n")
+			self.assertIsNone(manifest.classEntries(nodesPath))
+
+	def test_catalogueLazyClasses(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			packageDir = Path(tempDir) / "lazynodes"
+			packageDir.mkdir()
+			(packageDir / "__init__.py").write_text("")
+			(packageDir / "nodes.py").write_text(
+				"from treegraph.node import GraphNode\n"
+				"class LazyNode(GraphNode):\n\tpass\n")
+			manifestPath = Path(tempDir) / "manifest.json"
+			ClassCatalogue([packageDir], {GraphNode},
+			               manifestPath=manifestPath).gatherClasses()
+			sys.modules.pop("lazynodes.nodes", None)
+
+			# warm scan registers the class without importing it
+			catalogue = ClassCatalogue([packageDir], {GraphNode},
+			                           manifestPath=manifestPath)
+			catalogue.gatherClasses(lazy=True)
+			self.assertIn("LazyNode", catalogue.classNames())
+			self.assertNotIn("lazynodes.nodes", sys.modules)
+			cls = catalogue.classFromName("LazyNode")
+			self.assertEqual(cls.__name__, "LazyNode")
+			self.assertIn("lazynodes.nodes", sys.modules)
+			self.assertIs(catalogue.classFromName("LazyNode"), cls)
+
+	def test_catalogueWatcherMigration(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			packageDir = Path(tempDir) / "reloadnodes"
+			packageDir.mkdir()
+			(packageDir / "__init__.py").write_text("")
+			modulePath = packageDir / "nodes.py"
+			modulePath.write_text(
+				"from treegraph.node import GraphNode\n"
+				"class ReloadNode(GraphNode):\n\tversion = 1\n")
+			catalogue = ClassCatalogue([packageDir], {GraphNode})
+			catalogue.gatherClasses()
+
+			graph = Graph("reloadGraph")
+			node = graph.addNode(catalogue.classFromName("ReloadNode")("a"))
+			node.addInput("in").value = 4
+			watcher = CatalogueWatcher(catalogue)
+			watcher.watchGraph(graph)
+			startTracking(graph)
+			batches = []
+			graph.batchChanged.connect(batches.append)
+
+			modulePath.write_text(
+				"from treegraph.node import GraphNode\n"
+				"class ReloadNode(GraphNode):\n\tversion = 2\n")
+			stat = os.stat(modulePath)
+			os.utime(modulePath, ns=(stat.st_atime_ns,
+			                         stat.st_mtime_ns + 10 ** 9))
+			watcher.poll()
+
+			# same node object, new class, attrs kept
+			self.assertIs(graph.nodeFromUID(node.uid), node)
+			self.assertEqual(node.version, 2)
+			self.assertIs(type(node), catalogue.classFromName("ReloadNode"))
+			self.assertEqual(node.getInput("in").value, 4)
+			# one batch for the graph, and node saved again on next save
+			self.assertEqual([i.migratedNodes for i in batches], [[node]])
+			self.assertIn(node, graph.changeTracker.changedNodes)
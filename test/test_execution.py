@@ -0,0 +1,237 @@
+
+
+import os, tempfile, unittest
+
+from treegraph import Graph, GraphNode, ExecutionPath
+from treegraph.blobstore import BlobRef, blobThreshold
+from treegraph.constant import NodeState
+from treegraph.execache import NodeResultCache
+from treegraph.exegraph import DeferredStateSignals
+from treegraph.exeprofile import ExecutionProfiler
+from treegraph.executor import ExecutionScheduler, ThreadNodeExecutor, \
+	ProcessNodeExecutor, makeExecutionPayload, executePayload
+
+
+class AddNode(GraphNode):
+	"""adds one to its input"""
+	cacheResults = True
+
+	def defineAttrs(self):
+		self.addInput("in")
+		self.addOutput("out")
+
+	def execute(self):
+		self.getOutput("out").value = (self.getInput("in").value or 0) + 1
+		self.propagateOutputs()
+
+
+class QuietAddNode(AddNode):
+	"""adds one, leaving its outputs for the executor to propagate"""
+
+	def execute(self):
+		self.getOutput("out").value = (self.getInput("in").value or 0) + 1
+
+
+class CountNode(AddNode):
+	"""counts how many times it really executes"""
+	executions = 0
+
+	def execute(self):
+		CountNode.executions += 1
+		super(CountNode, self).execute()
+
+
+class PinnedNode(AddNode):
+	"""records the processes it executes in"""
+	pinToMainProcess = True
+	pids = []
+
+	def execute(self):
+		PinnedNode.pids.append(os.getpid())
+		super(PinnedNode, self).execute()
+
+
+class LengthNode(GraphNode):
+	"""outputs length of its input"""
+	cacheResults = True
+
+	def defineAttrs(self):
+		self.addInput("in")
+		self.addOutput("out")
+
+	def execute(self):
+		self.getOutput("out").value = len(self.getInput("in").value)
+
+
+class FailNode(AddNode):
+
+	def execute(self):
+		raise RuntimeError("failing on purpose")
+
+
+class TestExecution(unittest.TestCase):
+	""" test for execution scheduling """
+
+	def setUp(self):
+		self.graph = Graph(name="testGraph")
+
+	def connect(self, source, dest):
+		return self.graph.addEdge(source.getOutput("out"),
+		                          dest.getInput("in"))
+
+	def test_threadedExecution(self):
+		"""a -> b, a -> failing c -> d, e on its own"""
+		a, b, d, e = [self.graph.addNode(AddNode(i)) for i in "abde"]
+		c = self.graph.addNode(FailNode("c"))
+		self.connect(a, b)
+		self.connect(a, c)
+		self.connect(c, d)
+
+		path = ExecutionPath.getExecPathToAll(self.graph)
+		scheduler = ExecutionScheduler(self.graph, path.sequence,
+		                               ThreadNodeExecutor(maxWorkers=4))
+		failed = scheduler.run()
+
+		self.assertEqual(failed, [c])
+		self.assertEqual(scheduler.blockedNodes, {d})
+		self.assertEqual(b.getOutput("out").value, 2)
+		self.assertEqual(e.state, GraphNode.State.complete)
+		self.assertEqual(c.state, GraphNode.State.failed)
+		self.assertEqual(d.state, GraphNode.State.neutral)
+
+	def test_processExecution(self):
+		"""a -> pinned p -> b, c on its own, on a real process pool"""
+		PinnedNode.pids = []
+		a, b, c = [self.graph.addNode(AddNode(i)) for i in "abc"]
+		p = self.graph.addNode(PinnedNode("p"))
+		self.connect(a, p)
+		self.connect(p, b)
+		a.getInput("in").value = 1
+
+		path = ExecutionPath.getExecPathToAll(self.graph)
+		failed = ExecutionScheduler(self.graph, path.sequence,
+		                            ProcessNodeExecutor(maxWorkers=2)).run()
+
+		self.assertEqual(failed, [])
+		self.assertEqual(b.getOutput("out").value, 4)
+		self.assertEqual(c.getOutput("out").value, 1)
+		self.assertEqual(PinnedNode.pids, [os.getpid()])
+
+	def test_executorPropagation(self):
+		"""thread and process executors both propagate outputs"""
+		for executorCls in (ThreadNodeExecutor, ProcessNodeExecutor):
+			graph = Graph(name="propagationGraph")
+			a, b = [graph.addNode(QuietAddNode(i)) for i in "ab"]
+			graph.addEdge(a.getOutput("out"), b.getInput("in"))
+			path = ExecutionPath.getExecPathToAll(graph)
+			ExecutionScheduler(graph, path.sequence,
+			                   executorCls(maxWorkers=2)).run()
+			self.assertEqual(b.getInput("in").value, 1, executorCls)
+			self.assertEqual(b.getOutput("out").value, 2, executorCls)
+
+	def test_executionPayload(self):
+		node = self.graph.addNode(AddNode("a"))
+		node.getInput("in").value = 3
+		outputs = executePayload(makeExecutionPayload(node))
+		self.assertEqual(outputs, {("out", ) : 4})
+		# payload execution leaves original node untouched
+		self.assertIsNone(node.getOutput("out").value)
+
+	def test_blobPayload(self):
+		node = self.graph.addNode(LengthNode("a"))
+		node.getInput("in").value = os.urandom(blobThreshold)
+		with tempfile.TemporaryDirectory() as tempDir:
+			path = os.path.join(tempDir, "graph.tgr")
+			self.graph.save(path)
+			loaded = Graph.load(path).nodeFromUID(node.uid)
+			# mapped inputs travel by reference, and can be cached
+			payload = makeExecutionPayload(loaded)
+			self.assertIsInstance(payload.inputs[("in", )], BlobRef)
+			self.assertEqual(executePayload(payload),
+			                 {("out", ) : blobThreshold})
+			self.assertIsNotNone(NodeResultCache().nodeKey(loaded))
+			del loaded
+
+	def test_resultCache(self):
+		CountNode.executions = 0
+		cache = NodeResultCache(maxBytes=1024)
+		node = self.graph.addNode(CountNode("a"))
+		node.getInput("in").value = 1
+		node.execStage(0, cache=cache)
+		node.getOutput("out").value = None
+		node.execStage(0, cache=cache)
+		self.assertEqual(CountNode.executions, 1)
+		self.assertEqual(node.getOutput("out").value, 2)
+		self.assertEqual(cache.hits, 1)
+
+		# changing inputs misses
+		node.getInput("in").value = 5
+		node.execStage(0, cache=cache)
+		self.assertEqual(CountNode.executions, 2)
+		self.assertLessEqual(cache.memoryBytes, 1024)
+
+		# nodes are only cached if they declare themselves pure
+		self.assertIsNone(cache.nodeKey(self.graph.addNode(GraphNode("b"))))
+
+	def test_profiler(self):
+		a, b = [self.graph.addNode(AddNode(i)) for i in "ab"]
+		self.connect(a, b)
+		profiler = ExecutionProfiler()
+		path = ExecutionPath.getExecPathToAll(self.graph)
+		with profiler:
+			ExecutionScheduler(self.graph, path.sequence,
+			                   ThreadNodeExecutor(maxWorkers=2),
+			                   profiler=profiler).run()
+
+		phases = {(i.nodeName, i.phase) for i in profiler.records}
+		for node in "ab":
+			for phase in profiler.phases:
+				self.assertIn((node, phase), phases)
+		trace = profiler.toChromeTrace()
+		self.assertEqual(len([i for i in trace["traceEvents"]
+		                      if i["ph"] == "X"]), 6)
+		self.assertIn("node", profiler.summary())
+
+
+
+
+	def test_deferredStateSignals(self):
+		a, b = [self.graph.addNode(AddNode(i)) for i in "ab"]
+		self.connect(a, b)
+		emitted = []
+		snapshots = []
+		a.stateChanged.connect(lambda *args : emitted.append(a))
+		self.graph.nodeStatesChanged.connect(snapshots.append)
+
+		path = ExecutionPath.getExecPathToAll(self.graph)
+		with DeferredStateSignals(self.graph):
+			ExecutionScheduler(self.graph, path.sequence,
+			                   ThreadNodeExecutor(maxWorkers=2)).run()
+		# no per-node signals, one snapshot of final states
+		self.assertEqual(emitted, [])
+		self.assertEqual(len(snapshots), 1)
+		self.assertEqual(snapshots[0], {a : NodeState.complete,
+		                                b : NodeState.complete})
+
+	def test_evaluate(self):
+		"""a -> b, c on its own - evaluating b runs only a and b"""
+		a, b, c = [self.graph.addNode(CountNode(i)) for i in "abc"]
+		self.connect(a, b)
+		CountNode.executions = 0
+
+		self.assertEqual(self.graph.evaluate(b.getOutput("out")), 2)
+		self.assertEqual(CountNode.executions, 2)
+		self.assertNotEqual(c.state, NodeState.complete)
+
+		# memoised within the epoch
+		self.assertEqual(self.graph.evaluate(b.getOutput("out")), 2)
+		self.assertEqual(CountNode.executions, 2)
+
+		# dirty nodes run again
+		a.getInput("in").value = 5
+		self.assertEqual(self.graph.evaluate(b.getOutput("out")), 7)
+		self.assertEqual(CountNode.executions, 4)
+
+		self.graph.beginEvaluationEpoch()
+		self.graph.evaluate(b.getInput("in"))
+		self.assertEqual(CountNode.executions, 5)
@@ -1,8 +1,15 @@
 
-import unittest
+import marshal, os, pickle, struct, sys, tempfile, tracemalloc, unittest
 
 from tree import Tree
-from treegraph import Graph, GraphEdge, GraphNode
+from treegraph import Graph, GraphEdge, GraphNode, ExecutionPath
+from treegraph.blobstore import blobPath, blobRef, blobThreshold
+from treegraph.graphfile import GraphFileError, RecordType, fileMagic, \
+	formatVersion, loadClass
+from treegraph.graphfolder import saveGraphFolder
+from treegraph.graphjournal import journalPath
+from treegraph.lib.branch import branchFromAddress
+from treegraph.signalprofile import SignalProfiler
 
 class TestGraph(unittest.TestCase):
 	""" test for graph methods """
@@ -25,5 +32,484 @@ class TestGraph(unittest.TestCase):
 		self.assertIs(self.graph("testNode"), node)
 		self.assertIs(self.graph, node.graph)
 
+	def test_graphAdjacency(self):
+		nodeA = GraphNode("nodeA")
+		nodeB = GraphNode("nodeB")
+		outA = nodeA.addOutput("out")
+		inB = nodeB.addInput("in")
+		inB2 = nodeB.addInput("in2")
+		self.graph.addNode(nodeA)
+		self.graph.addNode(nodeB)
+
+		edge = self.graph.addEdge(outA, inB)
+		self.graph.addEdge(outA, inB2)
+		self.assertEqual(nodeA.directFuture, {nodeB})
+		self.assertEqual(nodeB.directHistory, {nodeA})
+		self.assertEqual(self.graph.edgeMultiplicity(nodeA, nodeB), 2)
+
+		self.graph.deleteEdge(edge)
+		self.assertEqual(self.graph.edgeMultiplicity(nodeA, nodeB), 1)
+		self.assertEqual(nodeA.directFuture, {nodeB})
+
+		self.graph.deleteNode(nodeB)
+		self.assertEqual(nodeA.directFuture, set())
+
+	def test_graphHistoryCache(self):
+		"""diamond a -> (b, c) -> d"""
+		nodes = {}
+		for name in "abcd":
+			node = GraphNode(name)
+			node.addInput("in")
+			node.addInput("in2")
+			node.addOutput("out")
+			nodes[name] = self.graph.addNode(node)
+		abEdge = self.graph.addEdge(nodes["a"].getOutput("out"), nodes["b"].getInput("in"))
+		self.graph.addEdge(nodes["a"].getOutput("out"), nodes["c"].getInput("in"))
+		self.graph.addEdge(nodes["b"].getOutput("out"), nodes["d"].getInput("in"))
+		self.graph.addEdge(nodes["c"].getOutput("out"), nodes["d"].getInput("in2"))
+
+		self.assertEqual(set(nodes["d"].history),
+		                 {nodes["a"], nodes["b"], nodes["c"]})
+		self.assertIs(nodes["d"].history, nodes["d"].history)
+
+		generation = self.graph.topologyGeneration
+		self.graph.deleteEdge(abEdge)
+		self.assertGreater(self.graph.topologyGeneration, generation)
+		self.assertEqual(set(nodes["a"].future), {nodes["c"], nodes["d"]})
+		self.assertEqual(set(nodes["b"].history), set())
+
+	def test_graphTopologicalOrder(self):
+		nodes = []
+		for name in "abc":
+			node = GraphNode(name)
+			node.addInput("in")
+			node.addOutput("out")
+			nodes.append(self.graph.addNode(node))
+		a, b, c = nodes
+		# connect against creation order to force a repair
+		self.graph.addEdge(c.getOutput("out"), b.getInput("in"))
+		self.graph.addEdge(b.getOutput("out"), a.getInput("in"))
+		self.assertEqual(self.graph.topologicalOrder(), [c, b, a])
+
+		# closing the loop is rejected
+		self.assertFalse(self.graph.checkLegalConnection(
+			a.getOutput("out"), c.getInput("in")))
+		self.assertFalse(self.graph.addEdge(
+			a.getOutput("out"), c.getInput("in")))
+		self.assertEqual(len(self.graph.edges), 2)
+
+		path = ExecutionPath.getExecPathToNodes(self.graph, {b})
+		self.assertEqual(path.sequence, [c, b])
+
+	def test_graphIslands(self):
+		nodes = []
+		for name in "abcd":
+			node = GraphNode(name)
+			node.addInput("in")
+			node.addInput("in2")
+			node.addOutput("out")
+			nodes.append(self.graph.addNode(node))
+		a, b, c, d = nodes
+		abEdge = self.graph.addEdge(a.getOutput("out"), b.getInput("in"))
+		self.graph.addEdge(c.getOutput("out"), b.getInput("in2"))
+		islands = sorted(self.graph.getIslands().values(), key=len)
+		self.assertEqual(islands, [{d}, {a, b, c}])
+
+		# deleting an edge splits its island
+		self.graph.deleteEdge(abEdge)
+		islands = {frozenset(i) for i in self.graph.getIslands().values()}
+		self.assertEqual(islands, {frozenset({a}), frozenset({d}),
+		                           frozenset({b, c})})
+		self.assertEqual(list(self.graph.getIslands({b}).values()), [{b}])
+
+	def test_graphNodeLookup(self):
+		a = self.graph.addNode(GraphNode("a"))
+		b = self.graph.addNode(GraphNode("b"))
+		self.assertIs(self.graph.nodeFromUID(a.uid), a)
+		self.assertIs(self.graph.getNode("b"), b)
+		self.assertEqual(set(self.graph.knownNames), {"a", "b"})
+
+		b.setName("c")
+		self.assertEqual(self.graph.nodesFromName("b"), [])
+		self.assertEqual(self.graph.nodesFromName("c"), [b])
+
+		self.graph.deleteNode(a)
+		self.assertIsNone(self.graph.nodeFromUID(a.uid))
+		self.assertEqual(self.graph.knownUIDs, [b.uid])
+
+	def test_graphEdgeTable(self):
+		nodes = []
+		for name in "abc":
+			node = GraphNode(name)
+			node.addInput("in")
+			node.addOutput("out")
+			nodes.append(self.graph.addNode(node))
+		a, b, c = nodes
+		abEdge = self.graph.addEdge(a.getOutput("out"), b.getInput("in"))
+		bcEdge = self.graph.addEdge(b.getOutput("out"), c.getInput("in"))
+		self.assertEqual(len(self.graph.edgeTable), 2)
+
+		# query views compare equal to edges held by graph
+		self.assertEqual(self.graph.edgesInto({b, c}), [abEdge, bcEdge])
+		self.assertEqual(self.graph.edgesFrom({b}), [bcEdge])
+		self.assertIn(self.graph.edgesInto({c})[0], self.graph.edges)
+
+		self.graph.deleteEdge(self.graph.edgesInto({b})[0])
+		self.assertEqual(len(self.graph.edgeTable), 1)
+		self.assertEqual(self.graph.edgesInto({b}), [])
+		# removed edge stays readable, but no longer matches its row
+		self.assertIs(abEdge.sourceNode, a)
+		self.assertFalse(abEdge.isLive)
+		self.assertFalse(self.graph.deleteEdge(abEdge))
+
+		# freed row is reused by the next edge
+		caEdge = self.graph.addEdge(c.getOutput("out"), a.getInput("in"))
+		self.assertEqual(self.graph.edgeTable.rowCount, 2)
+		self.assertEqual(caEdge.row, abEdge.row)
+		self.assertNotEqual(caEdge, abEdge)
+		self.assertEqual(self.graph.edges, {bcEdge, caEdge})
+
+		# an edge given to addEdge is found by the same hash once added
+		d = self.graph.addNode(GraphNode("d"))
+		adEdge = GraphEdge(a.getOutput("out"), d.addInput("in"), self.graph)
+		held = {adEdge}
+		self.graph.addEdge(adEdge.sourceAttr, adEdge.destAttr, newEdge=adEdge)
+		self.assertIn(adEdge, held)
+		self.assertIs(self.graph.edgesInto({d})[0], adEdge)
+
+	def test_graphEdgeMemory(self):
+		"""edges are held only as table rows, not as python objects"""
+		count = 500
+		a = self.graph.addNode(GraphNode("a"))
+		b = self.graph.addNode(GraphNode("b"))
+		source = a.addOutput("out")
+		inputs = [b.addInput("in{}".format(i)) for i in range(count)]
+
+		tracemalloc.start()
+		before = tracemalloc.get_traced_memory()[0]
+		self.graph.connectMany(source, inputs)
+		after = tracemalloc.get_traced_memory()[0]
+		tracemalloc.stop()
+
+		self.assertEqual(len(self.graph.edgeTable), count)
+		# a row is 9 ints, plus an interned id for its dest attr - edges
+		# held as objects in sets and maps took several times this
+		self.assertLess((after - before) / count, 256)
+
+	def test_graphBatch(self):
+		received = []
+		self.graph.batchChanged.connect(received.append)
+		self.graph.edgesChanged.connect(
+			lambda *args: self.fail("edge event emitted inside batch"))
+		with self.graph.batch():
+			nodes = []
+			for name in "abc":
+				node = GraphNode(name)
+				node.addInput("in")
+				node.addOutput("out")
+				nodes.append(self.graph.addNode(node))
+			a, b, c = nodes
+			self.graph.addEdge(b.getOutput("out"), c.getInput("in"))
+			self.graph.addEdge(a.getOutput("out"), b.getInput("in"))
+			# closes a cycle, rejected on exit
+			self.graph.addEdge(c.getOutput("out"), a.getInput("in"))
+
+		self.assertEqual(len(received), 1)
+		changes = received[0]
+		self.assertEqual(changes.addedNodes, [a, b, c])
+		self.assertEqual(len(changes.addedEdges), 2)
+		self.assertEqual(len(self.graph.edges), 2)
+		self.assertEqual(self.graph.topologicalOrder(), [a, b, c])
+		self.assertEqual(self.graph.dirtyNodes, {a, b, c})
+
+		# a rejected edge leaves the connection it would have replaced
+		d = self.graph.addNode(GraphNode("d"))
+		d.addOutput("out")
+		with self.graph.batch():
+			self.graph.addEdge(d.getOutput("out"), a.getInput("in"))
+		with self.graph.batch():
+			self.graph.addEdge(c.getOutput("out"), a.getInput("in"))
+		self.assertEqual([i.sourceNode for i in a.getInput("in").connections],
+		                 [d])
+
+	def test_graphBulkConstruction(self):
+		a, b, c = self.graph.addNodes((GraphNode, i) for i in "abc")
+		self.assertEqual([i.name for i in self.graph.nodes], ["a", "b", "c"])
+		for node in (a, b, c):
+			node.addInput("in")
+			node.addInput("in2")
+			node.addOutput("out")
+
+		edges = self.graph.connectMany(
+			a.getOutput("out"), [b.getInput("in"), c.getInput("in")])
+		self.assertEqual(len(edges), 2)
+		edges = self.graph.addEdges([(b.getOutput("out"), c.getInput("in2"))])
+		self.assertEqual(self.graph.topologicalOrder(), [a, b, c])
+
+		# whole batch is rejected if any edge closes a cycle
+		with self.assertRaises(RuntimeError):
+			self.graph.addEdges([(a.getOutput("out"), b.getInput("in2")),
+			                     (c.getOutput("out"), a.getInput("in"))])
+		self.assertEqual(len(self.graph.edges), 3)
+
+		# replacing c's input from b breaks the only path to close
+		self.graph.addEdges([(a.getOutput("out"), c.getInput("in2")),
+		                     (c.getOutput("out"), b.getInput("in2"))])
+		self.assertEqual(self.graph.topologicalOrder(), [a, c, b])
+
+		with self.assertRaises(RuntimeError):
+			self.graph.addEdges([(b.getInput("in"), c.getInput("in"))])
+
+		# edges refused by addEdge are handed back
+		rejected = []
+		self.graph.state = self.graph.State.executing
+		try:
+			edges = self.graph.connectMany(a.getOutput("out"),
+			                               [b.getInput("in")], rejected)
+		finally:
+			self.graph.state = self.graph.State.neutral
+		self.assertEqual(edges, [])
+		self.assertEqual(rejected, [(a.getOutput("out"), b.getInput("in"))])
+
+	def test_graphBinarySaveLoad(self):
+		a = self.graph.addNode(GraphNode("a"))
+		a.addOutput("out")
+		sub = self.graph.addNode(Graph("sub"))
+		b = sub.addNode(GraphNode("b"))
+		compound = b.addInput("compound")
+		compound.addAttr("leaf").value = 3
+		b.settings.addSetting("mode", value="fast")
+		sub.addEdge(a.getOutput("out"), compound)
+		self.graph.addNodeToSet(a, "outputs")
+
+		with tempfile.TemporaryDirectory() as tempDir:
+			path = os.path.join(tempDir, "graph.tgr")
+			self.graph.save(path)
+			loaded = Graph.load(path)
+
+		self.assertEqual(loaded.uid, self.graph.uid)
+		newSub = loaded.nodeFromUID(sub.uid)
+		newB = newSub.nodeFromUID(b.uid)
+		self.assertEqual(newB.getInput("compound")("leaf").value, 3)
+		self.assertEqual(newB.settings("mode").value, "fast")
+		self.assertEqual(len(newSub.edges), 1)
+		edge = next(iter(newSub.edges))
+		self.assertIs(edge.sourceNode, loaded.nodeFromUID(a.uid))
+		self.assertEqual(loaded.getNodesInSet("outputs"),
+		                 {loaded.nodeFromUID(a.uid)})
+
+	def test_graphFileRejectsObjects(self):
+		"""records are plain data - pickled files and code never load"""
+		with tempfile.TemporaryDirectory() as tempDir:
+			path = os.path.join(tempDir, "graph.tgr")
+			with open(path, "wb") as f:
+				f.write(fileMagic + bytes((1, )))
+				f.write(pickle.dumps({"uid" : "a"}))
+			with self.assertRaises(GraphFileError):
+				Graph.load(path)
+
+			data = marshal.dumps(compile("1", "record", "eval"))
+			with open(path, "wb") as f:
+				f.write(fileMagic + bytes((formatVersion, )))
+				f.write(struct.pack(">BQ", RecordType.header, len(data)))
+				f.write(data)
+			with self.assertRaises(GraphFileError):
+				Graph.load(path)
+
+			# classes are never imported from a file
+			with open(os.path.join(tempDir, "tgrimported.py"), "w") as f:
+				f.write("class FileNode(object):\n\tpass\n")
+			sys.path.insert(0, tempDir)
+			try:
+				self.assertIs(loadClass(("tgrimported", "FileNode"),
+				                        default=GraphNode), GraphNode)
+				self.assertNotIn("tgrimported", sys.modules)
+			finally:
+				sys.path.remove(tempDir)
+
+	def test_graphFileFailedSave(self):
+		"""a save that fails leaves the previous file and the graph as
+		they were"""
+		a = self.graph.addNode(GraphNode("a"))
+		a.addInput("in").value = 3
+		with tempfile.TemporaryDirectory() as tempDir:
+			path = os.path.join(tempDir, "graph.tgr")
+			self.graph.save(path)
+			self.assertIsNone(branchFromAddress(self.graph, ("nodeMemory", )))
+
+			a.getInput("in").value = object()
+			with self.assertRaises(GraphFileError):
+				self.graph.save(path)
+			self.assertEqual(os.listdir(tempDir), ["graph.tgr"])
+			loaded = Graph.load(path)
+			self.assertEqual(loaded.nodeFromUID(a.uid).getInput("in").value, 3)
+
+	def test_graphFolderSaveLoad(self):
+		a = self.graph.addNode(GraphNode("a"))
+		a.addOutput("out")
+		b = self.graph.addNode(GraphNode("b"))
+		b.addInput("in").value = 4
+		self.graph.addEdge(a.getOutput("out"), b.getInput("in"))
+		c = self.graph.addNode(GraphNode("c"))
+		c.settings.addSetting("mode", value=2)
+		d = self.graph.addNode(GraphNode("d"))
+		d.addInput("extra")
+
+		with tempfile.TemporaryDirectory() as tempDir:
+			# folders not written by the save are left alone
+			os.makedirs(os.path.join(tempDir, "other"))
+			open(os.path.join(tempDir, "other", "index.tgr"), "wb").close()
+			self.graph.save(tempDir, mode=Graph.SaveMode.separateFiles)
+			loaded = Graph.load(tempDir)
+			newB = loaded.nodeFromUID(b.uid)
+			newC = loaded.nodeFromUID(c.uid)
+			# edges to attrs added at runtime force a load
+			self.assertTrue(newB.isLoaded)
+			self.assertEqual(len(loaded.edges), 1)
+			self.assertFalse(newC.isLoaded)
+			self.assertEqual(newC.settings("mode").value, 2)
+			self.assertTrue(newC.isLoaded)
+			# so does any other branch lookup
+			newD = loaded.nodeFromUID(d.uid)
+			self.assertIsNotNone(branchFromAddress(newD("input"), ("extra", )))
+
+			# nothing changed, nothing rewritten
+			self.assertEqual(saveGraphFolder(loaded, tempDir), 0)
+			newB.getInput("in").value = 5
+			self.assertEqual(saveGraphFolder(loaded, tempDir), 1)
+			self.assertEqual(
+				Graph.load(tempDir).nodeFromUID(b.uid).getInput("in").value, 5)
+
+			loaded.deleteNode(newD)
+			saveGraphFolder(loaded, tempDir)
+			self.assertFalse(os.path.isfile(
+				os.path.join(tempDir, "nodes", "{}.tgr".format(d.uid))))
+			self.assertTrue(os.path.isdir(os.path.join(tempDir, "other")))
+
+	def test_graphFolderLazySubGraph(self):
+		sub = self.graph.addNode(Graph("sub"))
+		sub.settings.addSetting("mode", value=3)
+		e = sub.addNode(GraphNode("e"))
+
+		with tempfile.TemporaryDirectory() as tempDir:
+			self.graph.save(tempDir, mode=Graph.SaveMode.separateFiles)
+			loaded = Graph.load(tempDir)
+			# subgraph is filled from its index, its own state stays unloaded
+			newSub = loaded.nodeFromUID(sub.uid)
+			self.assertFalse(newSub.isLoaded)
+			self.assertEqual([i.uid for i in newSub.nodes], [e.uid])
+			self.assertFalse(newSub.isLoaded)
+			self.assertFalse(newSub.nodeFromUID(e.uid).isLoaded)
+
+			self.assertEqual(newSub.settings("mode").value, 3)
+			self.assertTrue(newSub.isLoaded)
+
+	def test_graphIncrementalSave(self):
+		a = self.graph.addNode(GraphNode("a"))
+		a.addOutput("out")
+		b = self.graph.addNode(GraphNode("b"))
+		b.addInput("in").value = 1
+		b.addInput("extra")
+		b.settings.addSetting("mode", value=2)
+		self.graph.addNodeToSet(a, "keep")
+		self.graph.addNodeToSet(b, "drop")
+
+		with tempfile.TemporaryDirectory() as tempDir:
+			path = os.path.join(tempDir, "graph.tgr")
+			self.graph.save(path)
+			self.graph.removeNodeSet("drop")
+			b.getInput("in").value = 2
+			b.removeAttr("extra", role="input")
+			b.settings.remove("mode")
+			c = self.graph.addNode(GraphNode("c"))
+			c.addInput("in")
+			self.graph.addEdge(a.getOutput("out"), c.getInput("in"))
+			self.graph.saveIncremental(path)
+			self.assertTrue(os.path.isfile(journalPath(path)))
+
+			loaded = Graph.load(path)
+			newB = loaded.nodeFromUID(b.uid)
+			self.assertEqual(newB.getInput("in").value, 2)
+			# removals replay too
+			self.assertIsNone(branchFromAddress(newB.inputRoot, ("extra", )))
+			self.assertIsNone(branchFromAddress(newB.settings, ("mode", )))
+			self.assertEqual(len(loaded.edges), 1)
+			self.assertIs(next(iter(loaded.edges)).destNode,
+			              loaded.nodeFromUID(c.uid))
+			self.assertEqual(loaded.nodeSetNames, ["keep"])
+
+			# a partial record from an interrupted write is dropped
+			journalSize = os.path.getsize(journalPath(path))
+			with open(journalPath(path), "ab") as f:
+				f.write(struct.pack(">BQ", RecordType.node, 100) + b"partial")
+			loaded = Graph.load(path)
+			self.assertEqual(loaded.nodeFromUID(b.uid).getInput("in").value, 2)
+			self.assertEqual(os.path.getsize(journalPath(path)), journalSize)
+
+			# full save folds journal back in
+			loaded.save(path)
+			self.assertFalse(os.path.isfile(journalPath(path)))
+
+	def test_graphBlobStorage(self):
+		node = self.graph.addNode(GraphNode("a"))
+		payload = os.urandom(blobThreshold)
+		node.data("points", create=True).value = payload
+
+		with tempfile.TemporaryDirectory() as tempDir:
+			path = os.path.join(tempDir, "graph.tgr")
+			self.graph.save(path)
+			self.assertTrue(os.path.isfile(blobPath(path)))
+			loaded = Graph.load(path)
+			value = loaded.nodeFromUID(node.uid).data("points").value
+			self.assertIsInstance(value, memoryview)
+			self.assertEqual(bytes(value), payload)
+			self.assertEqual(bytes(blobRef(value).open()), payload)
+			del value, loaded
+
+	def test_graphSignalProfile(self):
+		node = self.graph.addNode(GraphNode("a"))
+		profiler = SignalProfiler()
+		profiler.watchGraph(self.graph)
+		with profiler:
+			node.setState(node.state)
+		self.assertEqual(profiler.signalStats[("GraphNode", "stateChanged")][0], 1)
+		# stateChanged cascades into nodeChanged
+		self.assertEqual(profiler.signalStats[("GraphNode", "nodeChanged")][0], 1)
+		self.assertGreaterEqual(profiler.maxDepth, 2)
+		self.assertIn(
+			(("GraphNode", "stateChanged"), ("GraphNode", "nodeChanged")),
+			[i[0] for i in profiler.costliestChains()])
+		self.assertIn("max cascade depth", profiler.report())
+
+	def test_graphDirtyState(self):
+		nodes = []
+		for name in "abc":
+			node = GraphNode(name)
+			node.addInput("in")
+			node.addOutput("out")
+			nodes.append(self.graph.addNode(node))
+		a, b, c = nodes
+		self.graph.addEdge(a.getOutput("out"), b.getInput("in"))
+		self.graph.addEdge(b.getOutput("out"), c.getInput("in"))
+		self.assertEqual(self.graph.dirtyNodes, {a, b, c})
+
+		for i in nodes:
+			self.graph.markClean(i)
+		b.getInput("in").value = 5
+		self.assertEqual(self.graph.dirtyNodes, {b, c})
+
+		for i in nodes:
+			self.graph.markClean(i)
+		a.settings.addSetting("mode", value=1)
+		self.assertEqual(self.graph.dirtyNodes, {a, b, c})
+
+		# dirty nodes don't walk their future again
+		walked = []
+		getNodesInFuture = self.graph.getNodesInFuture
+		self.graph.getNodesInFuture = lambda node, *args, **kwargs : \
+			walked.append(node) or getNodesInFuture(node, *args, **kwargs)
+		b.getInput("in").value = 6
+		self.assertEqual(walked, [])
+
 
 
@@ -25,3 +25,17 @@ class TestNode(unittest.TestCase):
 
 
 
+
+	def test_attrResolution(self):
+		node = GraphNode()
+		parentAttr = node.addInput("parentAttr")
+		childAttr = parentAttr.addAttr("childAttr")
+		self.assertIs(childAttr.node, node)
+		self.assertIs(childAttr.attrRoot, node.inputRoot)
+		self.assertEqual(childAttr.role, NodeAttr.Roles.Input)
+
+		# moving attr updates cached resolution
+		childAttr.remove()
+		node.outputRoot.addChild(childAttr)
+		self.assertIs(childAttr.attrRoot, node.outputRoot)
+		self.assertEqual(childAttr.role, NodeAttr.Roles.Output)
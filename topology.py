@@ -0,0 +1,257 @@
+"""plain data structures for maintaining graph topology incrementally -
+these know nothing about attributes or edges, only nodes and
+callables returning their neighbours
+"""
+
+from __future__ import annotations
+import typing as T
+
+if T.TYPE_CHECKING:
+	from treegraph.node import GraphNode
+
+neighbourFnType = T.Callable[["GraphNode"], T.Iterable["GraphNode"]]
+
+
+class TopologicalOrder(object):
+	"""dynamic topological order of nodes, repaired locally
+	whenever an edge is inserted, following Pearce and Kelly -
+	only nodes lying between the new edge's endpoints in the
+	current order are ever visited or moved.
+
+	positions are unique but not contiguous - removing a node leaves
+	a hole, which is compacted away once holes outnumber nodes
+	"""
+
+	def __init__(self):
+		self._positions = {} #type: T.Dict[GraphNode, int]
+		self._nodeAt = [] #type: T.List[T.Optional[GraphNode]]
+
+	def __contains__(self, item):
+		return item in self._positions
+
+	def __len__(self):
+		return len(self._positions)
+
+	def __iter__(self):
+		return (i for i in self._nodeAt if i is not None)
+
+	def clear(self):
+		self._positions.clear()
+		self._nodeAt.clear()
+
+	def add(self, node:GraphNode):
+		"""add node at the end of the order"""
+		if node in self._positions:
+			return
+		self._positions[node] = len(self._nodeAt)
+		self._nodeAt.append(node)
+
+	def remove(self, node:GraphNode):
+		index = self._positions.pop(node, None)
+		if index is None:
+			return
+		self._nodeAt[index] = None
+		if len(self._nodeAt) > 2 * len(self._positions) + 16:
+			self.compact()
+
+	def compact(self):
+		"""close up holes left by removed nodes"""
+		self._nodeAt = [i for i in self._nodeAt if i is not None]
+		self._positions = {node : i for i, node in enumerate(self._nodeAt)}
+
+	def position(self, node:GraphNode)->int:
+		"""return node's position, adding it at the end if unknown"""
+		if node not in self._positions:
+			self.add(node)
+		return self._positions[node]
+
+	def ordered(self, nodes:T.Iterable[GraphNode]=None)->T.List[GraphNode]:
+		"""return given nodes in topological order, or all nodes
+		if none given"""
+		if nodes is None:
+			return list(self)
+		nodes = set(nodes)
+		for i in nodes:
+			self.position(i)
+		# small selections are cheaper to sort than to filter
+		if len(nodes) * 8 < len(self._nodeAt):
+			return sorted(nodes, key=self._positions.__getitem__)
+		return [i for i in self._nodeAt if i in nodes]
+
+	def rebuild(self, nodes:T.Iterable[GraphNode],
+	            successors:neighbourFnType)->T.Set[GraphNode]:
+		"""recompute whole order from scratch with Kahn's algorithm,
+		keeping existing relative order where possible.
+		returns set of nodes that could not be ordered due to cycles -
+		these are appended at the end"""
+		nodes = sorted(set(nodes),
+		               key=lambda x: self._positions.get(x, len(self._nodeAt)))
+		nodeSet = set(nodes)
+		inDegree = {i : 0 for i in nodes}
+		for node in nodes:
+			for i in successors(node):
+				if i in nodeSet:
+					inDegree[i] += 1
+		ready = [i for i in reversed(nodes) if not inDegree[i]]
+		result = []
+		while ready:
+			node = ready.pop()
+			result.append(node)
+			for i in successors(node):
+				if i not in nodeSet:
+					continue
+				inDegree[i] -= 1
+				if not inDegree[i]:
+					ready.append(i)
+		cyclic = nodeSet.difference(result)
+		result.extend(i for i in nodes if i in cyclic)
+		self._nodeAt = result
+		self._positions = {node : i for i, node in enumerate(result)}
+		return cyclic
+
+	def _searchForward(self, start:GraphNode, target:GraphNode,
+	                   upperBound:int, successors:neighbourFnType
+	                   )->T.Optional[T.List[GraphNode]]:
+		"""collect all nodes reachable from start with position
+		below upperBound - returns None if target is reached"""
+		found = [start]
+		visited = {start}
+		toVisit = [start]
+		while toVisit:
+			node = toVisit.pop()
+			for i in successors(node):
+				if i is target:
+					return None
+				if i in visited or self.position(i) > upperBound:
+					continue
+				visited.add(i)
+				found.append(i)
+				toVisit.append(i)
+		return found
+
+	def _searchBackward(self, start:GraphNode, lowerBound:int,
+	                    predecessors:neighbourFnType)->T.List[GraphNode]:
+		"""collect all nodes reaching start with position
+		above lowerBound"""
+		found = [start]
+		visited = {start}
+		toVisit = [start]
+		while toVisit:
+			node = toVisit.pop()
+			for i in predecessors(node):
+				if i in visited or self.position(i) < lowerBound:
+					continue
+				visited.add(i)
+				found.append(i)
+				toVisit.append(i)
+		return found
+
+	def wouldCreateCycle(self, source:GraphNode, dest:GraphNode,
+	                     successors:neighbourFnType)->bool:
+		"""check if edge from source to dest would close a cycle,
+		without changing the order"""
+		if source is dest:
+			return True
+		upperBound = self.position(source)
+		if upperBound < self.position(dest):
+			return False
+		return self._searchForward(
+			dest, source, upperBound, successors) is None
+
+	def insertEdge(self, source:GraphNode, dest:GraphNode,
+	               successors:neighbourFnType,
+	               predecessors:neighbourFnType)->bool:
+		"""repair order for a new edge from source to dest -
+		call BEFORE the edge is visible to successors / predecessors.
+		returns False without changing anything if the edge
+		would create a cycle"""
+		if source is dest:
+			return False
+		lowerBound = self.position(dest)
+		upperBound = self.position(source)
+		if upperBound < lowerBound:
+			return True
+
+		forward = self._searchForward(dest, source, upperBound, successors)
+		if forward is None:
+			return False
+		backward = self._searchBackward(source, lowerBound, predecessors)
+
+		# everything upstream of source moves before everything
+		# downstream of dest, reusing the same pool of positions
+		forward.sort(key=self._positions.__getitem__)
+		backward.sort(key=self._positions.__getitem__)
+		moved = backward + forward
+		pool = sorted(self._positions[i] for i in moved)
+		for node, index in zip(moved, pool):
+			self._positions[node] = index
+			self._nodeAt[index] = node
+		return True
+
+
+class DisjointSet(object):
+	"""union-find over nodes, with union by size and path halving -
+	finding and merging are near constant time.
+	sets can only grow - splitting after a removal needs a rebuild
+	"""
+
+	def __init__(self):
+		self._parents = {} #type: T.Dict[GraphNode, GraphNode]
+		self._sizes = {} #type: T.Dict[GraphNode, int]
+
+	def __contains__(self, item):
+		return item in self._parents
+
+	def __len__(self):
+		return len(self._parents)
+
+	def clear(self):
+		self._parents.clear()
+		self._sizes.clear()
+
+	def add(self, node:GraphNode):
+		"""add node as its own set"""
+		if node in self._parents:
+			return
+		self._parents[node] = node
+		self._sizes[node] = 1
+
+	def find(self, node:GraphNode)->GraphNode:
+		"""return representative node of node's set"""
+		self.add(node)
+		parents = self._parents
+		while parents[node] is not node:
+			parents[node] = parents[parents[node]]
+			node = parents[node]
+		return node
+
+	def union(self, a:GraphNode, b:GraphNode)->GraphNode:
+		"""merge sets of a and b, return new representative"""
+		rootA, rootB = self.find(a), self.find(b)
+		if rootA is rootB:
+			return rootA
+		if self._sizes[rootA] < self._sizes[rootB]:
+			rootA, rootB = rootB, rootA
+		self._parents[rootB] = rootA
+		self._sizes[rootA] += self._sizes.pop(rootB)
+		return rootA
+
+	def rebuild(self, nodes:T.Iterable[GraphNode],
+	            successors:neighbourFnType):
+		"""recompute sets from scratch over nodes"""
+		self.clear()
+		nodes = list(nodes)
+		for node in nodes:
+			self.add(node)
+		for node in nodes:
+			for child in successors(node):
+				self.union(node, child)
+
+	def groups(self, nodes:T.Iterable[GraphNode]=None
+	           )->T.List[T.Set[GraphNode]]:
+		"""return sets of given nodes (or all nodes),
+		grouped by shared representative"""
+		groups = {}
+		for node in (self._parents if nodes is None else nodes):
+			groups.setdefault(self.find(node), set()).add(node)
+		return list(groups.values())
@@ -14,6 +14,7 @@ from PySide2 import QtCore, QtWidgets, QtGui
 # ugly fake imports for type hinting
 if TYPE_CHECKING:
 	from treegraph.ui.view import GraphView
+	from treegraph.graph import BatchChanges
 
 # scene holding visual node graph
 
@@ -72,6 +73,7 @@ class GraphScene(QtWidgets.QGraphicsScene):
 		# tree signal hookups
 		self.graph.structureChanged.connect(self.onNodesChanged)
 		self.graph.edgesChanged.connect(self.onEdgesChanged)
+		self.graph.batchChanged.connect(self.onBatchChanged)
 
 		self.selectionChanged.connect(self.onSceneSelectionChanged)
 
@@ -100,6 +102,8 @@ class GraphScene(QtWidgets.QGraphicsScene):
 		if not isinstance(node, GraphNode):
 			#print("node is not node, skipping")
 			return
+		if self.graph.isBatching: # handled in onBatchChanged
+			return
 		# node created
 		if eventType == Tree.StructureEvents.branchAdded:
 			# print("scene signal node added")
@@ -114,10 +118,29 @@ class GraphScene(QtWidgets.QGraphicsScene):
 			return tile
 
 
+	def onBatchChanged(self, changes:BatchChanges):
+		"""update tiles and pipes for every change in a graph batch,
+		relaxing new tiles together once"""
+		for edge in changes.removedEdges:
+			pipe = self.pipes.get(edge)
+			if pipe:
+				self.deletePipe(pipe)
+		for node in changes.removedNodes:
+			if node in self.tiles:
+				self.deleteTile(node)
+		newTiles = [self.makeTile(abstract=node, relax=False)
+		            for node in changes.addedNodes
+		            if isinstance(node, GraphNode)]
+		self.relaxItems(newTiles, iterations=2)
+		for edge in changes.addedEdges:
+			self.addEdgePipe(edge)
+
 	def onEdgesChanged(self, edge:GraphEdge,
 	                   event=Graph.EdgeEvents.added):
 		"""called when an edge is created or dereferenced in the graph"""
 		print("scene onEdgesChanged")
+		if self.graph.isBatching:
+			return
 		if event == Graph.EdgeEvents.removed:
 			pipe = self.pipes.get(edge)
 			if not pipe:
@@ -144,7 +167,8 @@ class GraphScene(QtWidgets.QGraphicsScene):
 
 	def makeTile(self, abstract:GraphNode=None,
 	             pos:Union[
-		             QtCore.QPoint, QtCore.QPointF, None]=None
+		             QtCore.QPoint, QtCore.QPointF, None]=None,
+	             relax=True
 	             )->NodeDelegate:
 		if isinstance(self.tiles.get(abstract), NodeDelegate):
 			raise RuntimeError("added node already in scene")
@@ -173,7 +197,8 @@ class GraphScene(QtWidgets.QGraphicsScene):
 			tile.setPos(*pos)
 		self.tiles[abstract] = tile
 		#self.addItem(tile.settingsProxy)
-		self.relaxItems([tile], iterations=2)
+		if relax:
+			self.relaxItems([tile], iterations=2)
 		return tile
 
 	def addEdgePipe(self, edge:GraphEdge=None):
@@ -469,8 +469,7 @@ class GraphView(QtWidgets.QGraphicsView):
 			new_pos = QtCore.QPoint(pos.x() - rect.width() / 2,
 			                        pos.y() - rect.height() / 2)
 			self.tabSearch.move(new_pos)
-			self.tabSearch.setValidStrings(
-				list(self.graph.registeredNodeClasses.keys()))
+			self.tabSearch.setValidStrings(self.graph.registeredClassNames)
 			self.tabSearch.setVisible(True)
 			rect = self.mapToScene(rect).boundingRect()
 			self.tabSearch.setFocus()